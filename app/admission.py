@@ -0,0 +1,231 @@
+"""
+/workflow* 路由的准入控制：按客户端限速 + 全局 LLM 并发上限（公平排队）。
+
+单个客户端连续调用 /workflow/generate-orders 会用光 OpenAI 的速率配额，其他人的请求全部排队或失败。
+AdmissionMiddleware 在请求进入线程池之前处理：
+- 客户端按来源 IP 区分；X-API-Key 请求头只有在 CLIENT_API_KEYS 中配置过时才作为客户端身份
+  （未验证的 key 可以随意更换，不能用来区分客户端），每个客户端一个令牌桶
+  （rate_per_s 个 / 秒，容量 burst），令牌不足时直接返回 429 + Retry-After；
+- 全局最多 max_concurrency 个 workflow 请求同时执行（每个请求在执行期间占用一个 LLM 槽位，
+  包括其中的所有 LLM 调用）；超出的请求按客户端分队列、轮流放行，连续请求的客户端
+  只会排在自己的队列里，不会挡住其他客户端；
+- 排队总数达到 max_queue，或排队超过 max_wait_s 时提前返回 429，Retry-After 按最近的平均执行时间估算；
+- 排队深度、执行中数量、等待时间和拒绝次数导出到 /metrics。
+状态都在本进程内存中：客户端令牌桶按 worker 计（keep-alive 客户端固定在一个 worker 上，不分摊）；
+全局并发与排队上限由 main.py 用 per_worker() 按 WEB_CONCURRENCY 平均分给各 worker。
+"""
+import asyncio
+import hashlib
+import json
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, FrozenSet, Optional, Tuple
+
+from app import metrics
+
+
+def per_worker(total: float, workers: int, minimum: float = 1.0) -> float:
+    """全服务上限 -> 单个 worker 的上限；total <= 0（不限制）原样返回。"""
+    if total <= 0 or workers <= 1:
+        return total
+    return max(minimum, total / workers)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """按客户端的令牌桶；take() 返回 0 表示放行，否则返回需要等待的秒数。"""
+
+    def __init__(self, rate_per_s: float, burst: float, max_clients: int = 10000):
+        self.rate = rate_per_s
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # client -> (tokens, updated_at)
+
+    def take(self, client: str, now: Optional[float] = None) -> float:
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1.0:
+            self._buckets[client] = (tokens - 1.0, now)
+            if len(self._buckets) > self.max_clients:
+                self._prune(now)
+            return 0.0
+        self._buckets[client] = (tokens, now)
+        return (1.0 - tokens) / self.rate
+
+    def _prune(self, now: float) -> None:
+        # 已经回满的桶与新建的桶等价，可以丢弃
+        full = [c for c, (t, u) in self._buckets.items() if t + (now - u) * self.rate >= self.burst]
+        for c in full:
+            del self._buckets[c]
+
+
+class FairLimiter:
+    """
+    asyncio 并发上限；等待者按客户端分队列，释放时在客户端之间轮流放行。
+    只在事件循环线程中使用，不需要锁。
+    """
+
+    def __init__(self, limit: int, max_queue: int):
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.active = 0
+        self.waiting = 0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._hold_avg = 0.0  # 最近的平均占用时间（EWMA），用于估算 Retry-After
+
+    def retry_after(self) -> float:
+        return max(1.0, self._hold_avg * (self.waiting + 1) / self.limit)
+
+    async def acquire(self, client: str, timeout: Optional[float] = None) -> float:
+        """取得一个槽位，返回排队时间；队列已满或等待超时抛出 AdmissionRejected。"""
+        if self.active < self.limit and self.waiting == 0:
+            self.active += 1
+            return 0.0
+        if self.waiting >= self.max_queue:
+            raise AdmissionRejected("queue_full", self.retry_after())
+
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client, deque()).append(future)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 槽位已经交给了这个请求，但它不再需要
+                self.release()
+            else:
+                self._discard(client, future)
+            if isinstance(e, asyncio.TimeoutError):
+                raise AdmissionRejected("wait_timeout", self.retry_after())
+            raise
+        return time.perf_counter() - start
+
+    def _discard(self, client: str, future: asyncio.Future) -> None:
+        queue = self._queues.get(client)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.waiting -= 1
+            if not queue:
+                del self._queues[client]
+
+    def release(self, held: Optional[float] = None) -> None:
+        if held is not None:
+            self._hold_avg = held if not self._hold_avg else 0.8 * self._hold_avg + 0.2 * held
+        while self._queues:
+            client, queue = self._queues.popitem(last=False)
+            future = queue.popleft()
+            self.waiting -= 1
+            if queue:
+                self._queues[client] = queue  # 该客户端排到最后
+            if not future.done():
+                future.set_result(None)  # 槽位直接转交，active 不变
+                return
+        self.active -= 1
+
+
+# (CLIENT_API_KEYS 原文, 解析后的集合)
+_api_keys: Tuple[Optional[str], FrozenSet[str]] = (None, frozenset())
+
+
+def _known_api_keys() -> FrozenSet[str]:
+    global _api_keys
+    from .config import settings
+
+    raw = settings.client_api_keys
+    if raw != _api_keys[0]:
+        _api_keys = (raw, frozenset(k.strip() for k in (raw or "").split(",") if k.strip()))
+    return _api_keys[1]
+
+
+def client_key(scope: Dict[str, Any]) -> str:
+    """客户端身份：已配置的 X-API-Key（只保存哈希），否则为来源 IP。"""
+    for name, value in scope.get("headers") or ():
+        if name == b"x-api-key" and value:
+            api_key = value.decode("latin-1")
+            if api_key in _known_api_keys():
+                return "key:" + hashlib.blake2b(api_key.encode("utf-8"), digest_size=8).hexdigest()
+            break
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class AdmissionMiddleware:
+    """纯 ASGI 中间件：只对 path_prefix 下的请求做准入控制。"""
+
+    def __init__(
+        self,
+        app,
+        path_prefix: str = "/api/workflow",
+        rate_per_min: float = 30.0,
+        burst: float = 10.0,
+        max_concurrency: int = 8,
+        max_queue: int = 32,
+        max_wait_s: float = 30.0,
+    ):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.buckets = TokenBucket(rate_per_min / 60.0, burst)
+        self.limiter = FairLimiter(max_concurrency, max_queue)
+        self.max_wait_s = max_wait_s if max_wait_s > 0 else None
+        global _active
+        _active = self
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope.get("path", "").startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+
+        client = client_key(scope)
+        wait = self.buckets.take(client)
+        if wait > 0:
+            await self._reject(send, "rate_limited", wait)
+            return
+        try:
+            waited = await self.limiter.acquire(client, self.max_wait_s)
+        except AdmissionRejected as e:
+            await self._reject(send, e.reason, e.retry_after)
+            return
+        metrics.ADMISSION_WAIT_SECONDS.observe(waited)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release(time.perf_counter() - start)
+
+    @staticmethod
+    async def _reject(send, reason: str, retry_after: float) -> None:
+        metrics.ADMISSION_REJECTED.inc(reason=reason)
+        body = json.dumps({"detail": f"Too many requests ({reason}), retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+# 当前生效的中间件实例（/metrics 读取排队状态）
+_active: Optional[AdmissionMiddleware] = None
+
+
+def stats() -> Dict[str, float]:
+    if _active is None:
+        return {}
+    limiter = _active.limiter
+    return {"active": float(limiter.active), "waiting": float(limiter.waiting), "limit": float(limiter.limit)}
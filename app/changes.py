@@ -0,0 +1,196 @@
+"""
+处方 / 检验申请的增量变更流（GET /changes/{feed}?since=<cursor>）。
+
+门户原来靠反复拉取整张列表来发现状态变化；这里改为只返回游标之后新增 / 修改（以及删除）的行：
+- 变更来自快照之间的行级 diff（RemoteTableClient 的增量回调），本进程的写入会使该表失效，
+  下一次读取变更流时重新验证远端并产生对应的 diff；
+- 游标就是快照版本号（响应体内容哈希），多个 worker 看到同一份远端数据时版本号相同，
+  因此游标可以在 worker 之间通用；
+- 每张表保留最近 retention 个版本的变更；游标过旧、未知，或中间出现无法 diff 的整表重建时
+  返回 reset=true 和当前全部行，客户端用它替换本地列表；
+- wait > 0 时为长轮询：没有新变更就等待（期间每 poll_interval 秒向远端做一次条件请求，
+  本进程写入时立即唤醒），SSE 接口在此基础上循环推送。
+  等待在事件循环中进行（asyncio.Event），不占用线程池；只有每次读取快照时才短暂使用工作线程。
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+import anyio.to_thread
+
+from app import remote, tracing
+from app.records import as_dict
+
+# 对外的 feed 名 -> 表
+FEEDS: Dict[str, str] = {
+    "prescriptions": "prescription_form",
+    "requisitions": "requisition_form",
+}
+
+# 一次版本切换中的变更：[(op, pk, row)]；None 表示中间有整表重建（无法 diff）
+_Changes = Optional[List[Tuple[str, str, Optional[Dict[str, Any]]]]]
+
+
+class ChangeFeed:
+    def __init__(self, table: str, retention: int = 256):
+        self.table = table
+        self._log: Deque[Tuple[str, _Changes]] = deque(maxlen=max(2, retention))
+        self._lock = threading.RLock()
+        # 正在长轮询的请求：(事件循环, 事件)；写入线程通过 call_soon_threadsafe 唤醒
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    # ---- 写入 ----
+
+    def on_delta(self, delta: remote.TableDelta, snap: remote.TableSnapshot) -> None:
+        table = self.table
+        changes = [("insert", remote.row_key(table, r), r) for r in delta.inserted]
+        changes += [("update", remote.row_key(table, r), r) for r in delta.updated]
+        changes += [("delete", pk, None) for pk in delta.deleted]
+        self._append(snap.version, changes)
+
+    def observe(self, snap: remote.TableSnapshot) -> None:
+        """
+        记录读到的快照；版本变化但没有收到 diff（首次加载 / 整表重建）时记为断点。
+        日志中已有的版本（包括其他线程刷新之前取到的旧快照）不再记录。
+        """
+        with self._lock:
+            if not any(version == snap.version for version, _ in self._log):
+                self._append(snap.version, None)
+
+    def _append(self, version: str, changes: _Changes) -> None:
+        with self._lock:
+            if self._log and self._log[-1][0] == version:
+                return
+            self._log.append((version, changes))
+            self._wake()
+
+    def mark_dirty(self) -> None:
+        """本进程写入了该表：唤醒长轮询，让它们重新验证远端。"""
+        with self._lock:
+            self._wake()
+
+    def _wake(self) -> None:
+        # 调用方持有 self._lock
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    # ---- 读取 ----
+
+    def _since(self, cursor: Optional[str]) -> Tuple[str, bool, List[Tuple[str, str, Any]]]:
+        """(最新游标, 是否需要 reset, 合并后的变更)；调用方持有 self._lock。"""
+        latest = self._log[-1][0]
+        if cursor == latest:
+            return latest, False, []
+        entries = list(self._log)
+        # 版本是内容哈希，数据改回原样时同一版本可能出现多次：从最近的一次开始合并
+        for i in range(len(entries) - 1, -1, -1):
+            if entries[i][0] == cursor:
+                merged: Dict[str, Tuple[str, str, Any]] = {}
+                for _, changes in entries[i + 1:]:
+                    if changes is None:
+                        return latest, True, []
+                    for op, pk, row in changes:
+                        previous = merged.pop(pk, None)
+                        # 游标之后新增又修改的行仍是 insert
+                        if previous is not None and previous[0] == "insert" and op == "update":
+                            op = "insert"
+                        merged[pk] = (op, pk, row)
+                return latest, False, list(merged.values())
+        return latest, True, []
+
+    def _poll(self, cursor: Optional[str]) -> Tuple[str, bool, List[Tuple[str, str, Any]]]:
+        """读取（必要时向远端验证）当前快照，返回 cursor 之后的变更；在工作线程中执行。"""
+        snap = remote.client.get_snapshot(self.table)
+        self.observe(snap)
+        with self._lock:
+            return self._since(cursor)
+
+    async def read(self, cursor: Optional[str], wait: float = 0.0, poll_interval: float = 2.0) -> Dict[str, Any]:
+        """
+        返回 {cursor, reset, changes}。wait > 0 时在没有新变更的情况下最多等待 wait 秒。
+        """
+        deadline = time.monotonic() + max(0.0, wait)
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with tracing.span("changes.read", table=self.table, wait=wait) as sp:
+            with self._lock:
+                self._waiters.add(waiter)
+            try:
+                while True:
+                    waiter[1].clear()
+                    latest, reset, changes = await anyio.to_thread.run_sync(self._poll, cursor)
+                    remaining = deadline - time.monotonic()
+                    if cursor is None or reset or latest != cursor or remaining <= 0:
+                        break
+                    # 等待：其他请求读到新快照（_append）、本进程写入（mark_dirty）或到时间再向远端验证
+                    try:
+                        await asyncio.wait_for(waiter[1].wait(), min(remaining, poll_interval))
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                with self._lock:
+                    self._waiters.discard(waiter)
+            if sp is not None:
+                sp.set_attribute("changes", len(changes))
+                sp.set_attribute("reset", reset or cursor is None)
+
+        if reset or cursor is None:
+            snap = await anyio.to_thread.run_sync(remote.client.get_snapshot, self.table)
+            rows = [("upsert", remote.row_key(self.table, r), r) for r in snap.records]
+            return {"cursor": snap.version, "reset": True, "changes": _dump(rows)}
+        return {"cursor": latest, "reset": False, "changes": _dump(changes)}
+
+
+def _dump(changes: List[Tuple[str, str, Any]]) -> List[Dict[str, Any]]:
+    return [{"op": op, "id": pk, "row": as_dict(row)} for op, pk, row in changes]
+
+
+# ---------------- 对外接口 ----------------
+
+_feeds: Dict[str, ChangeFeed] = {}
+_client: Optional[remote.RemoteTableClient] = None
+_lock = threading.Lock()
+
+
+def _on_delta(table: str, delta: remote.TableDelta, snap: remote.TableSnapshot) -> None:
+    feed = _feeds.get(table)
+    if feed is not None:
+        feed.on_delta(delta, snap)
+
+
+def _on_invalidate(table: str) -> None:
+    feed = _feeds.get(table)
+    if feed is not None:
+        feed.mark_dirty()
+
+
+def _attach() -> None:
+    # remote.client 可能被替换（基准测试 / 压测），每次取 feed 时检查
+    global _client
+    client = remote.client
+    if client is not _client:
+        with _lock:
+            if _on_delta not in client._listeners:
+                client.add_listener(_on_delta)
+            if _on_invalidate not in client._invalidate_listeners:
+                client.add_invalidate_listener(_on_invalidate)
+            _client = client
+
+
+def get_feed(name: str) -> Optional[ChangeFeed]:
+    """按 feed 名（prescriptions / requisitions）取变更流；未知名称返回 None。"""
+    table = FEEDS.get(name)
+    if table is None:
+        return None
+    _attach()
+    feed = _feeds.get(table)
+    if feed is None:
+        from .config import settings
+
+        with _lock:
+            feed = _feeds.setdefault(table, ChangeFeed(table, retention=settings.change_feed_retention))
+    return feed
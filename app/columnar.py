@@ -0,0 +1,400 @@
+"""
+大表的列式快照文件（内存映射，只读）。
+
+diagnosis 这类表可能有上百万行；普通 TableSnapshot 在每个 worker 里都持有一份
+「每行一个 dict」的记录列表和索引，常驻内存是 GB 级的。配置 COLUMNAR_TABLES 后，这些表的快照
+改为写成一个列式文件，worker 通过 mmap 直接读取（页缓存在所有 worker 之间共享，不拷贝）：
+
+- 整数列：int64 数组；浮点列：float64 数组；
+- 字符串列：uint64 offsets（n+1 个）+ UTF-8 blob；重复度高的字符串列（诊断编码、日期等）改为字典编码：
+  uint32 编码数组 + 去重后的字符串表（打开文件时解码成一个小列表）；
+  其他类型（bool、嵌套对象等）按 JSON 文本存储在 offsets + blob 中；
+- 每列一个可选的状态数组（uint8：0 有值 / 1 null / 2 该行没有这个字段），全部有值时省略；
+- 主键索引：按主键排序的 int64 键数组 + 行号数组，二分查找；
+- patient_id 索引：去重排序的 patient_id 数组 + 每个 patient 的行号区间（行号按原顺序）。
+
+文件布局：8 字节 magic，8 字节头部长度，JSON 头部（各段相对数据区的偏移与长度），
+按 8 字节对齐的数据区。只有请求真正返回的行才会被还原成 dict。
+"""
+import array
+import bisect
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import remote
+
+MAGIC = b"EHCOL001"
+_INT64_MIN, _INT64_MAX = -(2 ** 63), 2 ** 63 - 1
+
+PRESENT, NULL, MISSING = 0, 1, 2
+
+# 字符串列去重后的取值数不超过行数的 1/4（且不超过 65536）时使用字典编码
+_DICT_MAX_VALUES = 65536
+_DICT_MIN_REPEAT = 4
+
+
+def default_dir() -> str:
+    """未配置 COLUMNAR_DIR 时列式文件所在目录。"""
+    return os.path.join(tempfile.gettempdir(), "ehealth-columnar")
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and _INT64_MIN <= value <= _INT64_MAX
+
+
+def _column_kind(values: List[Any]) -> str:
+    present = [v for v in values if v is not None]
+    if present and all(_is_int(v) for v in present):
+        return "int"
+    if present and all(isinstance(v, float) for v in present):
+        return "float"
+    if all(isinstance(v, str) for v in present):
+        return "str"
+    return "json"
+
+
+class _Writer:
+    """按 8 字节对齐依次追加数据段，记录 (偏移, 长度)。"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.size = 0
+
+    def add(self, data: bytes) -> Tuple[int, int]:
+        offset = self.size
+        self.chunks.append(data)
+        self.size += len(data)
+        pad = -self.size % 8
+        if pad:
+            self.chunks.append(b"\0" * pad)
+            self.size += pad
+        return offset, len(data)
+
+
+def _encode_blob(writer: _Writer, texts: List[Optional[str]]) -> Dict[str, Any]:
+    offsets = array.array("Q", [0])
+    parts = []
+    total = 0
+    for text in texts:
+        if text:
+            data = text.encode("utf-8")
+            parts.append(data)
+            total += len(data)
+        offsets.append(total)
+    return {"offsets": writer.add(offsets.tobytes()), "blob": writer.add(b"".join(parts))}
+
+
+def write(path: str, table: str, version: str, records: List[Dict[str, Any]], pk: str) -> None:
+    """把记录列表写成列式文件（先写临时文件再原子替换，读者不会看到写了一半的文件）。"""
+    names: Dict[str, None] = {}
+    for rec in records:
+        for name in rec:
+            names.setdefault(name, None)
+
+    writer = _Writer()
+    columns = []
+    for name in names:
+        values = [rec.get(name) for rec in records]
+        states = array.array("B", (PRESENT if v is not None else NULL if name in rec else MISSING
+                                   for v, rec in zip(values, records)))
+        kind = _column_kind(values)
+        column: Dict[str, Any] = {"name": name, "kind": kind, "state": None}
+        if any(states):
+            column["state"] = writer.add(states.tobytes())
+        if kind == "int":
+            column["data"] = writer.add(array.array("q", (v if v is not None else 0 for v in values)).tobytes())
+        elif kind == "float":
+            column["data"] = writer.add(array.array("d", (v if v is not None else 0.0 for v in values)).tobytes())
+        elif kind == "str":
+            words = {v: None for v in values if v is not None}
+            if len(words) <= _DICT_MAX_VALUES and len(words) * _DICT_MIN_REPEAT <= len(values):
+                codes = {w: n for n, w in enumerate(words)}
+                column["kind"] = "dict"
+                column["codes"] = writer.add(array.array("I", (codes.get(v, 0) for v in values)).tobytes())
+                column.update(_encode_blob(writer, list(words)))
+            else:
+                column.update(_encode_blob(writer, values))
+        else:
+            column.update(_encode_blob(writer, [
+                json.dumps(v, ensure_ascii=False, separators=(",", ":")) if v is not None else None for v in values
+            ]))
+        columns.append(column)
+
+    header: Dict[str, Any] = {
+        "table": table, "version": version, "pk": pk, "rows": len(records),
+        "columns": columns, "pk_index": None, "patient_index": None,
+    }
+
+    pk_values = [rec.get(pk) for rec in records]
+    if records and all(_is_int(v) for v in pk_values):
+        order = sorted(range(len(records)), key=lambda i: pk_values[i])
+        header["pk_index"] = {
+            "keys": writer.add(array.array("q", (pk_values[i] for i in order)).tobytes()),
+            "rows": writer.add(array.array("I", order).tobytes()),
+        }
+
+    pids = [rec.get("patient_id") for rec in records]
+    if "patient_id" in names and all(v is None or _is_int(v) for v in pids):
+        groups: Dict[int, List[int]] = {}
+        for i, pid in enumerate(pids):
+            if pid is not None:
+                groups.setdefault(pid, []).append(i)
+        keys = sorted(groups)
+        starts = array.array("I", [0])
+        rows = array.array("I")
+        for key in keys:
+            rows.extend(groups[key])
+            starts.append(len(rows))
+        header["patient_index"] = {
+            "keys": writer.add(array.array("q", keys).tobytes()),
+            "starts": writer.add(starts.tobytes()),
+            "rows": writer.add(rows.tobytes()),
+        }
+
+    head = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    head += b" " * (-(len(MAGIC) + 8 + len(head)) % 8)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(head)))
+        f.write(head)
+        for chunk in writer.chunks:
+            f.write(chunk)
+    os.replace(tmp, path)
+
+
+class _Column:
+    def __init__(self, meta: Dict[str, Any], section, mm: mmap.mmap, base: int):
+        self.name = meta["name"]
+        self.kind = meta["kind"]
+        self.state = section(meta["state"], "B") if meta["state"] else None
+        if self.kind in ("int", "float"):
+            self.value = section(meta["data"], "q" if self.kind == "int" else "d").__getitem__
+            return
+
+        offsets = section(meta["offsets"], "Q")
+        start = base + meta["blob"][0]
+
+        def text(i: int) -> str:
+            # 直接从 mmap 切片解码，比经过 memoryview 更快
+            return mm[start + offsets[i]: start + offsets[i + 1]].decode("utf-8")
+
+        if self.kind == "dict":
+            words = [text(n) for n in range(len(offsets) - 1)]
+            codes = section(meta["codes"], "I")
+            self.value = lambda i: words[codes[i]]
+        elif self.kind == "str":
+            self.value = text
+        else:
+            self.value = lambda i: json.loads(text(i))
+
+
+class ColumnarTable:
+    """一个已打开的列式文件。数组都是 mmap 上的 memoryview，不会拷贝到进程堆上。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a columnar snapshot file")
+        (head_len,) = struct.unpack_from("<Q", buf, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(buf[start:start + head_len]))
+        base = start + head_len
+
+        def section(span, fmt):
+            offset, length = span
+            view = buf[base + offset: base + offset + length]
+            return view.cast(fmt) if fmt else view
+
+        self.table: str = header["table"]
+        self.version: str = header["version"]
+        self.pk: str = header["pk"]
+        self.rows: int = header["rows"]
+        self.columns = [_Column(meta, section, self._mmap, base) for meta in header["columns"]]
+        self._by_name = {c.name: c for c in self.columns}
+
+        pk_index = header["pk_index"]
+        self._pk_keys = section(pk_index["keys"], "q") if pk_index else None
+        self._pk_rows = section(pk_index["rows"], "I") if pk_index else None
+        patient_index = header["patient_index"]
+        self._pid_keys = section(patient_index["keys"], "q") if patient_index else None
+        self._pid_starts = section(patient_index["starts"], "I") if patient_index else None
+        self._pid_rows = section(patient_index["rows"], "I") if patient_index else None
+        # 没有整数索引时（主键 / patient_id 不是整数）按需建的字典索引
+        self._pk_fallback: Optional[Dict[str, int]] = None
+        self._pid_fallback: Optional[Dict[Any, List[int]]] = None
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def row(self, i: int) -> Dict[str, Any]:
+        """把第 i 行还原成 dict（每次调用都返回新对象，调用方可以随意修改）。"""
+        rec = {}
+        for col in self.columns:
+            if col.state is None:
+                rec[col.name] = col.value(i)
+                continue
+            state = col.state[i]
+            if state == PRESENT:
+                rec[col.name] = col.value(i)
+            elif state == NULL:
+                rec[col.name] = None
+        return rec
+
+    def value(self, i: int, name: str) -> Any:
+        """只读取第 i 行的某一列（不存在或为 null 时返回 None）。"""
+        col = self._by_name.get(name)
+        if col is None or (col.state is not None and col.state[i] != PRESENT):
+            return None
+        return col.value(i)
+
+    def find_pk(self, pk: Any) -> Optional[int]:
+        """主键对应的行号；主键重复时与 TableSnapshot 一致取最后一行。"""
+        if self._pk_keys is not None:
+            try:
+                key = int(str(pk))
+            except ValueError:
+                return None
+            pos = bisect.bisect_right(self._pk_keys, key) - 1
+            if pos >= 0 and self._pk_keys[pos] == key:
+                return self._pk_rows[pos]
+            return None
+        if self._pk_fallback is None:
+            index = {}
+            for i in range(self.rows):
+                key = remote.row_key(self.table, {self.pk: self.value(i, self.pk), "id": self.value(i, "id")})
+                if key is not None:
+                    index[key] = i
+            self._pk_fallback = index
+        return self._pk_fallback.get(str(pk))
+
+    def patient_rows(self, patient_id: Any) -> Sequence[int]:
+        if self._pid_keys is not None:
+            if not _is_int(patient_id):
+                return ()
+            pos = bisect.bisect_left(self._pid_keys, patient_id)
+            if pos < len(self._pid_keys) and self._pid_keys[pos] == patient_id:
+                return self._pid_rows[self._pid_starts[pos]:self._pid_starts[pos + 1]]
+            return ()
+        if self._pid_fallback is None:
+            index: Dict[Any, List[int]] = {}
+            if "patient_id" in self._by_name:
+                for i in range(self.rows):
+                    pid = self.value(i, "patient_id")
+                    if pid is not None:
+                        index.setdefault(pid, []).append(i)
+            self._pid_fallback = index
+        return self._pid_fallback.get(patient_id, ())
+
+    def max_int_pk(self) -> Optional[int]:
+        if self._pk_keys is None:
+            return None
+        return self._pk_keys[-1] if len(self._pk_keys) else 0
+
+
+class RowSequence(Sequence):
+    """按需还原的行序列：len / 下标 / 切片 / 迭代，切片返回 dict 列表。"""
+
+    def __init__(self, table: ColumnarTable):
+        self._table = table
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._table.row(i) for i in range(*index.indices(len(self._table)))]
+        if index < 0:
+            index += len(self._table)
+        if not 0 <= index < len(self._table):
+            raise IndexError(index)
+        return self._table.row(index)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self._table)):
+            yield self._table.row(i)
+
+
+class ColumnarSnapshot(remote.TableSnapshot):
+    """
+    以列式文件为存储的 TableSnapshot：接口与普通快照相同（records / get / rows_for_patient /
+    max_numeric_pk / cached），但不持有 dict 列表和字典索引。
+    不支持按行增量合并：表内容变化时整表重新生成文件，也不通知增量订阅者。
+    """
+
+    def __init__(
+        self,
+        data: ColumnarTable,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ):
+        super().__init__(
+            data.table, RowSequence(data), data.version, etag=etag, last_modified=last_modified,
+            by_pk={}, by_patient={},
+        )
+        self.data = data
+
+    def get(self, pk: Any) -> Optional[Dict[str, Any]]:
+        i = self.data.find_pk(pk)
+        return self.data.row(i) if i is not None else None
+
+    def rows_for_patient(self, patient_id: Any) -> List[Dict[str, Any]]:
+        return [self.data.row(i) for i in self.data.patient_rows(patient_id)]
+
+    def max_numeric_pk(self) -> int:
+        if self._max_numeric_pk is None:
+            max_id = self.data.max_int_pk()
+            if max_id is None:
+                max_id = 0
+                for i in range(len(self.data)):
+                    try:
+                        max_id = max(max_id, int(str(self.data.value(i, self.data.pk))))
+                    except (TypeError, ValueError):
+                        continue
+            self._max_numeric_pk = max(max_id, 0)
+        return self._max_numeric_pk
+
+
+class ColumnarStore:
+    """
+    某个目录下的列式快照文件：<dir>/<table>.<version>.col。
+    文件名由内容版本决定，多个 worker（以及重启后的进程）可以直接复用已经生成的文件。
+    """
+
+    def __init__(self, directory: str, tables: Sequence[str]):
+        self.directory = directory
+        self.tables = set(tables)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, table: str, version: str) -> str:
+        return os.path.join(self.directory, f"{table}.{version}.col")
+
+    def open(self, table: str, version: str) -> Optional[ColumnarTable]:
+        try:
+            return ColumnarTable(self.path(table, version))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def build(self, table: str, version: str, records: List[Dict[str, Any]]) -> ColumnarTable:
+        path = self.path(table, version)
+        write(path, table, version, records, remote.PRIMARY_KEYS.get(table, "id"))
+        self._remove_old(table, keep=path)
+        return ColumnarTable(path)
+
+    def _remove_old(self, table: str, keep: str) -> None:
+        # 已 mmap 旧文件的 worker 不受影响（POSIX 上删除只是解除目录项）
+        prefix = f"{table}."
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(prefix) and name.endswith(".col") and path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -1,8 +1,148 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
-    openai_api_key: str  # For environment variable OPENAI_API_KEY
+    # For environment variable OPENAI_API_KEY; only needed when LLM_PROVIDER=openai
+    openai_api_key: Optional[str] = None
+
+    # LLM backend: "openai" (default) or "fake" (local deterministic provider, see app/llm_provider.py)
+    llm_provider: str = "openai"
+    # Fake provider tuning: latency (ms), distribution (fixed/normal/lognormal/uniform) and failure injection
+    llm_fake_latency_ms: float = 0.0
+    llm_fake_jitter_ms: float = 0.0
+    llm_fake_latency_dist: str = "fixed"
+    llm_fake_failure_rate: float = 0.0
+    llm_fake_failure_modes: str = "error"  # comma separated: error,timeout,no_tool_call,bad_json
+    llm_fake_seed: int = 0
+    # Per-model fake latency overriding LLM_FAKE_LATENCY_MS, e.g. "gpt-4.1-mini=900,gpt-4.1-nano=250"
+    llm_fake_model_latency_ms: str = ""
+
+    # Model routing (app/model_router.py): default model, per-tool overrides ("tool_name=model,..."),
+    # an optional faster fallback used while the routed model's rolling p95 latency is over
+    # LLM_LATENCY_BUDGET_S (empty LLM_FALLBACK_MODEL or a 0 budget disables), and an optional cheaper
+    # model for "complete" calls whose form is missing at most LLM_SIMPLE_MAX_MISSING editable fields
+    # (empty LLM_CHEAP_MODEL disables)
+    llm_default_model: str = "gpt-4.1-mini"
+    llm_tool_models: str = ""
+    llm_fallback_model: str = ""
+    llm_latency_budget_s: float = 20.0
+    llm_cheap_model: str = ""
+    llm_simple_max_missing: int = 2
+    llm_route_window_s: float = 300.0
+    llm_route_min_samples: int = 10
+    # Skip the LLM in the "complete" tools when the form is already complete and neither it nor the latest
+    # diagnosis changed since the last completion (fingerprints kept in memory, app/precheck.py)
+    completion_precheck: bool = True
+    completion_precheck_max_entries: int = 10000
+    # Diagnosis-to-order templates for generate-orders (app/order_templates.py): learned from prescriptions and
+    # requisitions clinicians submit for faxing (regimen fields only, no prescriber or free text) and reused
+    # without an LLM call once ORDER_TEMPLATE_MIN_SUPPORT sent orders agreed and the description matches with
+    # Jaccard similarity >= ORDER_TEMPLATE_MIN_SIMILARITY; off by default; SQLite file defaults to the temp directory
+    order_templates: bool = False
+    order_template_path: str = ""
+    order_template_max: int = 2000
+    order_template_min_support: int = 2
+    order_template_min_similarity: float = 0.9
+    order_template_ttl_days: float = 90.0
+
+    # LLM record/replay (app/llm_cassette.py): off / record / replay / replay_or_record
+    llm_cassette_mode: str = "off"
+    llm_cassette_path: str = "llm_cassette.jsonl.gz"
+    llm_cassette_strict: bool = False          # replay: require an exact fingerprint match
+    llm_cassette_replay_latency: bool = False  # replay: sleep for the recorded latency
+
+    # Local database (app/database.py, currently unused by the API); the engine is created on first use
+    database_url: str = "sqlite:///./app.db"
+
+    # Startup: tables to load (and index) in the lifespan hook, comma separated,
+    # e.g. "pharmacy_registration,lab_registration,patients_registration"
+    prewarm_tables: str = ""
+    prewarm_blocking: bool = False  # wait for prewarming / the first refresh before accepting requests
+    # Background refresher (app/refresher.py): tables kept warm and revalidated every
+    # interval ± jitter seconds, served stale-while-revalidate; empty (default) disables it,
+    # e.g. "pharmacy_registration,lab_registration,patients_registration"
+    refresh_tables: str = ""
+    refresh_interval_s: float = 30.0
+    refresh_jitter_s: float = 5.0
+    # `python main.py` auto-reload; set RELOAD=false outside development
+    reload: bool = True
+    # Production: number of uvicorn worker processes (uvicorn's CLI reads WEB_CONCURRENCY too).
+    # With more than one worker, remote table bodies are shared through a SQLite store
+    # (app/shared_cache.py) at SHARED_CACHE_PATH (default: a file in the temp directory)
+    web_concurrency: int = 1
+    shared_cache_path: str = ""
+    shared_cache_ttl_s: float = 5.0  # how long a body fetched by one worker may be reused by the others
+    # Large tables kept as memory-mapped columnar files (app/columnar.py) instead of in-process dicts,
+    # comma separated, e.g. "diagnosis"; files live in COLUMNAR_DIR (default: a temp directory)
+    columnar_tables: str = ""
+    columnar_dir: str = ""
+    # Batch create endpoints (POST /prescriptions/batch, /requisitions/batch): max items per request,
+    # concurrent single-row POSTs, or one POST with the whole list if the remote API accepts lists
+    batch_max_items: int = 500
+    batch_write_concurrency: int = 8
+    remote_bulk_insert: bool = False
+    # Fax dispatch (app/fax.py): persistent SQLite queue (default: a file in the temp directory) and the
+    # gateway transport: "loopback" (log only) or "file" (one text file per batch in FAX_OUTBOX_DIR)
+    fax_queue_path: str = ""
+    fax_transport: str = "loopback"
+    fax_outbox_dir: str = ""
+    fax_workers: int = 4             # render pool size
+    fax_batch_max: int = 20          # max forms per batch to one pharmacy / lab
+    fax_max_attempts: int = 5
+    fax_retry_backoff_s: float = 2.0  # doubled after every failed attempt
+    fax_poll_interval_s: float = 1.0
+    # The dispatcher thread starts on the first enqueue; enable to start it with the service so jobs
+    # left in the queue by a previous run are sent without waiting for a new submission
+    fax_dispatch_on_startup: bool = False
+    # Rendered fax documents (app/documents.py): content-hashed PDF cache directory (default: a temp
+    # directory) and the size of the render process pool
+    document_cache_dir: str = ""
+    document_workers: int = 2
+    # Change feeds (GET /changes/{prescriptions|requisitions}): snapshot versions kept per table, how often a
+    # waiting long-poll / SSE client revalidates the remote table, and the longest allowed wait
+    change_feed_retention: int = 256
+    change_feed_poll_s: float = 2.0
+    change_feed_max_wait_s: float = 30.0
+    # Remote table resilience (app/resilience.py): per-table circuit breaker, hedged GETs (a second request
+    # once the first exceeds the table's recent p95 latency) and bounded retries; when a read fails and a
+    # snapshot is already cached, the last good snapshot is served instead
+    remote_resilience: bool = True
+    remote_get_timeout_s: float = 60.0  # same as the client-wide TIMEOUT: first loads of large tables are slow
+    remote_retries: int = 2
+    remote_retry_backoff_s: float = 0.2
+    remote_hedge: bool = True
+    circuit_failure_threshold: int = 5
+    circuit_reset_s: float = 30.0
+    remote_stale_wait_s: float = 2.0  # how long a read waits on an in-flight refresh before serving stale
+    # Admission control for /api/workflow* (app/admission.py): per-client token bucket (X-API-Key header, else
+    # client IP), a global limit on concurrent LLM workflows with a fair per-client queue, and early 429s
+    # with Retry-After once the queue is full or a request has waited too long. Off by default: deployments opt in.
+    # The per-client rate limit applies per worker process (a keep-alive client stays on one worker).
+    # LLM_MAX_CONCURRENCY and ADMISSION_MAX_QUEUE are service-wide: each worker enforces its share
+    # (divided by WEB_CONCURRENCY, at least 1)
+    admission_enabled: bool = False
+    rate_limit_per_min: float = 30.0  # per client and worker; 0 disables rate limiting
+    rate_limit_burst: float = 10.0
+    llm_max_concurrency: int = 8      # whole service
+    admission_max_queue: int = 32     # whole service
+    # X-API-Key values accepted as a client identity (comma separated); requests without one of these keys are
+    # identified by client IP, both here and for Idempotency-Key scoping
+    client_api_keys: str = ""
+    admission_max_wait_s: float = 30.0
+    # Idempotency-Key support for POST endpoints (app/idempotency.py): responses are kept in a local SQLite
+    # store (default: a file in the temp directory) for IDEMPOTENCY_TTL_S; a duplicate that arrives while the
+    # first request is still running waits up to IDEMPOTENCY_WAIT_S for its response
+    idempotency_enabled: bool = True
+    idempotency_store_path: str = ""
+    idempotency_ttl_s: float = 86400.0
+    idempotency_wait_s: float = 60.0
+    # Keep cached rows as __slots__ record objects with interned strings (app/records.py) instead of dicts
+    compact_records: bool = False
+
+    # Tracing: JSON traces are appended to this file (env TRACE_FILE); disabled when empty
+    trace_file: Optional[str] = None
 
     model_config = SettingsConfigDict(
         env_file=".env",          # For loading environment variables from a .env file in local development
@@ -1,56 +1,134 @@
-import requests
-from typing import Any, Dict, List, Optional
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 from . import schemas
+from . import documents, remote, tracing
+from .records import Record, as_dicts
+# 远端表配置与解析工具已移至 app/remote.py，这里保留旧的导入路径
+from .remote import REMOTE_TABLES, TIMEOUT, _extract_records
 import json
 from math import radians, sin, cos, sqrt, atan2
 
-# 远端表 URL 映射
-REMOTE_TABLES = {
-    "patients_registration": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/patients_registration",
-    "diagnosis": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/diagnosis",
-    "patient_preference": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/patient_preference",
-    "prescription_form": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/prescription_form",
-    "requisition_form": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/requisition_form",
-    "pharmacy_registration": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/pharmacy_registration",
-    "lab_registration": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/lab_registration",
-}
 
-TIMEOUT = 60  # seconds. Increased to handle long-running AI workflows.
+# 一次组合查询内固定使用的快照（见 get_patient_context）：同一张表只读取一次，各部分看到同一版本
+_pinned_snapshots: contextvars.ContextVar[Optional[Dict[str, remote.TableSnapshot]]] = contextvars.ContextVar(
+    "pinned_snapshots", default=None
+)
+
+
+def _get_snapshot(table: str) -> remote.TableSnapshot:
+    """读取某张表的最新快照（条件请求 + 增量更新，见 app/remote.py）。"""
+    pinned = _pinned_snapshots.get()
+    if pinned is not None and table in pinned:
+        return pinned[table]
+    return remote.client.get_snapshot(table)
+
 
+def _get_remote(table: str) -> List[Dict[str, Any]]:
+    return _get_snapshot(table).records
 
-def _get_remote(table: str) -> Dict[str, Any]:
-    url = REMOTE_TABLES[table]
-    resp = requests.get(url, timeout=TIMEOUT)
-    resp.raise_for_status()
-    return resp.json()
+
+@contextmanager
+def pinned_snapshots(tables: Iterable[str]) -> Iterator[Dict[str, remote.TableSnapshot]]:
+    """
+    读取各表快照（多张表时并发）并在 with 块内固定使用，返回 表 -> 快照。
+    块内的查询都基于这些快照；调用方用它们的版本号计算 ETag，ETag 与响应体来自同一版本。
+    外层已固定的表直接复用。
+    """
+    tables = list(dict.fromkeys(tables))
+    current = _pinned_snapshots.get() or {}
+    missing = [t for t in tables if t not in current]
+    with tracing.span("crud.snapshot_gather", tables=len(missing)):
+        if len(missing) > 1:
+            with ThreadPoolExecutor(max_workers=len(missing), thread_name_prefix="context") as pool:
+                snapshots = list(pool.map(tracing.wrap(_get_snapshot), missing))
+        else:
+            snapshots = [_get_snapshot(table) for table in missing]
+    pinned = {**current, **dict(zip(missing, snapshots))}
+    token = _pinned_snapshots.set(pinned)
+    try:
+        yield {table: pinned[table] for table in tables}
+    finally:
+        _pinned_snapshots.reset(token)
+
+
+def _row_dict(rec: Any) -> Optional[Dict[str, Any]]:
+    """快照中的一行 -> 调用方可以修改的普通 dict（紧凑记录转回 dict）。"""
+    if rec is None:
+        return None
+    return rec.to_dict() if isinstance(rec, Record) else dict(rec)
 
 
 def _post_remote(table: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    url = REMOTE_TABLES[table]
-    resp = requests.post(url, json=payload, timeout=TIMEOUT)
-    resp.raise_for_status()
-    return resp.json()
+    return remote.client.post(table, payload)
 
 
 def _put_remote(table: str, record_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     """
     使用 PUT 方法更新远端服务器上的现有记录。
     """
-    url = f"{REMOTE_TABLES[table]}/{record_id}"
-    resp = requests.put(url, json=payload, timeout=TIMEOUT)
-    resp.raise_for_status()
-    # PUT 请求成功后，远端 API 可能返回空内容或确认消息，
-    # 我们直接返回我们发送的 payload 作为确认。
-    return payload
+    return remote.client.put(table, record_id, payload)
+
+
+# 本进程已经分配出去的最大 ID（写入远端、快照刷新之前，快照里的最大主键还看不到它们）
+_allocated_ids: Dict[str, int] = {}
+_allocate_lock = threading.Lock()
+
+
+def _allocate_ids(table: str, count: int) -> List[str]:
+    """
+    一次分配 count 个连续的自增 ID：起点为「快照最大数值主键」与「之前已分配的 ID」中较大者 + 1。
+    并发创建不会拿到相同的 ID；多 worker 时通过共享存储（app/shared_cache.py）预留。
+    """
+    with tracing.span("crud.allocate_id", table=table, count=count):
+        max_id = _get_snapshot(table).max_numeric_pk()
+        shared = remote.client.shared
+        if shared is not None:
+            start = shared.reserve_ids(table, max_id + 1, count)
+        else:
+            with _allocate_lock:
+                start = max(max_id, _allocated_ids.get(table, 0)) + 1
+                _allocated_ids[table] = start + count - 1
+    return [str(start + i) for i in range(count)]
 
 
-def _extract_records(data: Any) -> List[Dict[str, Any]]:
-    """统一从远端响应中提取记录列表."""
-    if isinstance(data, dict) and "data" in data:
-        records = data["data"]
-    else:
-        records = data
-    return records if isinstance(records, list) else []
+def _next_numeric_id(table: str) -> str:
+    """基于最新快照的最大数值主键生成下一个自增 ID."""
+    return _allocate_ids(table, 1)[0]
+
+
+def _create_batch(table: str, id_field: str, items: List[Any]) -> List[Dict[str, Any]]:
+    """
+    批量创建：一次分配连续的 ID 段，再批量写入远端（见 RemoteTableClient.post_many）。
+    返回逐条结果 {index, status: "created" | "error", <id_field>, error}。
+    """
+    from .config import settings
+
+    if not items:
+        return []
+    ids = _allocate_ids(table, len(items))
+    payloads = []
+    for obj_in, new_id in zip(items, ids):
+        payload = obj_in.dict()
+        payload[id_field] = new_id
+        payloads.append(payload)
+
+    with tracing.span("crud.create_batch", table=table, items=len(items)):
+        errors = remote.client.post_many(
+            table,
+            payloads,
+            concurrency=settings.batch_write_concurrency,
+            bulk=settings.remote_bulk_insert,
+        )
+    results = []
+    for index, (payload, error) in enumerate(zip(payloads, errors)):
+        if error is None:
+            results.append({"index": index, "status": "created", id_field: payload[id_field], "error": None})
+        else:
+            results.append({"index": index, "status": "error", id_field: None, "error": f"{type(error).__name__}: {error}"})
+    return results
 
 
 # --- 新增：地理位置计算辅助函数 ---
@@ -92,6 +170,41 @@ def _haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> f
     return distance
 
 
+def _parsed_address(snap: remote.TableSnapshot, rec: Dict[str, Any], field: str = "address"):
+    """带快照行级缓存的 _parse_address_with_coords：同一行在快照版本内只解析一次。"""
+    key = remote.row_key(snap.table, rec)
+    if key is None:
+        return _parse_address_with_coords(rec.get(field))
+    return snap.cached(f"parsed:{field}", key, lambda: _parse_address_with_coords(rec.get(field)))
+
+
+# 预热时除了加载快照，还要预先解析的地址字段（最近药店/实验室查询会用到）
+_PREWARM_ADDRESS_FIELDS = {
+    "pharmacy_registration": "address",
+    "lab_registration": "address",
+    "patients_registration": "contact_info",
+}
+
+
+def warm_snapshot(snap: remote.TableSnapshot) -> None:
+    """填充快照的派生缓存（地址解析）；增量更新后只有变化的行需要重新解析。"""
+    field = _PREWARM_ADDRESS_FIELDS.get(snap.table)
+    if field:
+        for rec in snap.records:
+            _parsed_address(snap, rec, field)
+
+
+def prewarm_tables(tables: List[str]) -> Dict[str, int]:
+    """加载并索引指定的表，同时填充地址解析缓存；返回每张表的行数。"""
+    loaded: Dict[str, int] = {}
+    for table in tables:
+        with tracing.span("crud.prewarm", table=table):
+            snap = _get_snapshot(table)
+            warm_snapshot(snap)
+        loaded[table] = len(snap.records)
+    return loaded
+
+
 # ---------------- Patients ----------------
 
 def create_patient(obj_in: schemas.PatientsRegistrationCreate) -> Dict[str, Any]:
@@ -100,18 +213,13 @@ def create_patient(obj_in: schemas.PatientsRegistrationCreate) -> Dict[str, Any]
 
 
 def get_patients(skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-    data = _get_remote("patients_registration")
-    records = _extract_records(data)
-    return records[skip: skip + limit]
+    records = _get_remote("patients_registration")
+    return as_dicts(records[skip: skip + limit])
 
 
 def get_patient(patient_id: int) -> Optional[Dict[str, Any]]:
-    data = _get_remote("patients_registration")
-    records = _extract_records(data)
-    for rec in records:
-        if rec.get("patient_id") == patient_id or rec.get("id") == patient_id:
-            return rec
-    return None
+    rec = _get_snapshot("patients_registration").get(patient_id)
+    return _row_dict(rec)
 
 
 # ---------------- Diagnosis ----------------
@@ -122,26 +230,18 @@ def create_diagnosis(obj_in: schemas.DiagnosisCreate) -> Dict[str, Any]:
 
 
 def get_diagnoses(skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-    data = _get_remote("diagnosis")
-    records = _extract_records(data)
-    return records[skip: skip + limit]
+    records = _get_remote("diagnosis")
+    return as_dicts(records[skip: skip + limit])
 
 
 def get_diagnosis(diagnosis_id: int):
-    data = _get_remote("diagnosis")
-    records = _extract_records(data)
-    if not isinstance(records, list):
-        return None
-    for rec in records:
-        if rec.get("diagnosis_id") == diagnosis_id or rec.get("id") == diagnosis_id:
-            return rec
+    rec = _get_snapshot("diagnosis").get(diagnosis_id)
+    return _row_dict(rec)
 
 
 def get_diagnoses_by_patient(patient_id: int) -> List[Dict[str, Any]]:
     """返回某个 patient 的全部 diagnosis."""
-    data = _get_remote("diagnosis")
-    records = _extract_records(data)
-    return [r for r in records if r.get("patient_id") == patient_id]
+    return as_dicts(_get_snapshot("diagnosis").rows_for_patient(patient_id))
 
 
 def get_latest_diagnosis_by_patient(patient_id: int) -> Optional[Dict[str, Any]]:
@@ -154,7 +254,7 @@ def get_latest_diagnosis_by_patient(patient_id: int) -> Optional[Dict[str, Any]]
         return (r.get("diagnosis_date") or "", r.get("diagnosis_id") or 0)
 
     records.sort(key=_key, reverse=True)
-    return records[0]
+    return _row_dict(records[0])
 
 
 # ---------------- Patient Preference ----------------
@@ -165,19 +265,13 @@ def create_preference(obj_in: schemas.PatientPreferenceCreate) -> Dict[str, Any]
 
 
 def get_preferences(skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-    data = _get_remote("patient_preference")
-    records = _extract_records(data)
-    return records[skip: skip + limit]
+    records = _get_remote("patient_preference")
+    return as_dicts(records[skip: skip + limit])
 
 
 def get_preferences_by_patient_and_type(patient_id: int, preference_type: str) -> List[Dict[str, Any]]:
-    data = _get_remote("patient_preference")
-    records = _extract_records(data)
-    return [
-        r
-        for r in records
-        if r.get("patient_id") == patient_id and r.get("preference_type") == preference_type
-    ]
+    records = _get_snapshot("patient_preference").rows_for_patient(patient_id)
+    return as_dicts(r for r in records if r.get("preference_type") == preference_type)
 
 
 # 新增：专门获取 pharmacy 偏好
@@ -199,11 +293,12 @@ def get_lab_preferences_by_patient(patient_id: int) -> List[Dict[str, Any]]:
 # 新增：获取详细的偏好药店信息
 def get_detailed_pharmacy_preferences(patient_id: int) -> List[Dict[str, Any]]:
     """获取病人的偏好药店，并附带完整的药店详情和距离。"""
-    patient = get_patient(patient_id)
+    patient_snap = _get_snapshot("patients_registration")
+    patient = patient_snap.get(patient_id)
     if not patient:
         return []
 
-    _, patient_coords = _parse_address_with_coords(patient.get("contact_info"))
+    _, patient_coords = _parsed_address(patient_snap, patient, "contact_info")
 
     preferences = get_pharmacy_preferences_by_patient(patient_id)
     detailed_preferences = []
@@ -238,26 +333,12 @@ def get_detailed_pharmacy_preferences(patient_id: int) -> List[Dict[str, Any]]:
 
 # ---------------- Prescription ----------------
 
+@tracing.traced()
 def create_prescription(obj_in: schemas.PrescriptionFormCreate) -> Dict[str, Any]:
     """生成自增 prescription_id 并调用远端 POST."""
 
-    # 步骤 1: 读取所有数据
-    data = _get_remote("prescription_form") # <-- 第一次网络请求 (GET)
-    records = _extract_records(data)
-
-    # 步骤 2: 在本地计算下一个 ID
-    max_id = 0
-    for r in records:
-        rid = r.get("prescription_id") or r.get("id")
-        if rid is None:
-            continue
-        try:
-            rid_int = int(rid)
-        except (TypeError, ValueError):
-            continue
-        max_id = max(max_id, rid_int)
-
-    new_id = str(max_id + 1 if max_id > 0 else 1)
+    # 步骤 1 + 2: 读取最新快照（条件请求），基于缓存的最大主键计算下一个 ID
+    new_id = _next_numeric_id("prescription_form") # <-- 第一次网络请求 (GET)
     payload = obj_in.dict()
     payload["prescription_id"] = new_id
 
@@ -267,25 +348,23 @@ def create_prescription(obj_in: schemas.PrescriptionFormCreate) -> Dict[str, Any
     return payload
 
 
+def create_prescriptions(items: List[schemas.PrescriptionFormCreate]) -> List[Dict[str, Any]]:
+    """批量创建处方（连续的 prescription_id），返回逐条结果."""
+    return _create_batch("prescription_form", "prescription_id", items)
+
+
 def get_prescriptions(skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-    data = _get_remote("prescription_form")
-    records = _extract_records(data)
-    return records[skip: skip + limit]
+    records = _get_remote("prescription_form")
+    return as_dicts(records[skip: skip + limit])
 
 
 def get_prescription(prescription_id: str) -> Optional[Dict[str, Any]]:
-    data = _get_remote("prescription_form")
-    records = _extract_records(data)
-    for rec in records:
-        if str(rec.get("prescription_id") or rec.get("id")) == str(prescription_id):
-            return rec
-    return None
+    rec = _get_snapshot("prescription_form").get(prescription_id)
+    return _row_dict(rec)
 
 
 def get_latest_prescription_by_patient(patient_id: int) -> Optional[Dict[str, Any]]:
-    data = _get_remote("prescription_form")
-    records = _extract_records(data)
-    records = [r for r in records if r.get("patient_id") == patient_id]
+    records = _get_snapshot("prescription_form").rows_for_patient(patient_id)
     if not records:
         return None
 
@@ -293,10 +372,11 @@ def get_latest_prescription_by_patient(patient_id: int) -> Optional[Dict[str, An
         return (r.get("date_prescribed") or "", r.get("prescription_id") or 0)
 
     records.sort(key=_key, reverse=True)
-    return records[0]
+    return _row_dict(records[0])
 
 
 # 新增：部分更新一个处方记录
+@tracing.traced()
 def update_prescription(prescription_id: str, obj_in: schemas.PrescriptionFormUpdate) -> Optional[Dict[str, Any]]:
     """部分更新一个已有的处方记录。"""
 
@@ -315,14 +395,16 @@ def update_prescription(prescription_id: str, obj_in: schemas.PrescriptionFormUp
         # 没有任何实际变化，直接返回现有记录，避免远端 404/出错
         return existing
 
-    # 4) 只有在确实有变化时才调用远端 PUT
+    # 4) 只有在确实有变化时才调用远端 PUT，并删除已渲染的传真文档
     _put_remote("prescription_form", prescription_id, update_data)
+    documents.invalidate("prescription", prescription_id)
 
     # 5) 返回更新后的完整记录
     return get_prescription(prescription_id)
 
 
 # 修改：不再依赖“最新”，而是通过 ID 更新
+@tracing.traced()
 def update_prescription_pharmacy(prescription_id: str, pharmacy_id: int) -> Optional[Dict[str, Any]]:
     """为指定的处方记录更新其 pharmacy_id（幂等：若值相同则不下发 PUT）。"""
     # 先检查记录是否存在
@@ -338,28 +420,16 @@ def update_prescription_pharmacy(prescription_id: str, pharmacy_id: int) -> Opti
     # 否则才真正下发 PUT
     update_payload = {"pharmacy_id": pharmacy_id}
     _put_remote("prescription_form", prescription_id, update_payload)
+    documents.invalidate("prescription", prescription_id)
     return get_prescription(prescription_id)
 
 
 # ---------------- Requisition ----------------
 
+@tracing.traced()
 def create_requisition(obj_in: schemas.RequisitionFormCreate) -> Dict[str, Any]:
     """生成自增 requisition_id 并调用远端 POST."""
-    data = _get_remote("requisition_form")
-    records = _extract_records(data)
-
-    max_id = 0
-    for r in records:
-        rid = r.get("requisition_id") or r.get("id")
-        if rid is None:
-            continue
-        try:
-            rid_int = int(rid)
-        except (TypeError, ValueError):
-            continue
-        max_id = max(max_id, rid_int)
-
-    new_id = str(max_id + 1 if max_id > 0 else 1)
+    new_id = _next_numeric_id("requisition_form")
     payload = obj_in.dict()
     payload["requisition_id"] = new_id
 
@@ -370,25 +440,23 @@ def create_requisition(obj_in: schemas.RequisitionFormCreate) -> Dict[str, Any]:
     return payload
 
 
+def create_requisitions(items: List[schemas.RequisitionFormCreate]) -> List[Dict[str, Any]]:
+    """批量创建检验申请（连续的 requisition_id），返回逐条结果."""
+    return _create_batch("requisition_form", "requisition_id", items)
+
+
 def get_requisitions(skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-    data = _get_remote("requisition_form")
-    records = _extract_records(data)
-    return records[skip: skip + limit]
+    records = _get_remote("requisition_form")
+    return as_dicts(records[skip: skip + limit])
 
 
 def get_requisition(requisition_id: str) -> Optional[Dict[str, Any]]:
-    data = _get_remote("requisition_form")
-    records = _extract_records(data)
-    for rec in records:
-        if str(rec.get("requisition_id") or rec.get("id")) == str(requisition_id):
-            return rec
-    return None
+    rec = _get_snapshot("requisition_form").get(requisition_id)
+    return _row_dict(rec)
 
 
 def get_latest_requisition_by_patient(patient_id: int) -> Optional[Dict[str, Any]]:
-    data = _get_remote("requisition_form")
-    records = _extract_records(data)
-    records = [r for r in records if r.get("patient_id") == patient_id]
+    records = _get_snapshot("requisition_form").rows_for_patient(patient_id)
     if not records:
         return None
 
@@ -396,10 +464,11 @@ def get_latest_requisition_by_patient(patient_id: int) -> Optional[Dict[str, Any
         return (r.get("date_requested") or "", r.get("requisition_id") or 0)
 
     records.sort(key=_key, reverse=True)
-    return records[0]
+    return _row_dict(records[0])
 
 
 # 新增：部分更新一个检验申请记录
+@tracing.traced()
 def update_requisition(requisition_id: str, obj_in: schemas.RequisitionFormUpdate) -> Optional[Dict[str, Any]]:
     """部分更新一个已有的检验申请记录。"""
 
@@ -414,10 +483,12 @@ def update_requisition(requisition_id: str, obj_in: schemas.RequisitionFormUpdat
         return existing
 
     _put_remote("requisition_form", requisition_id, update_data)
+    documents.invalidate("requisition", requisition_id)
     return get_requisition(requisition_id)
 
 
 # 修改：不再依赖“最新”，而是通过 ID 更新
+@tracing.traced()
 def update_requisition_lab(requisition_id: str, lab_id: int) -> Optional[Dict[str, Any]]:
     """为指定的检验申请记录更新其 lab_id（幂等：若值相同则不下发 PUT）。"""
     existing = get_requisition(requisition_id)
@@ -432,6 +503,7 @@ def update_requisition_lab(requisition_id: str, lab_id: int) -> Optional[Dict[st
     # 否则才真正下发 PUT
     update_payload = {"lab_id": lab_id}
     _put_remote("requisition_form", requisition_id, update_payload)
+    documents.invalidate("requisition", requisition_id)
     return get_requisition(requisition_id)
 
 
@@ -443,36 +515,33 @@ def create_pharmacy(obj_in: schemas.PharmacyRegistrationCreate) -> Dict[str, Any
 
 
 def get_pharmacies(skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-    data = _get_remote("pharmacy_registration")
-    records = _extract_records(data)
-    return records[skip: skip + limit]
+    records = _get_remote("pharmacy_registration")
+    return as_dicts(records[skip: skip + limit])
 
 
 def get_pharmacy(pharmacy_id: int) -> Optional[Dict[str, Any]]:
-    data = _get_remote("pharmacy_registration")
-    records = _extract_records(data)
-    for rec in records:
-        if rec.get("pharmacy_id") == pharmacy_id or rec.get("id") == pharmacy_id:
-            return rec
-    return None
+    rec = _get_snapshot("pharmacy_registration").get(pharmacy_id)
+    return _row_dict(rec)
 
 
 # 新增：获取最近的药店
 def get_nearest_pharmacies(patient_id: int, limit: int = 5) -> List[Dict[str, Any]]:
     """获取距离指定病人最近的药店列表。"""
-    patient = get_patient(patient_id)
+    patient_snap = _get_snapshot("patients_registration")
+    patient = patient_snap.get(patient_id)
     if not patient:
         return []
 
-    _, patient_coords = _parse_address_with_coords(patient.get("contact_info"))
+    _, patient_coords = _parsed_address(patient_snap, patient, "contact_info")
     if not patient_coords:
         return []
 
-    all_pharmacies = get_pharmacies()
+    snap = _get_snapshot("pharmacy_registration")
+    all_pharmacies = snap.records[:100]  # 与 get_pharmacies() 的默认分页保持一致
     pharmacies_with_distance = []
 
     for pharmacy in all_pharmacies:
-        plain_address, pharmacy_coords = _parse_address_with_coords(pharmacy.get("address"))
+        plain_address, pharmacy_coords = _parsed_address(snap, pharmacy)
         if pharmacy_coords:
             distance = _haversine_distance(
                 patient_coords["lat"], patient_coords["lng"],
@@ -497,28 +566,24 @@ def create_lab(obj_in: schemas.LabRegistrationCreate) -> Dict[str, Any]:
 
 
 def get_labs(skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-    data = _get_remote("lab_registration")
-    records = _extract_records(data)
-    return records[skip: skip + limit]
+    records = _get_remote("lab_registration")
+    return as_dicts(records[skip: skip + limit])
 
 
 def get_lab(lab_id: int) -> Optional[Dict[str, Any]]:
-    data = _get_remote("lab_registration")
-    records = _extract_records(data)
-    for rec in records:
-        if rec.get("lab_id") == lab_id or rec.get("id") == lab_id:
-            return rec
-    return None
+    rec = _get_snapshot("lab_registration").get(lab_id)
+    return _row_dict(rec)
 
 
 # 新增：获取详细的偏好实验室信息
 def get_detailed_lab_preferences(patient_id: int) -> List[Dict[str, Any]]:
     """获取病人的偏好实验室，并附带完整的实验室详情和距离。"""
-    patient = get_patient(patient_id)
+    patient_snap = _get_snapshot("patients_registration")
+    patient = patient_snap.get(patient_id)
     if not patient:
         return []
 
-    _, patient_coords = _parse_address_with_coords(patient.get("contact_info"))
+    _, patient_coords = _parsed_address(patient_snap, patient, "contact_info")
 
     preferences = get_lab_preferences_by_patient(patient_id)
     detailed_preferences = []
@@ -554,19 +619,21 @@ def get_detailed_lab_preferences(patient_id: int) -> List[Dict[str, Any]]:
 # 新增：获取最近的实验室
 def get_nearest_labs(patient_id: int, limit: int = 5) -> List[Dict[str, Any]]:
     """获取距离指定病人最近的实验室列表。"""
-    patient = get_patient(patient_id)
+    patient_snap = _get_snapshot("patients_registration")
+    patient = patient_snap.get(patient_id)
     if not patient:
         return []
 
-    _, patient_coords = _parse_address_with_coords(patient.get("contact_info"))
+    _, patient_coords = _parsed_address(patient_snap, patient, "contact_info")
     if not patient_coords:
         return []
 
-    all_labs = get_labs()
+    snap = _get_snapshot("lab_registration")
+    all_labs = snap.records[:100]  # 与 get_labs() 的默认分页保持一致
     labs_with_distance = []
 
     for lab in all_labs:
-        plain_address, lab_coords = _parse_address_with_coords(lab.get("address"))
+        plain_address, lab_coords = _parsed_address(snap, lab)
         if lab_coords:
             distance = _haversine_distance(
                 patient_coords["lat"], patient_coords["lng"],
@@ -581,3 +648,78 @@ def get_nearest_labs(patient_id: int, limit: int = 5) -> List[Dict[str, Any]]:
 
     labs_with_distance.sort(key=lambda l: l["distance_km"])
     return labs_with_distance[:limit]
+
+
+# ---------------- Patient context ----------------
+
+# 病人综合视图的各部分 -> 依赖的表（同一张表在一次请求中只读取一次）
+CONTEXT_SECTIONS: Dict[str, tuple] = {
+    "patient": ("patients_registration",),
+    "latest_diagnosis": ("diagnosis",),
+    "latest_prescription": ("prescription_form", "pharmacy_registration"),
+    "latest_requisition": ("requisition_form", "lab_registration"),
+    "pharmacy_preferences": ("patients_registration", "patient_preference", "pharmacy_registration"),
+    "lab_preferences": ("patients_registration", "patient_preference", "lab_registration"),
+    "nearest_pharmacies": ("patients_registration", "pharmacy_registration"),
+    "nearest_labs": ("patients_registration", "lab_registration"),
+}
+
+
+def context_tables(sections: List[str]) -> List[str]:
+    """给定部分依赖的表（去重，保持顺序）。"""
+    tables: List[str] = []
+    for section in sections:
+        for table in CONTEXT_SECTIONS[section]:
+            if table not in tables:
+                tables.append(table)
+    return tables
+
+
+def _with_facility(record: Optional[Dict[str, Any]], key: str, id_field: str, getter) -> Optional[Dict[str, Any]]:
+    """最新处方 / 检验申请 + 关联药店 / 实验室的 name 与纯地址（与 /prescriptions/latest 等接口一致）。"""
+    if not record:
+        return None
+    name = None
+    address = None
+    facility_id = record.get(id_field)
+    if facility_id is not None:
+        facility = getter(facility_id)
+        if facility:
+            name = facility.get("name")
+            address, _ = _parse_address_with_coords(facility.get("address"))
+    prefix = "pharmacy" if id_field == "pharmacy_id" else "lab"
+    return {key: record, f"{prefix}_name": name, f"{prefix}_address": address}
+
+
+_CONTEXT_BUILDERS = {
+    "patient": get_patient,
+    "latest_diagnosis": get_latest_diagnosis_by_patient,
+    "latest_prescription": lambda pid: _with_facility(
+        get_latest_prescription_by_patient(pid), "prescription", "pharmacy_id", get_pharmacy
+    ),
+    "latest_requisition": lambda pid: _with_facility(
+        get_latest_requisition_by_patient(pid), "requisition", "lab_id", get_lab
+    ),
+    "pharmacy_preferences": get_detailed_pharmacy_preferences,
+    "lab_preferences": get_detailed_lab_preferences,
+    "nearest_pharmacies": get_nearest_pharmacies,
+    "nearest_labs": get_nearest_labs,
+}
+
+
+@tracing.traced()
+def get_patient_context(patient_id: int, sections: List[str]) -> Dict[str, Any]:
+    """
+    病人综合视图：先并发读取所需的表快照（每张表一次条件请求，多 worker 时取自共享存储），
+    再在内存中组装各部分。某一部分失败时记入 errors，不影响其他部分。
+    """
+    context: Dict[str, Any] = {"patient_id": patient_id, "errors": {}}
+    with pinned_snapshots(context_tables(sections)):
+        for section in sections:
+            try:
+                with tracing.span("crud.context_section", section=section):
+                    context[section] = _CONTEXT_BUILDERS[section](patient_id)
+            except Exception as e:
+                context[section] = None
+                context["errors"][section] = f"{type(e).__name__}: {e}"
+    return context
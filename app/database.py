@@ -1,11 +1,46 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import threading
+
+from sqlalchemy.orm import declarative_base
+
+from app.config import settings
 
 # 本项目当前以“远端表 API 代理”为主，保留本地 DB 配置以便将来切换/迁移使用。
-DATABASE_URL = "sqlite:///E:/Code/FastAPI eHealth/app.db"
+# 连接串来自 settings.database_url（环境变量 DATABASE_URL）；engine / SessionLocal
+# 在第一次访问时才创建，导入本模块不会连接数据库或创建文件。
+DATABASE_URL = settings.database_url
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+_engine = None
+_session_factory = None
+_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                from sqlalchemy import create_engine
+
+                connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+                _engine = create_engine(DATABASE_URL, connect_args=connect_args)
+    return _engine
+
+
+def get_sessionmaker():
+    global _session_factory
+    if _session_factory is None:
+        from sqlalchemy.orm import sessionmaker
+
+        _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+    return _session_factory
+
+
+def __getattr__(name: str):
+    # 兼容旧的 `from app.database import engine, SessionLocal`
+    if name == "engine":
+        return get_engine()
+    if name == "SessionLocal":
+        return get_sessionmaker()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,280 @@
+"""
+处方 / 检验申请的传真文档（PDF）：渲染一次，按内容哈希缓存在磁盘上。
+
+- 文档内容由「表单记录 + 病人 + 关联的药店 / 实验室」决定；对这些数据（连同模板版本）
+  计算哈希，文件名为 <kind>-<record_id>-<hash>.pdf。数据不变时重复传真 / 预览直接读取文件，
+  任何字段变化都会得到新的哈希，不会读到过期的文档；
+- update_prescription / update_requisition（及修改药店 / 实验室）成功后调用 invalidate()，
+  删除该表单已有的文件；
+- 渲染在进程池中执行（DOCUMENT_WORKERS），CPU 工作不占用 API 进程的 GIL；同一文档的并发请求
+  共享一次渲染；
+- PDF 由标准库直接生成（单字体纯文本页面，每页约 50 行），不依赖第三方库。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app import metrics, tracing
+
+# 模板变化时递增：旧文件的哈希不再匹配，自然失效
+TEMPLATE_VERSION = 1
+
+_FIELDS = {
+    "prescription": (
+        "medication_name", "medication_strength", "medication_form", "dosage_instructions", "quantity",
+        "refills_allowed", "date_prescribed", "expiry_date", "prescriber_id", "status", "notes",
+    ),
+    "requisition": (
+        "department", "test_type", "test_code", "clinical_info", "date_requested", "priority",
+        "status", "notes",
+    ),
+}
+_FACILITY_KIND = {"prescription": "pharmacy", "requisition": "lab"}
+
+
+def default_dir() -> str:
+    """未配置 DOCUMENT_CACHE_DIR 时使用的目录。"""
+    return os.path.join(tempfile.gettempdir(), "ehealth-documents")
+
+
+class Document(NamedTuple):
+    kind: str
+    record_id: str
+    content_hash: str
+    path: str
+    lines: List[str]  # 文档的文本内容（传真封面 / 纯文本 transport 使用）
+
+
+# ---------------- 版式 ----------------
+
+def _plain_address(raw: Optional[str]) -> Optional[str]:
+    if raw and "||" in raw:
+        return raw.split("||", 1)[0].strip()
+    return raw
+
+
+def page_lines(
+    kind: str,
+    record: Dict[str, Any],
+    patient: Optional[Dict[str, Any]],
+    facility: Optional[Dict[str, Any]],
+) -> List[str]:
+    """文档的文本内容（一行一个字段）。"""
+    record_id = record.get(f"{kind}_id")
+    facility_kind = _FACILITY_KIND[kind]
+    lines = [f"{kind.upper()} FORM #{record_id}", ""]
+    if facility:
+        lines.append(f"To: {facility.get('name')} ({facility_kind} ID: {facility.get(f'{facility_kind}_id')})")
+        lines.append(f"Phone: {facility.get('phone_number') or ''}")
+        address = _plain_address(facility.get("address"))
+        if address:
+            lines.append(f"Address: {address}")
+        lines.append("")
+    if patient:
+        lines.append(f"Patient: {patient.get('name')} (ID: {patient.get('patient_id')}), DOB {patient.get('dob')}")
+        lines.append(f"Phone: {patient.get('phone_number') or ''}")
+    else:
+        lines.append(f"Patient ID: {record.get('patient_id')}")
+    lines.append("")
+    for field in _FIELDS[kind]:
+        value = record.get(field)
+        if value not in (None, ""):
+            lines.append(f"{field.replace('_', ' ').capitalize()}: {value}")
+    return lines
+
+
+def _pdf_text(s: str) -> str:
+    s = s.encode("latin-1", "replace").decode("latin-1")
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def render_pdf(lines: List[str], lines_per_page: int = 50) -> bytes:
+    """纯文本行 -> PDF（US Letter，Helvetica 11pt）。在进程池中执行。"""
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    objects: List[bytes] = []
+    # 1: catalog, 2: pages, 3: font, 之后每页两个对象（page, content）
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    for i, page in enumerate(pages):
+        stream = ["BT", "/F1 11 Tf", "14 TL", "56 740 Td"]
+        for j, line in enumerate(page):
+            if j:
+                stream.append("T*")
+            stream.append(f"({_pdf_text(line)}) Tj")
+        stream.append("ET")
+        content = "\n".join(stream).encode("latin-1")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for n, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % n + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _render_to_file(lines: List[str], path: str) -> int:
+    """进程池任务：渲染并原子写入文件，返回字节数。"""
+    data = render_pdf(lines)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data)
+
+
+# ---------------- 缓存 ----------------
+
+def content_hash(kind: str, record: Dict[str, Any], patient: Optional[Dict[str, Any]], facility: Optional[Dict[str, Any]]) -> str:
+    payload = json.dumps(
+        [TEMPLATE_VERSION, kind, record, patient, facility], sort_keys=True, default=str, separators=(",", ":")
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class DocumentCache:
+    def __init__(self, directory: str, workers: int = 2):
+        self.directory = directory
+        self.workers = max(1, workers)
+        os.makedirs(directory, exist_ok=True)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # 调用方持有 self._lock；进程池在第一次渲染时才创建
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    @staticmethod
+    def _safe(record_id: str) -> str:
+        return "".join(c if c.isalnum() or c in "-_" else "_" for c in str(record_id))
+
+    def path(self, kind: str, record_id: str, digest: str) -> str:
+        return os.path.join(self.directory, f"{kind}-{self._safe(record_id)}-{digest}.pdf")
+
+    def get(
+        self,
+        kind: str,
+        record: Dict[str, Any],
+        patient: Optional[Dict[str, Any]],
+        facility: Optional[Dict[str, Any]],
+    ) -> Document:
+        """返回文档；已渲染过（同一内容哈希）时直接返回文件路径，否则在进程池中渲染。"""
+        record_id = str(record.get(f"{kind}_id"))
+        digest = content_hash(kind, record, patient, facility)
+        path = self.path(kind, record_id, digest)
+        lines = page_lines(kind, record, patient, facility)
+        if os.path.exists(path):
+            metrics.DOCUMENT_RENDERS.inc(kind=kind, result="cached")
+            return Document(kind, record_id, digest, path, lines)
+
+        with self._lock:
+            future = self._inflight.get(path)
+            owner = future is None
+            if owner:
+                future = self._executor().submit(_render_to_file, lines, path)
+                self._inflight[path] = future
+        try:
+            with tracing.span("documents.render", kind=kind, record_id=record_id, shared=not owner):
+                with metrics.DOCUMENT_RENDER_SECONDS.time(kind=kind):
+                    future.result()
+        finally:
+            if owner:
+                with self._lock:
+                    self._inflight.pop(path, None)
+        metrics.DOCUMENT_RENDERS.inc(kind=kind, result="rendered" if owner else "coalesced")
+        return Document(kind, record_id, digest, path, lines)
+
+    def invalidate(self, kind: str, record_id: str) -> int:
+        """删除某张表单已缓存的所有文档，返回删除的文件数。"""
+        prefix = f"{kind}-{self._safe(record_id)}-"
+        removed = 0
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            if name.startswith(prefix) and name.endswith(".pdf"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+# ---------------- 对外接口 ----------------
+
+_cache: Optional[DocumentCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> DocumentCache:
+    global _cache
+    if _cache is None:
+        from .config import settings
+
+        with _cache_lock:
+            if _cache is None:
+                _cache = DocumentCache(settings.document_cache_dir or default_dir(), settings.document_workers)
+    return _cache
+
+
+def _load(kind: str, record_id: str) -> Optional[Tuple[Dict[str, Any], Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+    from app import crud
+
+    if kind == "prescription":
+        record = crud.get_prescription(record_id)
+        facility_id, get_facility = (record or {}).get("pharmacy_id"), crud.get_pharmacy
+    else:
+        record = crud.get_requisition(record_id)
+        facility_id, get_facility = (record or {}).get("lab_id"), crud.get_lab
+    if not record:
+        return None
+    patient_id = record.get("patient_id")
+    patient = crud.get_patient(patient_id) if patient_id is not None else None
+    facility = get_facility(facility_id) if facility_id is not None else None
+    return record, patient, facility
+
+
+def get_document(kind: str, record_id: str) -> Optional[Document]:
+    """按表单 ID 取文档（数据取自表快照）；表单不存在时返回 None。"""
+    loaded = _load(kind, record_id)
+    if loaded is None:
+        return None
+    return get_cache().get(kind, *loaded)
+
+
+def invalidate(kind: str, record_id: str) -> None:
+    """表单被修改后调用（crud.update_*）。"""
+    try:
+        get_cache().invalidate(kind, record_id)
+    except OSError as e:
+        print(f"[WARN] failed to invalidate {kind} {record_id} documents: {e}")
+
+
+def shutdown() -> None:
+    if _cache is not None:
+        _cache.shutdown()
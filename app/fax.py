@@ -0,0 +1,499 @@
+"""
+传真发送子系统：持久化的发送队列 + 可替换的传真网关（transport）。
+
+原来的 /prescriptions/{id}/fax、/requisitions/{id}/fax 同步打印一条模拟消息；现在改为：
+- 提交：在表快照中校验处方 / 检验申请（一次提交多条时同一张表只读一次），写入 SQLite 队列
+  （FAX_QUEUE_PATH，WAL 模式；进程重启后未发送的任务继续发送，多 worker 共用同一个文件）；
+- 发送：每个进程一个后台线程 FaxDispatcher（第一次入队时启动；FAX_DISPATCH_ON_STARTUP=true 时随服务启动，
+  用于重启后继续发送队列中未完成的任务），按「同一药店 / 实验室」成批领取到期的任务，
+  在线程池中并发取得各表单的 PDF（app/documents.py：渲染一次、按内容哈希缓存），整批交给 transport 发送；
+- 重试：发送失败的任务按指数退避重新排队，超过 FAX_MAX_ATTEMPTS 次后标记为 failed；
+  领取后进程崩溃的任务在租约到期后由其他 worker 重新领取；
+- 状态：queued -> sending -> sent / failed，客户端通过 GET /fax/jobs/{job_id} 轮询。
+
+transport 只需实现 send(batch) -> 回执号；内置两个替身（真实网关接入前使用）：
+- loopback：记录在内存中并打印 [FAX SIMULATION]（与原来的模拟行为一致）；
+- file：每批写一个文本文件（封面 + 各页文本）和各表单的 PDF 到 FAX_OUTBOX_DIR。
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app import crud, documents, metrics, order_templates, tracing
+
+# 任务类型 -> (表单表, 接收方字段, 接收方类型)
+JOB_KINDS: Dict[str, Tuple[str, str, str]] = {
+    "prescription": ("prescription_form", "pharmacy_id", "pharmacy"),
+    "requisition": ("requisition_form", "lab_id", "lab"),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fax_jobs (
+    job_id          TEXT PRIMARY KEY,
+    kind            TEXT NOT NULL,
+    record_id       TEXT NOT NULL,
+    patient_id      TEXT,
+    facility_id     TEXT NOT NULL,
+    status          TEXT NOT NULL,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    last_error      TEXT,
+    batch_id        TEXT,
+    delivery_ref    TEXT,
+    created_at      REAL NOT NULL,
+    updated_at      REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    lease_until     REAL
+);
+CREATE INDEX IF NOT EXISTS fax_jobs_due ON fax_jobs (status, next_attempt_at);
+"""
+
+_COLUMNS = (
+    "job_id", "kind", "record_id", "patient_id", "facility_id", "status", "attempts",
+    "last_error", "batch_id", "delivery_ref", "created_at", "updated_at",
+)
+
+
+def default_path() -> str:
+    """未配置 FAX_QUEUE_PATH 时使用的队列文件。"""
+    return os.path.join(tempfile.gettempdir(), "ehealth-fax.sqlite3")
+
+
+class FaxDocument(NamedTuple):
+    job_id: str
+    kind: str
+    record_id: str
+    patient_id: Optional[str]
+    body: str  # 文本内容
+    path: Optional[str] = None  # 渲染好的 PDF（文档缓存中的文件）
+
+
+class FaxBatch(NamedTuple):
+    batch_id: str
+    facility_kind: str  # "pharmacy" | "lab"
+    facility_id: str
+    facility_name: Optional[str]
+    fax_number: Optional[str]  # 注册表中没有单独的传真号码字段，取 phone_number
+    documents: List[FaxDocument]
+
+
+# ---------------- 队列 ----------------
+
+class FaxQueue:
+    """
+    lease_s：任务被领取后的租约时长；持有者在租约内没有回写结果（进程崩溃）时任务重新变为可领取。
+    """
+
+    def __init__(self, path: str, lease_s: float = 120.0):
+        self.path = path
+        self.lease_s = lease_s
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # 与 shared_cache 相同：每个线程一个连接，autocommit
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, kind: str, items: List[Tuple[str, Any, Any]]) -> List[Dict[str, Any]]:
+        """items: (record_id, patient_id, facility_id)；返回新建的任务。"""
+        now = time.time()
+        rows = [
+            (uuid.uuid4().hex, kind, str(record_id), None if patient_id is None else str(patient_id),
+             str(facility_id), "queued", 0, None, None, None, now, now, now)
+            for record_id, patient_id, facility_id in items
+        ]
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                f"INSERT INTO fax_jobs ({', '.join(_COLUMNS)}, next_attempt_at) "
+                f"VALUES ({', '.join('?' * (len(_COLUMNS) + 1))})",
+                rows,
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [dict(zip(_COLUMNS, row[:-1])) for row in rows]
+
+    def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        领取一批到期任务：最早到期任务的接收方（同一药店 / 实验室）下最多 limit 条，
+        状态改为 sending 并设置租约。没有到期任务时返回 []。
+        """
+        now = time.time()
+        due = "((status = 'queued' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until < ?))"
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            head = conn.execute(
+                f"SELECT kind, facility_id FROM fax_jobs WHERE {due} ORDER BY next_attempt_at LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if head is None:
+                conn.execute("COMMIT")
+                return []
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM fax_jobs WHERE {due} AND kind = ? AND facility_id = ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, now, head[0], head[1], limit),
+            ).fetchall()
+            batch_id = uuid.uuid4().hex
+            conn.executemany(
+                "UPDATE fax_jobs SET status = 'sending', attempts = attempts + 1, batch_id = ?, "
+                "updated_at = ?, lease_until = ? WHERE job_id = ?",
+                [(batch_id, now, now + self.lease_s, row[0]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        jobs = []
+        for row in rows:
+            job = dict(zip(_COLUMNS, row))
+            job.update(status="sending", attempts=job["attempts"] + 1, batch_id=batch_id)
+            jobs.append(job)
+        return jobs
+
+    def complete(self, job_ids: List[str], delivery_ref: str) -> None:
+        now = time.time()
+        self._conn().executemany(
+            "UPDATE fax_jobs SET status = 'sent', delivery_ref = ?, last_error = NULL, updated_at = ?, "
+            "lease_until = NULL WHERE job_id = ?",
+            [(delivery_ref, now, job_id) for job_id in job_ids],
+        )
+
+    def fail(self, jobs: List[Dict[str, Any]], error: str, max_attempts: int, backoff_s: float) -> List[str]:
+        """记录失败：未超过重试次数的任务按指数退避重新排队；返回最终失败（failed）的 job_id。"""
+        now = time.time()
+        failed = []
+        updates = []
+        for job in jobs:
+            if job["attempts"] >= max_attempts:
+                failed.append(job["job_id"])
+                updates.append(("failed", error, now, now, job["job_id"]))
+            else:
+                delay = backoff_s * (2 ** (job["attempts"] - 1))
+                updates.append(("queued", error, now, now + delay, job["job_id"]))
+        self._conn().executemany(
+            "UPDATE fax_jobs SET status = ?, last_error = ?, updated_at = ?, next_attempt_at = ?, "
+            "lease_until = NULL WHERE job_id = ?",
+            updates,
+        )
+        return failed
+
+    def get(self, job_ids: List[str]) -> List[Dict[str, Any]]:
+        """按 job_id 查询任务（保持请求中的顺序，不存在的忽略）。"""
+        if not job_ids:
+            return []
+        rows = self._conn().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM fax_jobs WHERE job_id IN ({', '.join('?' * len(job_ids))})",
+            job_ids,
+        ).fetchall()
+        by_id = {row[0]: dict(zip(_COLUMNS, row)) for row in rows}
+        return [by_id[job_id] for job_id in job_ids if job_id in by_id]
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM fax_jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+
+# ---------------- 传真网关 ----------------
+
+class LoopbackTransport:
+    """网关替身：不真正发送，保留最近的批次并打印（与原来的 [FAX SIMULATION] 输出一致）。"""
+
+    def __init__(self, keep: int = 1000):
+        self.sent: deque = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def send(self, batch: FaxBatch) -> str:
+        with self._lock:
+            self.sent.append(batch)
+        for doc in batch.documents:
+            print(
+                f"[FAX SIMULATION] Fax sent for patient (ID: {doc.patient_id})'s {doc.kind} form "
+                f"(ID: {doc.record_id}) to {batch.facility_kind} (ID: {batch.facility_id})."
+            )
+        return f"loopback:{batch.batch_id}"
+
+
+class FileTransport:
+    """
+    网关替身：每批写一个文本文件（封面 + 各文档文本，以分页符分隔）以及各文档的 PDF
+    （<批次文件名>-<序号>.pdf），回执号为文本文件名。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, batch: FaxBatch) -> str:
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{batch.facility_kind}-{batch.facility_id}-{batch.batch_id[:8]}.txt"
+        tmp = os.path.join(self.directory, f".{name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(f"TO: {batch.facility_name or ''} ({batch.facility_kind} {batch.facility_id})\n")
+            f.write(f"FAX: {batch.fax_number or ''}\n")
+            f.write(f"PAGES: {len(batch.documents)}\n")
+            for doc in batch.documents:
+                f.write("\f\n")
+                f.write(doc.body)
+        for i, doc in enumerate(batch.documents, start=1):
+            if doc.path:
+                shutil.copyfile(doc.path, os.path.join(self.directory, f"{name[:-4]}-{i}.pdf"))
+        os.replace(tmp, os.path.join(self.directory, name))
+        return name
+
+
+def make_transport(name: str, outbox_dir: str = ""):
+    if name == "loopback":
+        return LoopbackTransport()
+    if name == "file":
+        return FileTransport(outbox_dir or os.path.join(tempfile.gettempdir(), "ehealth-fax-outbox"))
+    raise ValueError(f"Unknown fax transport: {name!r} (expected 'loopback' or 'file')")
+
+
+# ---------------- 渲染 ----------------
+
+def _get_record(kind: str, record_id: str) -> Optional[Dict[str, Any]]:
+    return crud.get_prescription(record_id) if kind == "prescription" else crud.get_requisition(record_id)
+
+
+def _get_facility(kind: str, facility_id: Any) -> Optional[Dict[str, Any]]:
+    return crud.get_pharmacy(facility_id) if kind == "prescription" else crud.get_lab(facility_id)
+
+
+def render(job: Dict[str, Any]) -> FaxDocument:
+    """取得（必要时渲染）表单的传真文档。表单已被删除时抛出 LookupError。"""
+    kind, record_id = job["kind"], job["record_id"]
+    doc = documents.get_document(kind, record_id)
+    if doc is None:
+        raise LookupError(f"{kind} {record_id} not found")
+    return FaxDocument(job["job_id"], kind, record_id, job.get("patient_id"), "\n".join(doc.lines) + "\n", doc.path)
+
+
+# ---------------- 发送线程 ----------------
+
+class FaxDispatcher:
+    def __init__(
+        self,
+        queue: FaxQueue,
+        transport,
+        workers: int = 4,
+        batch_max: int = 20,
+        max_attempts: int = 5,
+        backoff_s: float = 2.0,
+        poll_interval: float = 1.0,
+    ):
+        self.queue = queue
+        self.transport = transport
+        self.workers = max(1, workers)
+        self.batch_max = max(1, batch_max)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_s = backoff_s
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fax-render")
+        self._thread = threading.Thread(target=self._run, name="fax-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def notify(self) -> None:
+        """有新任务入队：立即领取，不等下一次轮询。"""
+        self._wake.set()
+
+    def dispatch_once(self) -> int:
+        """领取并发送一批；返回处理的任务数（0 表示没有到期任务）。"""
+        jobs = self.queue.claim(self.batch_max)
+        if not jobs:
+            return 0
+        kind, facility_id = jobs[0]["kind"], jobs[0]["facility_id"]
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            with tracing.span("fax.dispatch", kind=kind, facility_id=facility_id, jobs=len(jobs)):
+                pool = self._pool
+                render_fn = tracing.wrap(self._render_safe)
+                rendered = list(pool.map(render_fn, jobs)) if pool is not None and len(jobs) > 1 else [
+                    render_fn(job) for job in jobs
+                ]
+                ready, documents = [], []
+                for job, doc in zip(jobs, rendered):
+                    if isinstance(doc, FaxDocument):
+                        ready.append(job)
+                        documents.append(doc)
+                    else:  # 渲染失败（doc 为错误信息），单独计入重试
+                        self._fail([job], doc, kind)
+
+                if documents:
+                    try:
+                        facility = _get_facility(kind, facility_id) or {}
+                        batch = FaxBatch(
+                            jobs[0]["batch_id"], JOB_KINDS[kind][2], facility_id,
+                            facility.get("name"), facility.get("phone_number"), documents,
+                        )
+                        ref = self.transport.send(batch)
+                    except Exception as e:
+                        self._fail(ready, f"{type(e).__name__}: {e}", kind)
+                    else:
+                        self.queue.complete([job["job_id"] for job in ready], ref)
+                        metrics.FAX_JOBS.inc(len(ready), kind=kind, outcome="sent")
+                        outcome = "ok"
+                        # 已发出的医嘱用于学习诊断 -> 医嘱模板（ORDER_TEMPLATES=true 时）
+                        order_templates.learn_from_sent(kind, [job["record_id"] for job in ready])
+        finally:
+            metrics.FAX_BATCH_SECONDS.observe(time.perf_counter() - start, kind=kind, outcome=outcome)
+        return len(jobs)
+
+    @staticmethod
+    def _render_safe(job: Dict[str, Any]):
+        try:
+            return render(job)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+
+    def _fail(self, jobs: List[Dict[str, Any]], error: str, kind: str) -> None:
+        failed = self.queue.fail(jobs, error, self.max_attempts, self.backoff_s)
+        if len(jobs) > len(failed):
+            metrics.FAX_JOBS.inc(len(jobs) - len(failed), kind=kind, outcome="retry")
+        if failed:
+            metrics.FAX_JOBS.inc(len(failed), kind=kind, outcome="failed")
+            print(f"[WARN] fax jobs failed after {self.max_attempts} attempts: {', '.join(failed)} ({error})")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.dispatch_once():
+                    continue
+            except Exception as e:
+                print(f"[WARN] fax dispatch failed: {type(e).__name__}: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+
+# ---------------- 对外接口 ----------------
+
+_queue: Optional[FaxQueue] = None
+_dispatcher: Optional[FaxDispatcher] = None
+_lock = threading.Lock()
+_dispatcher_lock = threading.Lock()
+
+
+def get_queue() -> FaxQueue:
+    global _queue
+    if _queue is None:
+        from .config import settings
+
+        with _lock:
+            if _queue is None:
+                _queue = FaxQueue(settings.fax_queue_path or default_path())
+    return _queue
+
+
+def submit(kind: str, record_ids: List[str]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    校验并入队；返回 (新建的任务, 逐条错误 {kind, record_id, status_code, error})。
+    表单不存在为 404，没有关联药店 / 实验室为 400；同一请求中重复的 record_id 只入队一次。
+    """
+    table, facility_field, facility_kind = JOB_KINDS[kind]
+    items: List[Tuple[str, Any, Any]] = []
+    errors: List[Dict[str, Any]] = []
+    seen = set()
+    with tracing.span("fax.submit", kind=kind, records=len(record_ids)):
+        for record_id in record_ids:
+            record_id = str(record_id)
+            if record_id in seen:
+                continue
+            seen.add(record_id)
+            record = _get_record(kind, record_id)
+            if not record:
+                errors.append({"kind": kind, "record_id": record_id, "status_code": 404,
+                               "error": f"{kind.capitalize()} with ID {record_id} not found."})
+            elif record.get(facility_field) is None:
+                errors.append({"kind": kind, "record_id": record_id, "status_code": 400,
+                               "error": f"{kind.capitalize()} {record_id} has no associated {facility_field}."})
+            else:
+                items.append((record_id, record.get("patient_id"), record.get(facility_field)))
+        jobs = get_queue().enqueue(kind, items) if items else []
+    if jobs:
+        metrics.FAX_JOBS.inc(len(jobs), kind=kind, outcome="queued")
+        ensure_started().notify()
+    return jobs, errors
+
+
+def get_jobs(job_ids: List[str]) -> List[Dict[str, Any]]:
+    return get_queue().get(job_ids)
+
+
+def start(
+    transport: str = "loopback",
+    outbox_dir: str = "",
+    workers: int = 4,
+    batch_max: int = 20,
+    max_attempts: int = 5,
+    backoff_s: float = 2.0,
+    poll_interval: float = 1.0,
+) -> FaxDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = FaxDispatcher(
+            get_queue(), make_transport(transport, outbox_dir), workers=workers, batch_max=batch_max,
+            max_attempts=max_attempts, backoff_s=backoff_s, poll_interval=poll_interval,
+        )
+        _dispatcher.start()
+    return _dispatcher
+
+
+def ensure_started() -> FaxDispatcher:
+    """按配置启动（已启动时直接返回）本进程的发送线程。"""
+    if _dispatcher is None:
+        from .config import settings
+
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                start(
+                    settings.fax_transport,
+                    settings.fax_outbox_dir,
+                    workers=settings.fax_workers,
+                    batch_max=settings.fax_batch_max,
+                    max_attempts=settings.fax_max_attempts,
+                    backoff_s=settings.fax_retry_backoff_s,
+                    poll_interval=settings.fax_poll_interval_s,
+                )
+    return _dispatcher
+
+
+def stop() -> None:
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop()
+        _dispatcher = None
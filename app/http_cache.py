@@ -0,0 +1,90 @@
+"""
+HTTP 条件请求（ETag / If-None-Match）支持。
+
+- 表数据接口（列表、nearest、偏好详情、病人综合视图）：ETag 由「生成响应体的表快照版本 + 查询参数」
+  计算，命中时连计算 / 序列化都省掉；
+- 其他派生接口：ETag 为响应体内容哈希。
+命中时返回 304（无响应体），并统一设置 Cache-Control。
+"""
+import hashlib
+from typing import Any, Mapping, Optional
+
+from fastapi import Request, Response
+
+from .remote import TableSnapshot
+from .serialization import dump_json
+
+# 注册表类数据（药店/实验室）变化很少，允许浏览器短时间直接复用
+REGISTRY_CACHE_CONTROL = "private, max-age=60"
+# 业务数据：可以缓存，但每次使用前必须带 If-None-Match 重新验证
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts: Any) -> str:
+    """由任意部件计算强 ETag（带双引号）。bytes 直接参与哈希。"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        h.update(b"\x1f")
+    return f'"{h.hexdigest()}"'
+
+
+def table_etag(snapshots: Mapping[str, TableSnapshot], *params: Any) -> Optional[str]:
+    """
+    按生成响应体的快照（crud.pinned_snapshots）的版本计算 ETag；
+    任一快照没有版本号时返回 None（由调用方退回到内容哈希）。
+    """
+    versions = []
+    for table, snap in snapshots.items():
+        if not snap.version:
+            return None
+        versions.append(f"{table}@{snap.version}")
+    return make_etag(*versions, *params)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match 使用弱比较（RFC 9110 13.1.2），支持多个值和 '*'。"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    target = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == target:
+            return True
+    return False
+
+
+def not_modified(etag: str, cache_control: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+
+def conditional_json(
+    request: Request,
+    tp: Any,
+    data: Any,
+    etag: Optional[str] = None,
+    cache_control: str = REVALIDATE_CACHE_CONTROL,
+) -> Response:
+    """
+    返回带 ETag 的 JSON 响应；客户端的 If-None-Match 命中时返回 304。
+    未提供 etag 时以序列化后的响应体计算（派生响应）。
+    """
+    if etag is not None and etag_matches(request, etag):
+        return not_modified(etag, cache_control)
+
+    body = dump_json(tp, data)
+    if etag is None:
+        etag = make_etag(body)
+        if etag_matches(request, etag):
+            return not_modified(etag, cache_control)
+
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": cache_control},
+    )
@@ -0,0 +1,291 @@
+"""
+POST 接口的 Idempotency-Key 支持（/workflow/*、创建处方 / 检验申请等）。
+
+门户在超时后重试 /workflow/generate-orders 或 POST /prescriptions 会重复下单，每次重复还会多一次
+LLM 调用和整表读取。请求带 Idempotency-Key 请求头时：
+- 第一次请求正常执行，2xx 和确定性的 4xx 响应按 客户端 + key 存入本地 SQLite（默认在临时目录），
+  ttl 秒内相同 key 的请求直接返回保存的响应（响应头 Idempotent-Replayed: true），不再执行工具；
+- 第一次请求仍在执行时，相同 key 的并发请求等待它完成后返回同一响应；等待超过 wait_s 返回 409；
+- 同一个 key 携带不同的请求（方法 / 路径 / 请求体不同）返回 422；
+- 5xx、异常和暂时性的 4xx（408 / 409 / 423 / 425 / 429，例如准入控制的限速）不保存，
+  客户端可以用同一个 key 重试；
+- 存储在 SQLite 中，多个 worker 共用同一个文件时跨进程同样生效；
+  执行中的记录超过 pending_timeout_s 视为持有者已崩溃，可被重新领取。
+不带该请求头的请求不受影响。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import anyio.to_thread
+
+from app import metrics
+from app.admission import client_key
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key         TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    state       TEXT NOT NULL,          -- pending / done
+    status      INTEGER,
+    headers     TEXT,
+    body        BLOB,
+    created_at  REAL NOT NULL,
+    expires_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys (expires_at);
+"""
+
+MAX_KEY_LENGTH = 255
+
+# 暂时性的 4xx：重试可能得到不同的结果，不保存
+_TRANSIENT_STATUSES = frozenset({408, 409, 423, 425, 429})
+
+
+def is_storable(status: int) -> bool:
+    return 200 <= status < 300 or (400 <= status < 500 and status not in _TRANSIENT_STATUSES)
+
+
+def default_path() -> str:
+    """未配置 IDEMPOTENCY_STORE_PATH 时使用的文件。"""
+    return os.path.join(tempfile.gettempdir(), "ehealth-idempotency.sqlite3")
+
+
+class StoredResponse(NamedTuple):
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+
+class IdempotencyStore:
+    """
+    ttl：保存的响应保留多久；pending_timeout_s：执行中的记录多久后视为持有者已崩溃。
+    """
+
+    def __init__(self, path: str, ttl: float = 86400.0, pending_timeout_s: float = 300.0):
+        self.path = path
+        self.ttl = ttl
+        self.pending_timeout_s = pending_timeout_s
+        self._local = threading.local()
+        self._claims = 0
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # 与 shared_cache 相同：每个线程一个连接，autocommit
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def claim(self, key: str, fingerprint: str) -> Tuple[str, Optional[StoredResponse]]:
+        """
+        返回 (state, response)：
+        new（由调用方执行并 complete / release）、pending（其他请求正在执行）、
+        done（返回保存的响应）、mismatch（同一个 key 对应不同的请求）。
+        """
+        now = time.time()
+        conn = self._conn()
+        self._claims += 1
+        if self._claims % 200 == 0:
+            conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND expires_at < ?", (key, now))
+            row = conn.execute(
+                "SELECT fingerprint, state, status, headers, body FROM idempotency_keys WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO idempotency_keys (key, fingerprint, state, created_at, expires_at) "
+                    "VALUES (?, ?, 'pending', ?, ?)",
+                    (key, fingerprint, now, now + self.pending_timeout_s),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return "new", None
+        stored_fingerprint, state, status, headers, body = row
+        if stored_fingerprint != fingerprint:
+            return "mismatch", None
+        if state != "done":
+            return "pending", None
+        return "done", StoredResponse(status, [tuple(h) for h in json.loads(headers)], bytes(body))
+
+    def complete(self, key: str, response: StoredResponse) -> None:
+        self._conn().execute(
+            "UPDATE idempotency_keys SET state = 'done', status = ?, headers = ?, body = ?, expires_at = ? "
+            "WHERE key = ?",
+            (response.status, json.dumps(response.headers), response.body, time.time() + self.ttl, key),
+        )
+
+    def release(self, key: str) -> None:
+        """执行失败：删除执行中的记录，允许用同一个 key 重试。"""
+        self._conn().execute("DELETE FROM idempotency_keys WHERE key = ? AND state = 'pending'", (key,))
+
+
+class IdempotencyMiddleware:
+    """纯 ASGI 中间件：对 path_prefixes 下带 Idempotency-Key 请求头的 POST 请求生效。"""
+
+    def __init__(
+        self,
+        app,
+        path: str = "",
+        ttl: float = 86400.0,
+        path_prefixes: Tuple[str, ...] = ("/api/",),
+        wait_s: float = 60.0,
+        poll_interval: float = 0.1,
+    ):
+        self.app = app
+        self.path = path or default_path()
+        self.ttl = ttl
+        self._store: Optional[IdempotencyStore] = None
+        self.path_prefixes = tuple(path_prefixes)
+        self.wait_s = wait_s
+        self.poll_interval = poll_interval
+        # 本进程内执行中的 key -> 完成事件（同进程的重复请求不必轮询 SQLite）
+        self._inflight: Dict[str, asyncio.Event] = {}
+
+    @property
+    def store(self) -> IdempotencyStore:
+        # SQLite 文件在第一个带 Idempotency-Key 的请求时才打开
+        if self._store is None:
+            # 执行中的记录至少保留到等待者放弃之后
+            self._store = IdempotencyStore(self.path, self.ttl, pending_timeout_s=max(300.0, 2 * self.wait_s))
+        return self._store
+
+    @staticmethod
+    def _header(scope, name: bytes) -> Optional[str]:
+        for k, v in scope.get("headers") or ():
+            if k == name:
+                return v.decode("latin-1")
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope.get("method") != "POST"
+            or not scope.get("path", "").startswith(self.path_prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+        idem_key = self._header(scope, b"idempotency-key")
+        if not idem_key:
+            await self.app(scope, receive, send)
+            return
+        if len(idem_key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, {"detail": f"Idempotency-Key longer than {MAX_KEY_LENGTH} characters"})
+            return
+
+        # 读完请求体（用于指纹），之后原样交给下游
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        fingerprint = hashlib.blake2b(
+            b"\0".join([scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body]),
+            digest_size=16,
+        ).hexdigest()
+        key = f"{client_key(scope)}|{idem_key}"
+
+        deadline = time.monotonic() + self.wait_s
+        waited = False
+        while True:
+            state, stored = await anyio.to_thread.run_sync(self.store.claim, key, fingerprint)
+            if state == "new":
+                break
+            if state == "done":
+                metrics.IDEMPOTENCY_REQUESTS.inc(result="waited" if waited else "replayed")
+                await _replay(send, stored)
+                return
+            if state == "mismatch":
+                metrics.IDEMPOTENCY_REQUESTS.inc(result="mismatch")
+                await _send_json(send, 422, {"detail": "Idempotency-Key was already used with a different request"})
+                return
+            # pending：等待第一个请求完成
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.IDEMPOTENCY_REQUESTS.inc(result="conflict")
+                await _send_json(
+                    send, 409, {"detail": "A request with this Idempotency-Key is still in progress"},
+                    retry_after=1,
+                )
+                return
+            waited = True
+            event = self._inflight.get(key)
+            if event is not None:
+                try:
+                    await asyncio.wait_for(event.wait(), min(remaining, self.wait_s))
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # 执行者在其他 worker 中：轮询
+                await asyncio.sleep(min(remaining, self.poll_interval))
+
+        metrics.IDEMPOTENCY_REQUESTS.inc(result="new")
+        event = self._inflight[key] = asyncio.Event()
+        replayed_body = [False]
+
+        async def receive_body():
+            if not replayed_body[0]:
+                replayed_body[0] = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        start: Dict = {}
+        parts: List[bytes] = []
+
+        async def send_capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                parts.append(message.get("body", b""))
+            await send(message)
+
+        stored = None
+        try:
+            await self.app(scope, receive_body, send_capture)
+            status = start.get("status", 500)
+            if is_storable(status):
+                headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in start.get("headers", [])]
+                stored = StoredResponse(status, headers, b"".join(parts))
+        finally:
+            try:
+                if stored is not None:
+                    await anyio.to_thread.run_sync(self.store.complete, key, stored)
+                else:
+                    await anyio.to_thread.run_sync(self.store.release, key)
+            finally:
+                self._inflight.pop(key, None)
+                event.set()
+
+
+async def _replay(send, stored: StoredResponse) -> None:
+    headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in stored.headers]
+    headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": stored.status, "headers": headers})
+    await send({"type": "http.response.body", "body": stored.body})
+
+
+async def _send_json(send, status: int, payload: Dict, retry_after: Optional[int] = None) -> None:
+    body = json.dumps(payload).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
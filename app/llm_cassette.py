@@ -0,0 +1,213 @@
+"""
+LLM 调用的录制 / 回放（cassette）。
+
+与缓存不同，cassette 的目的是「可复现」：
+- record：透传给真实 provider，同时把 (请求指纹 → 响应) 追加写入 gzip JSON Lines 文件；
+- replay：完全从 cassette 返回响应，不访问网络、不消耗 token（内存查找，微秒级）；
+- replay_or_record：命中则回放，未命中再调用真实 provider 并录制。
+
+请求指纹 = sha256(规范化 JSON(model, messages, tools, tool_choice, ...))，
+消息内容中的日期/时间戳会先替换为占位符，避免 date_prescribed 等字段导致每次运行指纹不同。
+严格匹配失败时（例如新版本改了 prompt），可按 (model, 工具名) 退化匹配，
+依次返回录制时的响应；settings.llm_cassette_strict=True 时直接报错。
+
+通过 LLM_CASSETTE_MODE / LLM_CASSETTE_PATH 配置，包装在 app/llm_provider.py 的 provider 之外。
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from types import SimpleNamespace as NS
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.llm_provider import LLMProvider
+
+MODES = ("off", "record", "replay", "replay_or_record")
+
+# ISO 日期 / 时间戳（2025-11-22、2025-11-22T10:00:00.123456Z）
+_VOLATILE = re.compile(r"\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?Z?)?")
+
+
+class CassetteMiss(LookupError):
+    """回放模式下 cassette 中没有对应的录制。"""
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return _VOLATILE.sub("<date>", value)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _tool_name(request: Dict[str, Any]) -> Optional[str]:
+    choice = request.get("tool_choice")
+    if isinstance(choice, dict):
+        return (choice.get("function") or {}).get("name")
+    tools = request.get("tools") or []
+    return ((tools[0] if tools else {}).get("function") or {}).get("name")
+
+
+def fingerprint(request: Dict[str, Any]) -> str:
+    canonical = json.dumps(_normalize(request), sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def loose_key(request: Dict[str, Any]) -> str:
+    return f"{request.get('model', '')}:{_tool_name(request) or ''}"
+
+
+def encode_response(response: Any) -> Dict[str, Any]:
+    """只保留 llm_tools 用到的字段，保证 cassette 紧凑。"""
+    message = response.choices[0].message
+    usage = getattr(response, "usage", None)
+    return {
+        "model": getattr(response, "model", None),
+        "content": getattr(message, "content", None),
+        "tool_calls": [
+            {"name": tc.function.name, "arguments": tc.function.arguments}
+            for tc in (getattr(message, "tool_calls", None) or [])
+        ],
+        "usage": {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        } if usage is not None else None,
+    }
+
+
+def decode_response(data: Dict[str, Any]) -> Any:
+    tool_calls = [
+        NS(id=f"call_replay_{i}", type="function", function=NS(name=tc["name"], arguments=tc["arguments"]))
+        for i, tc in enumerate(data.get("tool_calls") or [])
+    ] or None
+    usage = data.get("usage")
+    return NS(
+        model=data.get("model"),
+        choices=[NS(index=0, message=NS(role="assistant", content=data.get("content"), tool_calls=tool_calls))],
+        usage=NS(**usage) if usage else None,
+    )
+
+
+class Cassette:
+    """gzip JSON Lines 文件；每条记录单独一个 gzip member，追加写入即可，崩溃也不会损坏已有内容。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._by_fp: Dict[str, Dict[str, Any]] = {}
+        self._by_loose: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._loose_cursor: Dict[str, int] = defaultdict(int)
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._index(json.loads(line))
+
+    def _index(self, entry: Dict[str, Any]) -> None:
+        self._by_fp[entry["fp"]] = entry
+        self._by_loose[entry["loose"]].append(entry)
+
+    def __len__(self) -> int:
+        return len(self._by_fp)
+
+    def lookup(self, request: Dict[str, Any], strict: bool = True) -> Optional[Dict[str, Any]]:
+        entry = self._by_fp.get(fingerprint(request))
+        if entry is not None or strict:
+            return entry
+        candidates = self._by_loose.get(loose_key(request))
+        if not candidates:
+            return None
+        key = loose_key(request)
+        with self._lock:
+            i = self._loose_cursor[key]
+            self._loose_cursor[key] = i + 1
+        return candidates[i % len(candidates)]
+
+    def record(self, request: Dict[str, Any], response: Any, latency_s: float) -> None:
+        entry = {
+            "fp": fingerprint(request),
+            "loose": loose_key(request),
+            "tool": _tool_name(request),
+            "latency_ms": round(latency_s * 1000, 1),
+            "recorded_at": time.time(),
+            "response": encode_response(response),
+        }
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+            self._index(entry)
+
+
+class CassetteProvider(LLMProvider):
+    """包装任意 provider，实现 record / replay / replay_or_record。"""
+
+    name = "cassette"
+
+    def __init__(
+        self,
+        inner: Optional[LLMProvider],
+        cassette: Cassette,
+        mode: str = "replay",
+        strict: bool = False,
+        replay_latency: bool = False,
+    ):
+        if mode not in MODES or mode == "off":
+            raise ValueError(f"unsupported cassette mode: {mode}")
+        self.inner = inner
+        self.cassette = cassette
+        self.mode = mode
+        self.strict = strict
+        self.replay_latency = replay_latency
+        self.hits = 0
+        self.misses = 0
+
+    def chat_completion(self, **kwargs) -> Any:
+        if self.mode in ("replay", "replay_or_record"):
+            entry = self.cassette.lookup(kwargs, strict=self.strict)
+            if entry is not None:
+                self.hits += 1
+                if self.replay_latency:
+                    time.sleep(entry.get("latency_ms", 0) / 1000.0)
+                return decode_response(entry["response"])
+            self.misses += 1
+            if self.mode == "replay":
+                raise CassetteMiss(
+                    f"no recording for tool={_tool_name(kwargs)} fingerprint={fingerprint(kwargs)[:12]} "
+                    f"in {self.cassette.path}"
+                )
+
+        if self.inner is None:
+            raise RuntimeError("cassette record mode needs an underlying LLM provider")
+        start = time.perf_counter()
+        response = self.inner.chat_completion(**kwargs)
+        self.cassette.record(kwargs, response, time.perf_counter() - start)
+        return response
+
+
+def wrap(inner: LLMProvider, mode: str, path: str, strict: bool = False, replay_latency: bool = False) -> LLMProvider:
+    if mode == "off":
+        return inner
+    return CassetteProvider(inner, Cassette(path), mode=mode, strict=strict, replay_latency=replay_latency)
+
+
+def stats(path: str) -> Tuple[int, Dict[str, int]]:
+    """返回 (记录数, 按工具计数)，用于检查 cassette 内容。"""
+    cassette = Cassette(path)
+    per_tool: Dict[str, int] = defaultdict(int)
+    for entry in cassette._by_fp.values():
+        per_tool[entry.get("tool") or ""] += 1
+    return len(cassette), dict(per_tool)
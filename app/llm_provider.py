@@ -0,0 +1,272 @@
+"""
+可插拔的 LLM 后端。
+
+llm_tools 只依赖 chat_completion(**kwargs) 返回的 OpenAI 风格响应对象
+（response.choices[0].message.tool_calls[0].function.arguments + response.usage），
+因此任何实现了该方法的 provider 都可以替换真实的 OpenAI 客户端：
+
+- OpenAIProvider：真实调用；OpenAI 客户端在第一次调用时才构造，
+  未配置 OPENAI_API_KEY 时只有真正调用 LLM 才会报错。
+- FakeLLMProvider：本地确定性实现，按 tools_spec 的 JSON Schema 生成合法的
+  tool_call 参数，可配置延迟分布和故障注入，用于离线测试与容量规划。
+
+通过 settings.llm_provider（环境变量 LLM_PROVIDER=openai|fake）选择，
+或在脚本中调用 set_provider() 替换；LLM_CASSETTE_MODE 不为 off 时外面再包一层
+录制/回放（见 app/llm_cassette.py）。
+"""
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace as NS
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import model_router
+from app.config import settings
+
+
+class LLMProvider:
+    name = "base"
+
+    def chat_completion(self, **kwargs) -> Any:
+        raise NotImplementedError
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    api_key = self.api_key or settings.openai_api_key
+                    if not api_key:
+                        raise RuntimeError("OPENAI_API_KEY is not configured (or set LLM_PROVIDER=fake)")
+                    from openai import OpenAI  # 延迟导入，避免拖慢启动
+
+                    self._client = OpenAI(api_key=api_key)
+        return self._client
+
+    def chat_completion(self, **kwargs) -> Any:
+        return self.client.chat.completions.create(**kwargs)
+
+
+# ---------------- Fake provider ----------------
+
+# 常见字段的示例值；未列出的字符串字段用 "<字段名> (synthetic)"
+_SAMPLE_STRINGS: Dict[str, Optional[str]] = {
+    "prescriber_id": "DOC001",
+    "medication_name": "Amoxicillin",
+    "medication_strength": "500mg",
+    "medication_form": "Capsule",
+    "dosage_instructions": "Take 1 capsule by mouth three times daily for 7 days",
+    "expiry_date": "2025-12-31",
+    "status": "active",
+    "notes": "Generated by the fake LLM provider.",
+    "department": "General Medicine",
+    "test_type": "Complete Blood Count",
+    "test_code": "CBC",
+    "clinical_info": "Baseline blood work according to the latest diagnosis.",
+    "priority": "Routine",
+    "result_date": None,
+}
+_SAMPLE_INTS = {"quantity": 21, "refills_allowed": 0}
+
+# 不同工具的状态字段取值不同（requisition 使用 Pending）
+_TOOL_OVERRIDES: Dict[str, Dict[str, Any]] = {
+    "propose_orders_from_diagnosis": {"requisition": {"status": "Pending"}},
+    "propose_completed_requisition": {"status": "Pending"},
+}
+
+FAILURE_MODES = ("error", "timeout", "no_tool_call", "bad_json")
+
+
+class FakeLLMError(RuntimeError):
+    """FakeLLMProvider 注入的故障。"""
+
+
+def sample_from_schema(schema: Dict[str, Any], name: str = "") -> Any:
+    """按 JSON Schema 生成一个确定的合法值（覆盖本项目 tools_spec 用到的子集）。"""
+    types = schema.get("type", "string")
+    if isinstance(types, list):
+        nullable = "null" in types
+        types = next((t for t in types if t != "null"), "null")
+        if nullable and name in _SAMPLE_STRINGS and _SAMPLE_STRINGS[name] is None:
+            return None
+    if types == "object":
+        return {key: sample_from_schema(sub, key) for key, sub in schema.get("properties", {}).items()}
+    if types == "array":
+        return [sample_from_schema(schema.get("items", {}), name)]
+    if types == "integer":
+        return _SAMPLE_INTS.get(name, 1)
+    if types == "number":
+        return float(_SAMPLE_INTS.get(name, 1))
+    if types == "boolean":
+        return False
+    if types == "null":
+        return None
+    value = _SAMPLE_STRINGS.get(name)
+    return value if value is not None else f"{name or 'value'} (synthetic)"
+
+
+def _merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge(base[key], value)
+        elif key in base:
+            base[key] = value
+    return base
+
+
+class FakeLLMProvider(LLMProvider):
+    """
+    确定性的本地 LLM。
+
+    latency_dist:
+      fixed      每次 latency_ms
+      normal     N(latency_ms, jitter_ms)，截断到 >= 0
+      lognormal  中位数 latency_ms，jitter_ms 为 sigma*1000（例如 500 -> sigma 0.5），带长尾
+      uniform    [latency_ms - jitter_ms, latency_ms + jitter_ms]
+    model_latency_ms: 按模型覆盖 latency_ms（用于验证模型路由的延迟切换）。
+    failure_rate: 每次调用注入故障的概率；failure_modes 为候选故障类型（见 FAILURE_MODES）。
+    延迟通过阻塞 sleep 模拟，与同步 OpenAI 客户端在工作线程中的行为一致。
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        latency_dist: str = "fixed",
+        failure_rate: float = 0.0,
+        failure_modes: Optional[List[str]] = None,
+        timeout_s: float = 60.0,
+        seed: int = 0,
+        model_latency_ms: Optional[Dict[str, float]] = None,
+    ):
+        if latency_dist not in ("fixed", "normal", "lognormal", "uniform"):
+            raise ValueError(f"unknown latency distribution: {latency_dist}")
+        modes = list(failure_modes or ["error"])
+        unknown = set(modes) - set(FAILURE_MODES)
+        if unknown:
+            raise ValueError(f"unknown failure modes: {sorted(unknown)}")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.latency_dist = latency_dist
+        self.failure_rate = failure_rate
+        self.failure_modes = modes
+        self.timeout_s = timeout_s
+        self.model_latency_ms = dict(model_latency_ms or {})
+        self.calls = 0
+        self.failures = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self, model: str = "") -> Tuple[float, Optional[str]]:
+        base = self.model_latency_ms.get(model, self.latency_ms)
+        with self._lock:
+            self.calls += 1
+            rng = self._rng
+            if self.latency_dist == "normal":
+                ms = rng.gauss(base, self.jitter_ms)
+            elif self.latency_dist == "lognormal":
+                ms = base * rng.lognormvariate(0.0, self.jitter_ms / 1000.0)
+            elif self.latency_dist == "uniform":
+                ms = rng.uniform(base - self.jitter_ms, base + self.jitter_ms)
+            else:
+                ms = base
+            failure = None
+            if self.failure_rate and rng.random() < self.failure_rate:
+                failure = rng.choice(self.failure_modes)
+                self.failures += 1
+        return max(0.0, ms) / 1000.0, failure
+
+    def chat_completion(
+        self,
+        model: str = "",
+        messages: Optional[List[Dict[str, Any]]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        **kwargs,
+    ) -> Any:
+        delay, failure = self._draw(model)
+        if failure == "timeout":
+            time.sleep(self.timeout_s)
+            raise FakeLLMError(f"injected timeout after {self.timeout_s:.1f}s")
+        if delay:
+            time.sleep(delay)
+        if failure == "error":
+            raise FakeLLMError("injected upstream error")
+
+        function = (tools or [{}])[0].get("function", {})
+        fn_name = function.get("name")
+        arguments = sample_from_schema(function.get("parameters", {"type": "object"}))
+        _merge(arguments, _TOOL_OVERRIDES.get(fn_name, {}))
+        raw_arguments = json.dumps(arguments)
+        if failure == "bad_json":
+            raw_arguments = raw_arguments[: len(raw_arguments) // 2]
+
+        tool_calls = None if failure == "no_tool_call" else [
+            NS(id=f"call_fake_{self.calls}", type="function", function=NS(name=fn_name, arguments=raw_arguments))
+        ]
+        prompt_chars = sum(len(m.get("content") or "") for m in messages or [])
+        return NS(
+            model=model,
+            choices=[NS(index=0, finish_reason="tool_calls", message=NS(role="assistant", content=None, tool_calls=tool_calls))],
+            usage=NS(prompt_tokens=prompt_chars // 4, completion_tokens=len(raw_arguments) // 4),
+        )
+
+
+def _build_from_settings() -> LLMProvider:
+    if settings.llm_provider == "fake":
+        modes = [m.strip() for m in (settings.llm_fake_failure_modes or "").split(",") if m.strip()]
+        return FakeLLMProvider(
+            latency_ms=settings.llm_fake_latency_ms,
+            jitter_ms=settings.llm_fake_jitter_ms,
+            latency_dist=settings.llm_fake_latency_dist,
+            failure_rate=settings.llm_fake_failure_rate,
+            failure_modes=modes or None,
+            seed=settings.llm_fake_seed,
+            model_latency_ms={
+                model: float(ms) for model, ms in model_router.parse_mapping(settings.llm_fake_model_latency_ms).items()
+            },
+        )
+    if settings.llm_provider == "openai":
+        return OpenAIProvider()
+    raise ValueError(f"unknown LLM_PROVIDER: {settings.llm_provider}")
+
+
+_provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> LLMProvider:
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                provider = _build_from_settings()
+                if settings.llm_cassette_mode != "off":
+                    from app import llm_cassette
+
+                    provider = llm_cassette.wrap(
+                        provider,
+                        settings.llm_cassette_mode,
+                        settings.llm_cassette_path,
+                        strict=settings.llm_cassette_strict,
+                        replay_latency=settings.llm_cassette_replay_latency,
+                    )
+                _provider = provider
+    return _provider
+
+
+def set_provider(provider: Optional[LLMProvider]) -> None:
+    """替换当前 provider；传 None 则下次调用时按 settings 重新构造。"""
+    global _provider
+    _provider = provider
@@ -1,12 +1,44 @@
 import json
-from typing import Dict, Any
-from openai import OpenAI
-from app.config import settings
+from typing import Any, Dict, Optional, Tuple
 from datetime import datetime, timedelta
-from . import crud, schemas
+from . import crud, llm_provider, metrics, model_router, order_templates, precheck, schemas, tracing
+from .config import settings
 import time # 引入 time 模块用于计时
 
-client = OpenAI(api_key=settings.openai_api_key)
+
+def _chat_completion(tool_name: str, simple: bool = False, **kwargs) -> Any:
+    """
+    统一的 LLM 调用入口：由模型路由（app/model_router.py）选择模型，转发给当前 provider
+    （OpenAI 或本地 fake，见 app/llm_provider.py），并按 tool / model 记录延迟与 token 用量。
+    simple=True 表示这次调用的改动很小（补全时表单只缺少少量字段），可以使用更便宜的模型。
+    """
+    router = model_router.get_router()
+    model, reason = router.select(tool_name, simple=simple)
+    kwargs["model"] = model
+    metrics.LLM_ROUTED.inc(tool=tool_name, model=model, reason=reason)
+    start = time.perf_counter()
+    outcome = "error"
+    prompt_tokens = completion_tokens = 0
+    with tracing.span("llm.chat_completion", tool=tool_name, model=model, route=reason) as sp:
+        try:
+            response = llm_provider.get_provider().chat_completion(**kwargs)
+            outcome = "ok"
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+                completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.LLM_REQUEST_SECONDS.observe(elapsed, tool=tool_name, model=model, outcome=outcome)
+            router.record(model, elapsed, prompt_tokens, completion_tokens, ok=outcome == "ok")
+        if usage is not None:
+            metrics.LLM_TOKENS.inc(prompt_tokens, tool=tool_name, model=model, kind="prompt")
+            metrics.LLM_TOKENS.inc(completion_tokens, tool=tool_name, model=model, kind="completion")
+            if sp is not None:
+                sp.set_attribute("prompt_tokens", prompt_tokens)
+                sp.set_attribute("completion_tokens", completion_tokens)
+    return response
+
 
 # --- 统一的工具注册和执行机制 ---
 
@@ -18,13 +50,26 @@ def register_tool(func):
     TOOLS[func.__name__] = func
     return func
 
-def execute_tool(function_name: str, arguments: Dict[str, Any]) -> Any:
-    """根据函数名和参数执行一个已注册的工具。"""
+def execute_tool(function_name: str, arguments: Dict[str, Any], model: Optional[str] = None) -> Any:
+    """
+    根据函数名和参数执行一个已注册的工具。
+    model 不为空时，这次工具调用中的所有 LLM 调用都使用该模型（不经过路由）。
+    """
     if function_name not in TOOLS:
         raise ValueError(f"Unknown tool: {function_name}")
     func = TOOLS[function_name]
     # 注意：我们的工具函数都希望接收一个名为 'args' 的字典
-    return func(args=arguments)
+    with tracing.span(f"tool.{function_name}"), model_router.pinned(model):
+        return func(args=arguments)
+
+
+# 补全工具允许 LLM 修改的字段；已有表单中为空的字段很少时补全走便宜的模型
+# （requisition 的 result_date 通常为空，不计入）
+_PRESCRIPTION_EDITABLE = [
+    "medication_name", "medication_strength", "medication_form", "dosage_instructions",
+    "quantity", "refills_allowed", "expiry_date", "status", "notes",
+]
+_REQUISITION_EDITABLE = ["department", "test_type", "test_code", "clinical_info", "priority", "status", "notes"]
 
 
 # --- 底层工具：负责将结构化数据写入数据库 ---
@@ -148,6 +193,98 @@ def tool_create_requisition_from_latest_diagnosis(args: Dict[str, Any]) -> Dict[
 
 # --- 高层工作流工具：封装了 AI 推理和底层工具调用 ---
 
+def _design_orders_with_llm(patient_id: int, diag_desc: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """让 LLM 根据诊断描述设计一张处方和一张检验申请（只返回字段，不入库）。"""
+    # 调用 LLM（function calling）生成两套结构化字段
+    print(f"[DEBUG] Step 2: Calling OpenAI API to design orders...")
+    system_prompt = (
+        "You are a clinical decision support assistant. "
+        "Given a patient's latest diagnosis description, you MUST design "
+        "one medication prescription and one lab requisition. "
+        "You MUST respond ONLY via the provided JSON tool schema. "
+        "Do NOT output natural-language text."
+    )
+
+    user_prompt = (
+        f"Patient id: {patient_id}\n"
+        f"Latest diagnosis_description:\n"
+        f"--------------------\n{diag_desc}\n--------------------\n"
+        "1) Propose an appropriate medication-based treatment plan.\n"
+        "2) Propose an appropriate lab investigation plan.\n"
+        "3) You MUST NOT invent any pharmacy_id or lab_id.\n"
+        "4) You MUST fill all required fields in the JSON schema."
+    )
+
+    tools_spec = [
+        {
+            "type": "function",
+            "function": {
+                "name": "propose_orders_from_diagnosis",
+                "description": "Propose both a prescription and a requisition payload.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "prescription": {
+                            "type": "object",
+                            "properties": {
+                                "prescriber_id": {"type": "string"},
+                                "medication_name": {"type": "string"},
+                                "medication_strength": {"type": "string"},
+                                "medication_form": {"type": "string"},
+                                "dosage_instructions": {"type": "string"},
+                                "quantity": {"type": "integer"},
+                                "refills_allowed": {"type": "integer"},
+                                "status": {"type": "string"},
+                                "notes": {"type": "string"}
+                            },
+                            "required": ["prescriber_id", "medication_name", "medication_strength", "medication_form", "dosage_instructions", "quantity", "refills_allowed"]
+                        },
+                        "requisition": {
+                            "type": "object",
+                            "properties": {
+                                "department": {"type": "string"},
+                                "test_type": {"type": "string"},
+                                "test_code": {"type": ["string", "null"]},
+                                "clinical_info": {"type": "string"},
+                                "priority": {"type": "string"},
+                                "status": {"type": "string"},
+                                "notes": {"type": ["string", "null"]}
+                            },
+                            "required": ["department", "test_type", "clinical_info", "priority"]
+                        }
+                    },
+                    "required": ["prescription", "requisition"]
+                }
+            }
+        }
+    ]
+
+    llm_start_time = time.time()
+    response = _chat_completion(
+        "tool_generate_orders_from_latest_diagnosis",
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        tools=tools_spec,
+        tool_choice={"type": "function", "function": {"name": "propose_orders_from_diagnosis"}},
+    )
+    llm_end_time = time.time()
+    print(f"[DEBUG] Step 2: OpenAI API call successful. Time taken: {llm_end_time - llm_start_time:.2f} seconds.")
+
+    msg = response.choices[0].message
+    if not msg.tool_calls:
+        raise ValueError("Model did not output tool calls for propose_orders_from_diagnosis")
+
+    tc = msg.tool_calls[0]
+    tool_args = json.loads(tc.function.arguments)
+
+    prescription_design = tool_args["prescription"]
+    requisition_design = tool_args["requisition"]
+    print("[DEBUG] Step 2: Successfully parsed AI-generated prescription and requisition designs.")
+    return prescription_design, requisition_design
+
+
 @register_tool
 def tool_generate_orders_from_latest_diagnosis(args: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -156,7 +293,12 @@ def tool_generate_orders_from_latest_diagnosis(args: Dict[str, Any]) -> Dict[str
     PURPOSE:
       High-level workflow tool. For a given patient_id, automatically:
         1) Reads the latest diagnosis_description of this patient.
-        2) Asks an AI to design a prescription and a lab requisition.
+        2) Reuses a learned order template for a common diagnosis (high-confidence
+           match on diagnosis_code + description, learned from orders clinicians
+           actually faxed; see app/order_templates.py). The template only carries
+           the regimen fields: prescriber_id is the diagnosing doctor and
+           clinical_info is the current diagnosis description. Otherwise asks an
+           AI to design a prescription and a lab requisition.
         3) Persists BOTH records into the database via other tools.
 
     INPUT (args dict):
@@ -169,7 +311,9 @@ def tool_generate_orders_from_latest_diagnosis(args: Dict[str, Any]) -> Dict[str
         "patient_id": <int>,
         "diagnosis": {...latest diagnosis row...},
         "prescription": {...created prescription row...},
-        "requisition": {...created requisition row...}
+        "requisition": {...created requisition row...},
+        "source": "llm" | "template",       # "template": a learned order set was reused (no LLM call)
+        "template_confidence": <float|null>
       }
     """
     start_time = time.time()
@@ -180,7 +324,8 @@ def tool_generate_orders_from_latest_diagnosis(args: Dict[str, Any]) -> Dict[str
 
         # 1) 获取最新诊断
         print(f"[DEBUG] Step 1: Fetching latest diagnosis for patient_id={patient_id}...")
-        dx = crud.get_latest_diagnosis_by_patient(patient_id)
+        with tracing.span("step.fetch_latest_diagnosis", patient_id=patient_id):
+            dx = crud.get_latest_diagnosis_by_patient(patient_id)
         if not dx:
             raise ValueError(f"No latest diagnosis found for patient_id={patient_id}")
         print(f"[DEBUG] Step 1: Success. Diagnosis found.")
@@ -190,93 +335,24 @@ def tool_generate_orders_from_latest_diagnosis(args: Dict[str, Any]) -> Dict[str
             raise ValueError(f"Latest diagnosis for patient_id={patient_id} has empty description")
         print(f"[DEBUG] Diagnosis description: '{diag_desc[:100]}...'")
 
-        # 2) 调用 LLM（function calling）生成两套结构化字段
-        print(f"[DEBUG] Step 2: Calling OpenAI API to design orders...")
-        system_prompt = (
-            "You are a clinical decision support assistant. "
-            "Given a patient's latest diagnosis description, you MUST design "
-            "one medication prescription and one lab requisition. "
-            "You MUST respond ONLY via the provided JSON tool schema. "
-            "Do NOT output natural-language text."
-        )
-
-        user_prompt = (
-            f"Patient id: {patient_id}\n"
-            f"Latest diagnosis_description:\n"
-            f"--------------------\n{diag_desc}\n--------------------\n"
-            "1) Propose an appropriate medication-based treatment plan.\n"
-            "2) Propose an appropriate lab investigation plan.\n"
-            "3) You MUST NOT invent any pharmacy_id or lab_id.\n"
-            "4) You MUST fill all required fields in the JSON schema."
-        )
-
-        tools_spec = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "propose_orders_from_diagnosis",
-                    "description": "Propose both a prescription and a requisition payload.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "prescription": {
-                                "type": "object",
-                                "properties": {
-                                    "prescriber_id": {"type": "string"},
-                                    "medication_name": {"type": "string"},
-                                    "medication_strength": {"type": "string"},
-                                    "medication_form": {"type": "string"},
-                                    "dosage_instructions": {"type": "string"},
-                                    "quantity": {"type": "integer"},
-                                    "refills_allowed": {"type": "integer"},
-                                    "status": {"type": "string"},
-                                    "notes": {"type": "string"}
-                                },
-                                "required": ["prescriber_id", "medication_name", "medication_strength", "medication_form", "dosage_instructions", "quantity", "refills_allowed"]
-                            },
-                            "requisition": {
-                                "type": "object",
-                                "properties": {
-                                    "department": {"type": "string"},
-                                    "test_type": {"type": "string"},
-                                    "test_code": {"type": ["string", "null"]},
-                                    "clinical_info": {"type": "string"},
-                                    "priority": {"type": "string"},
-                                    "status": {"type": "string"},
-                                    "notes": {"type": ["string", "null"]}
-                                },
-                                "required": ["department", "test_type", "clinical_info", "priority"]
-                            }
-                        },
-                        "required": ["prescription", "requisition"]
-                    }
-                }
-            }
-        ]
-
-        llm_start_time = time.time()
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            tools=tools_spec,
-            tool_choice={"type": "function", "function": {"name": "propose_orders_from_diagnosis"}},
-        )
-        llm_end_time = time.time()
-        print(f"[DEBUG] Step 2: OpenAI API call successful. Time taken: {llm_end_time - llm_start_time:.2f} seconds.")
-
-        msg = response.choices[0].message
-        if not msg.tool_calls:
-            raise ValueError("Model did not output tool calls for propose_orders_from_diagnosis")
-
-        tc = msg.tool_calls[0]
-        tool_args = json.loads(tc.function.arguments)
-
-        prescription_design = tool_args["prescription"]
-        requisition_design = tool_args["requisition"]
-        print("[DEBUG] Step 2: Successfully parsed AI-generated prescription and requisition designs.")
+        # 2) 常见诊断直接使用已学到的医嘱模板；没有高置信的模板时调用 LLM（function calling）设计
+        #    模板只有方案字段：处方医生取当前诊断的医生，临床信息取当前诊断描述（需要诊断带 doctor_id）
+        source, template_confidence = "llm", None
+        store = order_templates.get_store()
+        match = None
+        if store is not None and dx.get("doctor_id") is not None:
+            with tracing.span("step.order_template_lookup") as sp:
+                match, lookup_result = store.lookup(dx.get("diagnosis_code"), diag_desc)
+                if sp is not None:
+                    sp.set_attribute("result", lookup_result)
+            metrics.ORDER_TEMPLATE_LOOKUPS.inc(result=lookup_result)
+        if match is not None:
+            print(f"[DEBUG] Step 2: Using order template {match.key} (confidence {match.confidence:.2f}, support {match.support}).")
+            prescription_design = {**match.prescription, "prescriber_id": str(dx["doctor_id"])}
+            requisition_design = {**match.requisition, "clinical_info": diag_desc}
+            source, template_confidence = "template", match.confidence
+        else:
+            prescription_design, requisition_design = _design_orders_with_llm(patient_id, diag_desc)
 
         # 3) 用生成的字段 + patient_id 调用底层两个工具完成真正入库
         print("[DEBUG] Step 3: Persisting generated orders into the database...")
@@ -284,18 +360,27 @@ def tool_generate_orders_from_latest_diagnosis(args: Dict[str, Any]) -> Dict[str
         req_args = {"patient_id": patient_id, **requisition_design}
 
         print("[DEBUG] Creating prescription...")
-        created_pres = tool_create_prescription_from_latest_diagnosis(pres_args)
+        with tracing.span("step.create_prescription"):
+            created_pres = tool_create_prescription_from_latest_diagnosis(pres_args)
         print("[DEBUG] Prescription created successfully.")
 
         print("[DEBUG] Creating requisition...")
-        created_req = tool_create_requisition_from_latest_diagnosis(req_args)
+        with tracing.span("step.create_requisition"):
+            created_req = tool_create_requisition_from_latest_diagnosis(req_args)
         print("[DEBUG] Requisition created successfully.")
 
+        # 记录两张表单的来源诊断：传真发送成功后按这条诊断学习医嘱模板
+        if store is not None:
+            order_templates.record_origin("prescription", (created_pres or {}).get("prescription_id"), dx.get("diagnosis_id"))
+            order_templates.record_origin("requisition", (created_req or {}).get("requisition_id"), dx.get("diagnosis_id"))
+
         final_result = {
             "patient_id": patient_id,
             "diagnosis": dx,
             "prescription": created_pres,
             "requisition": created_req,
+            "source": source,
+            "template_confidence": template_confidence,
         }
 
         end_time = time.time()
@@ -342,14 +427,19 @@ def tool_complete_prescription_from_diagnosis(args: Dict[str, Any]) -> Dict[str,
            - notes
          based on diagnosis_description and current prescription content.
       4) Call crud.update_prescription(...) to persist changes.
-      5) Return the updated prescription row as dict.
+      5) Return the updated prescription row as dict, plus "llm_skipped": false.
+
+      If every editable field is already filled and neither the latest diagnosis
+      nor the form changed since the last completion, steps 3-4 are skipped and the
+      existing row is returned with "llm_skipped": true.
     """
     start_time = time.time()
     patient_id = int(args["patient_id"])
     prescription_id = str(args["prescription_id"])
 
     # 1) 获取最新诊断
-    dx = crud.get_latest_diagnosis_by_patient(patient_id)
+    with tracing.span("step.fetch_latest_diagnosis", patient_id=patient_id):
+        dx = crud.get_latest_diagnosis_by_patient(patient_id)
     if not dx:
         raise ValueError(f"No latest diagnosis found for patient_id={patient_id}")
     diag_desc = (dx.get("diagnosis_description") or "").strip()
@@ -357,10 +447,18 @@ def tool_complete_prescription_from_diagnosis(args: Dict[str, Any]) -> Dict[str,
         raise ValueError(f"Latest diagnosis for patient_id={patient_id} has empty description")
 
     # 2) 获取已有处方
-    pres = crud.get_prescription(prescription_id)
+    with tracing.span("step.fetch_prescription", prescription_id=prescription_id):
+        pres = crud.get_prescription(prescription_id)
     if not pres:
         raise ValueError(f"Prescription with id={prescription_id} not found")
 
+    # 已完整且自上次补全以来诊断和表单都没有变化：不调用 LLM
+    checker = precheck.get_precheck()
+    if checker is not None and checker.unchanged("prescription", prescription_id, dx, pres, _PRESCRIPTION_EDITABLE):
+        metrics.COMPLETION_PRECHECK.inc(kind="prescription", result="skipped")
+        print(f"[DEBUG] tool_complete_prescription_from_diagnosis: {prescription_id} unchanged, LLM skipped")
+        return {**pres, "llm_skipped": True}
+
     # 保留原 pharmacy_id，不允许 AI 修改
     original_pharmacy_id = pres.get("pharmacy_id")
 
@@ -429,8 +527,9 @@ def tool_complete_prescription_from_diagnosis(args: Dict[str, Any]) -> Dict[str,
         }
     ]
 
-    resp = client.chat.completions.create(
-        model="gpt-4.1-mini",
+    resp = _chat_completion(
+        "tool_complete_prescription_from_diagnosis",
+        simple=model_router.is_simple_completion(pres, _PRESCRIPTION_EDITABLE, settings.llm_simple_max_missing),
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
@@ -459,15 +558,20 @@ def tool_complete_prescription_from_diagnosis(args: Dict[str, Any]) -> Dict[str,
         notes=tool_args.get("notes"),
     )
 
-    updated = crud.update_prescription(prescription_id, update_payload) or pres
+    with tracing.span("step.update_prescription", prescription_id=prescription_id):
+        updated = crud.update_prescription(prescription_id, update_payload) or pres
 
     # 强制确保 pharmacy_id 不被修改
     if updated.get("pharmacy_id") != original_pharmacy_id:
         updated["pharmacy_id"] = original_pharmacy_id
 
+    if checker is not None:
+        metrics.COMPLETION_PRECHECK.inc(kind="prescription", result="llm")
+        checker.remember("prescription", prescription_id, dx, updated, _PRESCRIPTION_EDITABLE)
+
     end_time = time.time()
     print(f"[DEBUG] tool_complete_prescription_from_diagnosis finished in {end_time - start_time:.2f}s")
-    return updated
+    return {**updated, "llm_skipped": False}
 
 
 # --- 新增：补全已有 REQUISITION_FORM（不改 lab_id） ---
@@ -502,23 +606,35 @@ def tool_complete_requisition_from_diagnosis(args: Dict[str, Any]) -> Dict[str,
            - notes
          based on diagnosis_description and current requisition content.
       4) Call crud.update_requisition(...) to persist changes.
-      5) Return the updated requisition row as dict.
+      5) Return the updated requisition row as dict, plus "llm_skipped": false.
+
+      If every editable field (except result_date) is already filled and neither the
+      latest diagnosis nor the form changed since the last completion, steps 3-4 are
+      skipped and the existing row is returned with "llm_skipped": true.
     """
     start_time = time.time()
     patient_id = int(args["patient_id"])
     requisition_id = str(args["requisition_id"])
 
-    dx = crud.get_latest_diagnosis_by_patient(patient_id)
+    with tracing.span("step.fetch_latest_diagnosis", patient_id=patient_id):
+        dx = crud.get_latest_diagnosis_by_patient(patient_id)
     if not dx:
         raise ValueError(f"No latest diagnosis found for patient_id={patient_id}")
     diag_desc = (dx.get("diagnosis_description") or "").strip()
     if not diag_desc:
         raise ValueError(f"Latest diagnosis for patient_id={patient_id} has empty description")
 
-    req = crud.get_requisition(requisition_id)
+    with tracing.span("step.fetch_requisition", requisition_id=requisition_id):
+        req = crud.get_requisition(requisition_id)
     if not req:
         raise ValueError(f"Requisition with id={requisition_id} not found")
 
+    checker = precheck.get_precheck()
+    if checker is not None and checker.unchanged("requisition", requisition_id, dx, req, _REQUISITION_EDITABLE):
+        metrics.COMPLETION_PRECHECK.inc(kind="requisition", result="skipped")
+        print(f"[DEBUG] tool_complete_requisition_from_diagnosis: {requisition_id} unchanged, LLM skipped")
+        return {**req, "llm_skipped": True}
+
     original_lab_id = req.get("lab_id")
 
     system_prompt = (
@@ -581,8 +697,9 @@ def tool_complete_requisition_from_diagnosis(args: Dict[str, Any]) -> Dict[str,
         }
     ]
 
-    resp = client.chat.completions.create(
-        model="gpt-4.1-mini",
+    resp = _chat_completion(
+        "tool_complete_requisition_from_diagnosis",
+        simple=model_router.is_simple_completion(req, _REQUISITION_EDITABLE, settings.llm_simple_max_missing),
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
@@ -609,13 +726,18 @@ def tool_complete_requisition_from_diagnosis(args: Dict[str, Any]) -> Dict[str,
         notes=tool_args.get("notes"),
     )
 
-    updated = crud.update_requisition(requisition_id, update_payload) or req
+    with tracing.span("step.update_requisition", requisition_id=requisition_id):
+        updated = crud.update_requisition(requisition_id, update_payload) or req
 
     # 强制确保 lab_id 不被修改
     if updated.get("lab_id") != original_lab_id:
         updated["lab_id"] = original_lab_id
 
+    if checker is not None:
+        metrics.COMPLETION_PRECHECK.inc(kind="requisition", result="llm")
+        checker.remember("requisition", requisition_id, dx, updated, _REQUISITION_EDITABLE)
+
     end_time = time.time()
     print(f"[DEBUG] tool_complete_requisition_from_diagnosis finished in {end_time - start_time:.2f}s")
-    return updated
+    return {**updated, "llm_skipped": False}
 
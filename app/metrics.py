@@ -0,0 +1,470 @@
+"""
+进程内指标（Prometheus 文本格式，/metrics 暴露）。
+
+只实现本项目用到的 Counter / Gauge / Histogram，不引入 prometheus_client 依赖。
+热路径上的 observe/inc 只做一次 dict 查找 + 加锁累加。
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 默认延迟桶（秒）：覆盖本地快照命中（毫秒级）到 LLM 调用（数十秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.collect())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        # callback 在抓取时调用，返回 {label 值元组: 数值}
+        self._callback = callback
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        if self._callback is not None:
+            try:
+                items.extend(self._callback().items())
+            except Exception:
+                pass
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [每个桶的计数..., +Inf 计数, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = row
+            row[idx] += 1
+            row[-1] += value
+
+    def time(self, **labels: str) -> "_Timer":
+        """with metric.time(route="..."): ... 计时并 observe。"""
+        return _Timer(self, labels)
+
+    def count(self, **labels: str) -> int:
+        row = self._values.get(self._key(labels))
+        return int(sum(row[:-1])) if row else 0
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, row in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(row[-1])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Iterable[str] = (), callback=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, callback=callback))
+
+
+def histogram(name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+
+# ---------------- 指标定义 ----------------
+
+HTTP_REQUEST_SECONDS = histogram(
+    "ehealth_http_request_duration_seconds",
+    "Latency of HTTP requests by route template.",
+    ("method", "route", "status"),
+)
+HTTP_IN_PROGRESS = gauge(
+    "ehealth_http_requests_in_progress",
+    "HTTP requests currently being served.",
+)
+
+REMOTE_REQUEST_SECONDS = histogram(
+    "ehealth_remote_request_duration_seconds",
+    "Latency of calls to the remote table API by table and verb.",
+    ("table", "verb", "status"),
+)
+SNAPSHOT_READS = counter(
+    "ehealth_snapshot_reads_total",
+    "Remote table snapshot reads by outcome "
+    "(cached/coalesced/not_modified/unchanged are cache hits; delta/full/shared are misses, "
+    "shared meaning the body came from the multi-worker shared store instead of the network; "
+    "stale means the remote failed and the last good snapshot was served).",
+    ("table", "result"),
+)
+
+LLM_REQUEST_SECONDS = histogram(
+    "ehealth_llm_request_duration_seconds",
+    "Latency of LLM chat completion calls by tool and model.",
+    ("tool", "model", "outcome"),
+)
+LLM_TOKENS = counter(
+    "ehealth_llm_tokens_total",
+    "LLM token usage by tool, model and kind (prompt/completion).",
+    ("tool", "model", "kind"),
+)
+
+# 快照读取中视为「命中」的结果
+SNAPSHOT_HIT_RESULTS = ("cached", "coalesced", "not_modified", "unchanged")
+
+
+def _snapshot_hit_ratio() -> Dict[Tuple[str, ...], float]:
+    totals: Dict[str, List[float]] = {}
+    with SNAPSHOT_READS._lock:
+        items = list(SNAPSHOT_READS._values.items())
+    for (table, result), value in items:
+        hit_total = totals.setdefault(table, [0.0, 0.0])
+        if result in SNAPSHOT_HIT_RESULTS:
+            hit_total[0] += value
+        hit_total[1] += value
+    return {(table,): hit / total for table, (hit, total) in totals.items() if total}
+
+
+SNAPSHOT_HIT_RATIO = gauge(
+    "ehealth_snapshot_cache_hit_ratio",
+    "Share of snapshot reads served without re-parsing the table body.",
+    ("table",),
+    callback=_snapshot_hit_ratio,
+)
+
+
+SNAPSHOT_REFRESH_SECONDS = histogram(
+    "ehealth_snapshot_refresh_duration_seconds",
+    "Background snapshot refresh duration by table and outcome.",
+    ("table", "outcome"),
+)
+
+
+def _snapshot_age() -> Dict[Tuple[str, ...], float]:
+    from app import remote
+
+    client = remote.client
+    ages = {}
+    for table in list(client._last_fetch):
+        age = client.age(table)
+        if age is not None:
+            ages[(table,)] = age
+    return ages
+
+
+SNAPSHOT_AGE = gauge(
+    "ehealth_snapshot_age_seconds",
+    "Seconds since each table snapshot was last revalidated against the remote API.",
+    ("table",),
+    callback=_snapshot_age,
+)
+
+
+def _threadpool_stats() -> Dict[Tuple[str, ...], float]:
+    # 只能在事件循环线程中调用（/metrics 为 async endpoint）
+    import anyio.to_thread
+
+    stats = anyio.to_thread.current_default_thread_limiter().statistics()
+    return {
+        ("borrowed",): float(stats.borrowed_tokens),
+        ("total",): float(stats.total_tokens),
+        ("waiting",): float(stats.tasks_waiting),
+    }
+
+
+THREADPOOL = gauge(
+    "ehealth_threadpool_tokens",
+    "Default AnyIO worker threadpool usage (borrowed/total tokens and waiting tasks).",
+    ("state",),
+    callback=_threadpool_stats,
+)
+
+
+FAX_JOBS = counter(
+    "ehealth_fax_jobs_total",
+    "Fax jobs by kind and outcome (queued/sent/retry/failed).",
+    ("kind", "outcome"),
+)
+FAX_BATCH_SECONDS = histogram(
+    "ehealth_fax_batch_duration_seconds",
+    "Time to render and send one batch of faxes to a pharmacy or lab.",
+    ("kind", "outcome"),
+)
+
+DOCUMENT_RENDERS = counter(
+    "ehealth_document_renders_total",
+    "Fax document requests by kind and result (cached = served from the on-disk cache, "
+    "rendered = rendered in the process pool, coalesced = waited for a concurrent render).",
+    ("kind", "result"),
+)
+DOCUMENT_RENDER_SECONDS = histogram(
+    "ehealth_document_render_duration_seconds",
+    "Time spent waiting for a fax document render (cache misses only).",
+    ("kind",),
+)
+
+REMOTE_CIRCUIT_STATE = gauge(
+    "ehealth_remote_circuit_state",
+    "Remote table circuit breaker state (0 closed, 1 half-open, 2 open).",
+    ("table",),
+)
+REMOTE_HEDGES = counter(
+    "ehealth_remote_hedged_requests_total",
+    "Hedged remote GETs by table (sent = a second request was issued, won = the second one answered first).",
+    ("table", "outcome"),
+)
+REMOTE_RETRIES = counter(
+    "ehealth_remote_retries_total",
+    "Remote GET retry outcomes by table (retry, exhausted, rejected = circuit open).",
+    ("table", "outcome"),
+)
+
+
+def _admission_stats() -> Dict[Tuple[str, ...], float]:
+    from app import admission
+
+    return {(state,): value for state, value in admission.stats().items()}
+
+
+ADMISSION_SLOTS = gauge(
+    "ehealth_admission_llm_slots",
+    "Workflow (LLM) admission control: requests holding a slot, requests queued, and the slot limit.",
+    ("state",),
+    callback=_admission_stats,
+)
+ADMISSION_WAIT_SECONDS = histogram(
+    "ehealth_admission_wait_seconds",
+    "Time workflow requests spent queued for an LLM slot.",
+)
+ADMISSION_REJECTED = counter(
+    "ehealth_admission_rejected_total",
+    "Workflow requests rejected with 429 by reason (rate_limited, queue_full, wait_timeout).",
+    ("reason",),
+)
+
+
+LLM_ROUTED = counter(
+    "ehealth_llm_routed_total",
+    "LLM calls by tool, selected model and routing reason (configured, latency, simple, pinned).",
+    ("tool", "model", "reason"),
+)
+
+
+def _llm_model_p95() -> Dict[Tuple[str, ...], float]:
+    from app import model_router
+
+    if model_router._router is None:
+        return {}
+    stats = model_router._router.stats()
+    return {(model,): s["p95_s"] for model, s in stats.items() if s.get("calls")}
+
+
+LLM_MODEL_P95 = gauge(
+    "ehealth_llm_model_rolling_p95_seconds",
+    "Rolling-window p95 LLM latency per model, as used by the model router.",
+    ("model",),
+    callback=_llm_model_p95,
+)
+
+
+ORDER_TEMPLATE_LOOKUPS = counter(
+    "ehealth_order_template_lookups_total",
+    "Diagnosis-to-order template lookups in generate-orders by result (hit, miss, low_confidence).",
+    ("result",),
+)
+
+
+def _order_template_count() -> Dict[Tuple[str, ...], float]:
+    from app import order_templates
+
+    store = order_templates._store
+    return {(): float(len(store))} if store is not None else {}
+
+
+ORDER_TEMPLATES = gauge(
+    "ehealth_order_templates",
+    "Learned diagnosis-to-order templates currently indexed.",
+    callback=_order_template_count,
+)
+
+
+COMPLETION_PRECHECK = counter(
+    "ehealth_completion_precheck_total",
+    "Complete-prescription/requisition calls by kind and result (skipped = form unchanged, LLM not called).",
+    ("kind", "result"),
+)
+
+
+IDEMPOTENCY_REQUESTS = counter(
+    "ehealth_idempotency_requests_total",
+    "POST requests carrying an Idempotency-Key by result "
+    "(new, replayed, waited = replayed after waiting on the first request, conflict, mismatch).",
+    ("result",),
+)
+
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：按路由模板记录请求延迟（比 BaseHTTPMiddleware 开销更低）。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                method=scope.get("method", ""),
+                route=getattr(route, "path", "unmatched"),
+                status=str(status[0]),
+            )
@@ -0,0 +1,187 @@
+"""
+LLM 模型路由：按工具选择模型，按延迟 / 成本切换。
+
+原来三个 LLM 调用都写死 model="gpt-4.1-mini"。这里统一由 llm_tools._chat_completion 调用 select()：
+- 每个工具可以配置自己的模型（LLM_TOOL_MODELS），未配置的使用 LLM_DEFAULT_MODEL；
+- 每个模型在最近 window_s 秒内的调用（延迟、token、成功 / 失败）保存在滚动窗口中；
+  配置了 fallback_model（默认不配置）时，样本数达到 min_samples 且 p95 超过 latency_budget_s
+  就改用 fallback_model（更快的模型）。
+  主模型因此不再收到请求，窗口内的样本过期后自然恢复到主模型；
+- 「补全」类工具在已有表单只缺少少量字段（simple=True）时使用 cheap_model；
+- execute_tool(..., model=...) 可以为一次工具调用固定模型（测试 / 对比时使用）。
+路由结果与每个模型的滚动 p95 导出到 /metrics；FakeLLMProvider 支持按模型配置延迟，可在本地验证切换。
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+
+# execute_tool(model=...) 固定的模型
+_pinned: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_pinned_model", default=None)
+
+
+def parse_mapping(value: str) -> Dict[str, str]:
+    """"tool_a=model_x,tool_b=model_y" -> dict。"""
+    mapping = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            key, model = item.split("=", 1)
+            if key.strip() and model.strip():
+                mapping[key.strip()] = model.strip()
+    return mapping
+
+
+class ModelStats:
+    """单个模型最近 window_s 秒的调用记录。"""
+
+    def __init__(self, window_s: float = 300.0, max_samples: int = 1000):
+        self.window_s = window_s
+        # (时间, 延迟, prompt tokens, completion tokens, 是否成功)
+        self._samples: Deque[Tuple[float, float, int, int, bool]] = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, prompt_tokens: int = 0, completion_tokens: int = 0, ok: bool = True) -> None:
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds, prompt_tokens, completion_tokens, ok))
+
+    def _recent(self) -> List[Tuple[float, float, int, int, bool]]:
+        cutoff = time.monotonic() - self.window_s
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return list(self._samples)
+
+    @staticmethod
+    def _quantile(values: List[float], q: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def p95(self, min_samples: int = 1) -> Optional[float]:
+        latencies = [s[1] for s in self._recent()]
+        if len(latencies) < max(1, min_samples):
+            return None
+        return self._quantile(latencies, 0.95)
+
+    def summary(self) -> Dict[str, float]:
+        samples = self._recent()
+        if not samples:
+            return {"calls": 0}
+        latencies = [s[1] for s in samples]
+        return {
+            "calls": len(samples),
+            "errors": sum(1 for s in samples if not s[4]),
+            "p50_s": self._quantile(latencies, 0.5),
+            "p95_s": self._quantile(latencies, 0.95),
+            "prompt_tokens": sum(s[2] for s in samples),
+            "completion_tokens": sum(s[3] for s in samples),
+        }
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        default_model: str = "gpt-4.1-mini",
+        tool_models: Optional[Dict[str, str]] = None,
+        fallback_model: str = "",
+        latency_budget_s: float = 0.0,
+        cheap_model: str = "",
+        window_s: float = 300.0,
+        min_samples: int = 10,
+    ):
+        self.default_model = default_model
+        self.tool_models = dict(tool_models or {})
+        self.fallback_model = fallback_model
+        self.latency_budget_s = latency_budget_s
+        self.cheap_model = cheap_model
+        self.window_s = window_s
+        self.min_samples = min_samples
+        self._stats: Dict[str, ModelStats] = {}
+        self._lock = threading.Lock()
+
+    def _model_stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(model, ModelStats(self.window_s))
+        return stats
+
+    def over_budget(self, model: str) -> bool:
+        if self.latency_budget_s <= 0:
+            return False
+        p95 = self._model_stats(model).p95(self.min_samples)
+        return p95 is not None and p95 > self.latency_budget_s
+
+    def select(self, tool: str, simple: bool = False) -> Tuple[str, str]:
+        """返回 (模型, 原因)：pinned / simple / latency / configured。"""
+        pinned = _pinned.get()
+        if pinned:
+            return pinned, "pinned"
+        if simple and self.cheap_model:
+            return self.cheap_model, "simple"
+        model = self.tool_models.get(tool, self.default_model)
+        fallback = self.fallback_model
+        if fallback and fallback != model and self.over_budget(model) and not self.over_budget(fallback):
+            return fallback, "latency"
+        return model, "configured"
+
+    def record(self, model: str, seconds: float, prompt_tokens: int = 0, completion_tokens: int = 0, ok: bool = True) -> None:
+        self._model_stats(model).record(seconds, prompt_tokens, completion_tokens, ok)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {model: stats.summary() for model, stats in list(self._stats.items())}
+
+
+@contextmanager
+def pinned(model: Optional[str]):
+    """在 with 块内固定使用 model（None 表示不固定）。"""
+    token = _pinned.set(model)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def is_simple_completion(record: Dict, fields: List[str], max_missing: int) -> bool:
+    """已有表单中为空的可编辑字段不超过 max_missing 个时，补全视为简单。"""
+    if max_missing < 0:
+        return False
+    missing = [f for f in fields if record.get(f) in (None, "")]
+    return len(missing) <= max_missing
+
+
+# ---------------- 对外接口 ----------------
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def _build_from_settings() -> ModelRouter:
+    from .config import settings
+
+    return ModelRouter(
+        default_model=settings.llm_default_model,
+        tool_models=parse_mapping(settings.llm_tool_models),
+        fallback_model=settings.llm_fallback_model,
+        latency_budget_s=settings.llm_latency_budget_s,
+        cheap_model=settings.llm_cheap_model,
+        window_s=settings.llm_route_window_s,
+        min_samples=settings.llm_route_min_samples,
+    )
+
+
+def get_router() -> ModelRouter:
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = _build_from_settings()
+    return _router
+
+
+def set_router(router: Optional[ModelRouter]) -> None:
+    """替换当前路由；传 None 则下次调用时按 settings 重新构造。"""
+    global _router
+    _router = router
+
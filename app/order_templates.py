@@ -0,0 +1,341 @@
+"""
+常见诊断的医嘱模板（诊断 -> 处方 + 检验申请设计）。
+
+很多病人的诊断相同，但 tool_generate_orders_from_latest_diagnosis 每次都让 LLM 重新设计医嘱。
+这里从医生确认发送（传真发送成功）的处方 / 检验申请中学习模板，不从未经审核的 LLM 输出学习：
+- generate-orders 创建表单时记录其来源诊断（order_template_origins）；传真发送线程在发送成功后
+  按来源诊断学习，之后新增的诊断不影响。没有来源诊断的表单（例如手工创建的）不学习；
+- 模板按「规范化的 diagnosis_code + 诊断描述的词集合哈希」存放；描述先小写、去标点和停用词，
+  词序和大小写不同的描述得到同一个键；
+- 只保存取决于诊断的方案字段（药名 / 规格 / 剂型 / 剂量说明 / 数量 / 续药次数；科室 / 检验类型 /
+  代码 / 优先级）。处方医生、备注、临床信息、状态等与病人或医生相关的字段不保存，命中时由调用方
+  按当前上下文填写；
+- 处方和检验申请分别学习：同一个键下方案字段与已有模板完全一致时该部分 support + 1，
+  不一致时 support - 1，降到 0 后换成新的方案；同一张表单（重复提交传真）只计一次；
+- 查找走倒排索引表 order_template_tokens：(code, 词) -> 模板；只在 diagnosis_code 相同的模板中
+  按词集合的 Jaccard 相似度打分；
+- 相似度 >= min_similarity，且处方和检验申请的 support 都 >= min_support（至少几张独立发送的医嘱
+  方案一致）才视为高置信，直接使用模板，否则照常调用 LLM；
+- 淘汰：超过 ttl_s 未使用的模板删除；数量超过 max_templates 时删除 (support + hits) 最小、
+  最久未使用的模板。
+模板保存在 SQLite 中（默认在临时目录），查找和学习都直接读写数据库，多个 worker 共用同一个文件时
+互相可见；learn() 在一个写事务（BEGIN IMMEDIATE）中完成，support 用 SQL 原地加减，并发学习不会互相覆盖。
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS order_templates (
+    key                  TEXT PRIMARY KEY,
+    code                 TEXT NOT NULL,
+    description          TEXT NOT NULL,
+    tokens               TEXT NOT NULL,
+    prescription         TEXT,
+    prescription_support INTEGER NOT NULL DEFAULT 0,
+    requisition          TEXT,
+    requisition_support  INTEGER NOT NULL DEFAULT 0,
+    hits                 INTEGER NOT NULL,
+    created_at           REAL NOT NULL,
+    last_used            REAL NOT NULL
+);
+-- 倒排索引：(code, 词) -> 模板
+CREATE TABLE IF NOT EXISTS order_template_tokens (
+    code  TEXT NOT NULL,
+    token TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    PRIMARY KEY (code, token, key)
+);
+CREATE INDEX IF NOT EXISTS idx_order_template_tokens_key ON order_template_tokens (key);
+-- 已经计入 support 的表单
+CREATE TABLE IF NOT EXISTS order_template_sources (
+    kind     TEXT NOT NULL,
+    order_id TEXT NOT NULL,
+    key      TEXT NOT NULL,
+    PRIMARY KEY (kind, order_id)
+);
+-- generate-orders 创建的表单 -> 来源诊断
+CREATE TABLE IF NOT EXISTS order_template_origins (
+    kind         TEXT NOT NULL,
+    order_id     TEXT NOT NULL,
+    diagnosis_id TEXT NOT NULL,
+    created_at   REAL NOT NULL,
+    PRIMARY KEY (kind, order_id)
+);
+"""
+
+_STOPWORDS = {
+    "a", "an", "and", "the", "of", "with", "without", "in", "on", "for", "to", "by", "or", "at",
+    "is", "was", "patient", "pt", "dx", "diagnosis", "diagnosed",
+}
+
+# 模板保存（并用于判断两次方案「一致」）的字段；其余字段不保存
+TEMPLATE_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "prescription": (
+        "medication_name", "medication_strength", "medication_form",
+        "dosage_instructions", "quantity", "refills_allowed",
+    ),
+    "requisition": ("department", "test_type", "test_code", "priority"),
+}
+# 可以为空的字段
+_OPTIONAL_FIELDS = {"test_code"}
+
+
+def default_path() -> str:
+    """未配置 ORDER_TEMPLATE_PATH 时使用的文件。"""
+    return os.path.join(tempfile.gettempdir(), "ehealth-order-templates.sqlite3")
+
+
+def normalize_code(code: Optional[str]) -> str:
+    """"e11.9 " -> "E119"。"""
+    return re.sub(r"[^0-9A-Z]", "", (code or "").upper())
+
+
+def tokenize(description: str) -> Set[str]:
+    return {t for t in re.findall(r"[a-z0-9]+", (description or "").lower()) if t not in _STOPWORDS}
+
+
+def _tokens_hash(tokens: Iterable[str]) -> str:
+    return hashlib.blake2b(" ".join(sorted(tokens)).encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _core(design: Dict[str, Any], fields: Tuple[str, ...]) -> Tuple[str, ...]:
+    return tuple(" ".join(str(design.get(f) or "").lower().split()) for f in fields)
+
+
+def template_fields(kind: str, order: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """表单 -> 模板字段；缺少必填的方案字段时返回 None（不学习）。"""
+    fields = TEMPLATE_FIELDS[kind]
+    if any(order.get(f) in (None, "") for f in fields if f not in _OPTIONAL_FIELDS):
+        return None
+    return {f: order.get(f) for f in fields}
+
+
+class TemplateMatch(NamedTuple):
+    key: str
+    confidence: float  # 描述的 Jaccard 相似度
+    support: int  # 处方与检验申请 support 中较小的一个
+    prescription: Dict[str, Any]
+    requisition: Dict[str, Any]
+
+
+class OrderTemplateStore:
+    def __init__(
+        self,
+        path: str,
+        max_templates: int = 2000,
+        min_support: int = 2,
+        min_similarity: float = 0.9,
+        ttl_s: float = 90 * 86400.0,
+    ):
+        self.path = path
+        self.max_templates = max(1, max_templates)
+        self.min_support = max(1, min_support)
+        self.min_similarity = min_similarity
+        self.ttl_s = ttl_s
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # 与 shared_cache 相同：每个线程一个连接，autocommit
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- 查找 / 学习 ----
+
+    def record_origin(self, kind: str, order_id: str, diagnosis_id: Any) -> None:
+        """记录 generate-orders 创建的表单所依据的诊断；学习时按它取诊断。"""
+        self._conn().execute(
+            "INSERT OR REPLACE INTO order_template_origins (kind, order_id, diagnosis_id, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (kind, str(order_id), str(diagnosis_id), time.time()),
+        )
+
+    def origin(self, kind: str, order_id: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT diagnosis_id FROM order_template_origins WHERE kind = ? AND order_id = ?", (kind, str(order_id))
+        ).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, diagnosis_code: Optional[str], description: str) -> Tuple[Optional[TemplateMatch], str]:
+        """
+        返回 (高置信的模板或 None, 结果)：hit / miss（没有相似的模板）/
+        low_confidence（有相似模板，但相似度或 support 不够，或只学到了其中一部分）。
+        """
+        code = normalize_code(diagnosis_code)
+        tokens = sorted(tokenize(description))
+        if not tokens:
+            return None, "miss"
+        now = time.time()
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT o.key, COUNT(*), o.tokens, o.prescription, o.prescription_support, "
+            "o.requisition, o.requisition_support "
+            "FROM order_template_tokens t JOIN order_templates o ON o.key = t.key "
+            f"WHERE t.code = ? AND t.token IN ({', '.join('?' * len(tokens))}) AND o.last_used >= ? "
+            "GROUP BY o.key",
+            (code, *tokens, now - self.ttl_s),
+        ).fetchall()
+        if not rows:
+            return None, "miss"
+        best, similarity = None, -1.0
+        for row in rows:
+            union = len(tokens) + len(json.loads(row[2])) - row[1]
+            score = row[1] / union if union else 0.0
+            if score > similarity:
+                best, similarity = row, score
+        key, _, _, prescription, prescription_support, requisition, requisition_support = best
+        support = min(prescription_support, requisition_support)
+        if prescription is None or requisition is None or similarity < self.min_similarity or support < self.min_support:
+            return None, "low_confidence"
+        conn.execute("UPDATE order_templates SET hits = hits + 1, last_used = ? WHERE key = ?", (now, key))
+        return TemplateMatch(key, similarity, support, json.loads(prescription), json.loads(requisition)), "hit"
+
+    def learn(
+        self,
+        kind: str,
+        diagnosis_code: Optional[str],
+        description: str,
+        order_id: str,
+        order: Dict[str, Any],
+    ) -> bool:
+        """
+        记录一张医生已确认发送的处方（kind="prescription"）或检验申请（kind="requisition"）；
+        返回是否计入（方案字段不完整或该表单已经计入过时返回 False）。
+        """
+        design = template_fields(kind, order)
+        code = normalize_code(diagnosis_code)
+        tokens = sorted(tokenize(description))
+        if design is None or not tokens:
+            return False
+        # 列名只来自 TEMPLATE_FIELDS 的键
+        part, support = kind, f"{kind}_support"
+        key = f"{code}|{_tokens_hash(tokens)}"
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute(
+                "INSERT OR IGNORE INTO order_template_sources (kind, order_id, key) VALUES (?, ?, ?)",
+                (kind, str(order_id), key),
+            ).rowcount == 0:
+                conn.execute("COMMIT")
+                return False
+            row = conn.execute(f"SELECT {part}, {support} FROM order_templates WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                conn.execute(
+                    f"INSERT INTO order_templates (key, code, description, tokens, {part}, {support}, hits, "
+                    "created_at, last_used) VALUES (?, ?, ?, ?, ?, 1, 0, ?, ?)",
+                    (key, code, description.strip(), json.dumps(tokens), json.dumps(design), now, now),
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO order_template_tokens (code, token, key) VALUES (?, ?, ?)",
+                    [(code, token, key) for token in tokens],
+                )
+                self._evict(conn, now)
+            elif row[0] is not None and _core(json.loads(row[0]), TEMPLATE_FIELDS[kind]) == _core(
+                design, TEMPLATE_FIELDS[kind]
+            ):
+                conn.execute(
+                    f"UPDATE order_templates SET {support} = {support} + 1, last_used = ? WHERE key = ?", (now, key)
+                )
+            elif row[0] is not None and row[1] > 1:
+                conn.execute(f"UPDATE order_templates SET {support} = {support} - 1 WHERE key = ?", (key,))
+            else:
+                # 还没有这一部分，或与已有方案不一致且已有方案没有其他支持：换成新的方案
+                conn.execute(
+                    f"UPDATE order_templates SET {part} = ?, {support} = 1, hits = 0, last_used = ? WHERE key = ?",
+                    (json.dumps(design), now, key),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """删除过期模板；超过 max_templates 时删除 (support + hits) 最小、最久未使用的模板。调用方持有写事务。"""
+        conn.execute("DELETE FROM order_templates WHERE last_used < ?", (now - self.ttl_s,))
+        conn.execute(
+            "DELETE FROM order_templates WHERE key IN (SELECT key FROM order_templates "
+            "ORDER BY prescription_support + requisition_support + hits, last_used "
+            "LIMIT max(0, (SELECT COUNT(*) FROM order_templates) - ?))",
+            (self.max_templates,),
+        )
+        conn.execute("DELETE FROM order_template_tokens WHERE key NOT IN (SELECT key FROM order_templates)")
+        conn.execute("DELETE FROM order_template_sources WHERE key NOT IN (SELECT key FROM order_templates)")
+        conn.execute("DELETE FROM order_template_origins WHERE created_at < ?", (now - self.ttl_s,))
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM order_templates").fetchone()[0]
+
+
+# ---------------- 对外接口 ----------------
+
+_store: Optional[OrderTemplateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[OrderTemplateStore]:
+    """ORDER_TEMPLATES=false（默认）时返回 None（每次都调用 LLM，也不学习）。"""
+    global _store
+    from .config import settings
+
+    if not settings.order_templates:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = OrderTemplateStore(
+                    settings.order_template_path or default_path(),
+                    max_templates=settings.order_template_max,
+                    min_support=settings.order_template_min_support,
+                    min_similarity=settings.order_template_min_similarity,
+                    ttl_s=settings.order_template_ttl_days * 86400.0,
+                )
+    return _store
+
+
+def record_origin(kind: str, order_id: Any, diagnosis_id: Any) -> None:
+    """generate-orders 创建表单后调用（ORDER_TEMPLATES=true 时记录来源诊断）；失败只打印警告。"""
+    store = get_store()
+    if store is None or order_id is None or diagnosis_id is None:
+        return
+    try:
+        store.record_origin(kind, str(order_id), diagnosis_id)
+    except Exception as e:
+        print(f"[WARN] order template origin not recorded for {kind} {order_id}: {type(e).__name__}: {e}")
+
+
+def learn_from_sent(kind: str, order_ids: List[str]) -> None:
+    """
+    处方 / 检验申请传真发送成功（医生确认发送）后由传真发送线程调用：按各表单记录的来源诊断学习，
+    表单取发送时的版本。没有来源诊断的表单跳过；失败只打印警告，不影响传真任务。
+    """
+    store = get_store()
+    if store is None:
+        return
+    from . import crud
+
+    for order_id in order_ids:
+        try:
+            diagnosis_id = store.origin(kind, order_id)
+            if diagnosis_id is None:
+                continue
+            order = crud.get_prescription(order_id) if kind == "prescription" else crud.get_requisition(order_id)
+            dx = crud.get_diagnosis(int(diagnosis_id))
+            if order and dx and (dx.get("diagnosis_description") or "").strip():
+                store.learn(kind, dx.get("diagnosis_code"), dx["diagnosis_description"], order_id, order)
+        except Exception as e:
+            print(f"[WARN] order template learning failed for {kind} {order_id}: {type(e).__name__}: {e}")
@@ -0,0 +1,82 @@
+"""
+补全工具（tool_complete_prescription_from_diagnosis / tool_complete_requisition_from_diagnosis）的预检查。
+
+每次补全成功后记录该表单的指纹：最新诊断（diagnosis_id + 诊断描述）+ 表单的病人与可编辑字段。
+再次补全同一张表单时，如果所有可编辑字段都已填写，且当前指纹与上次补全后的指纹相同
+（诊断没有变化，表单也没有被其他人修改），直接返回现有表单，不调用 LLM（响应中 llm_skipped=true）。
+
+指纹只保存在本进程内存中（最多 max_entries 张表单，LRU）；多 worker 或重启后第一次补全会照常调用 LLM。
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+def fingerprint(diagnosis: Dict[str, Any], record: Dict[str, Any], fields: List[str]) -> str:
+    # 值统一转成字符串：远端返回的 "21" 与本地的 21 视为相同
+    payload = json.dumps(
+        [
+            str(diagnosis.get("diagnosis_id")),
+            (diagnosis.get("diagnosis_description") or "").strip(),
+            str(record.get("patient_id")),
+            [None if record.get(f) is None else str(record.get(f)) for f in fields],
+        ],
+        separators=(",", ":"),
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def is_complete(record: Dict[str, Any], fields: List[str]) -> bool:
+    return all(record.get(f) not in (None, "") for f in fields)
+
+
+class CompletionPrecheck:
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._fingerprints: "OrderedDict[str, str]" = OrderedDict()  # "<kind>:<id>" -> 指纹
+        self._lock = threading.Lock()
+
+    def unchanged(
+        self, kind: str, record_id: str, diagnosis: Dict[str, Any], record: Dict[str, Any], fields: List[str]
+    ) -> bool:
+        """表单已完整，且诊断与表单内容自上次补全以来都没有变化。"""
+        if not is_complete(record, fields):
+            return False
+        key = f"{kind}:{record_id}"
+        with self._lock:
+            stored = self._fingerprints.get(key)
+            if stored is not None:
+                self._fingerprints.move_to_end(key)
+        return stored == fingerprint(diagnosis, record, fields)
+
+    def remember(
+        self, kind: str, record_id: str, diagnosis: Dict[str, Any], record: Dict[str, Any], fields: List[str]
+    ) -> None:
+        """补全成功后记录（record 为更新后的表单）。"""
+        key = f"{kind}:{record_id}"
+        value = fingerprint(diagnosis, record, fields)
+        with self._lock:
+            self._fingerprints[key] = value
+            self._fingerprints.move_to_end(key)
+            while len(self._fingerprints) > self.max_entries:
+                self._fingerprints.popitem(last=False)
+
+
+_precheck: Optional[CompletionPrecheck] = None
+_precheck_lock = threading.Lock()
+
+
+def get_precheck() -> Optional[CompletionPrecheck]:
+    """COMPLETION_PRECHECK=false 时返回 None（每次都调用 LLM）。"""
+    global _precheck
+    from .config import settings
+
+    if not settings.completion_precheck:
+        return None
+    if _precheck is None:
+        with _precheck_lock:
+            if _precheck is None:
+                _precheck = CompletionPrecheck(settings.completion_precheck_max_entries)
+    return _precheck
@@ -0,0 +1,179 @@
+"""
+远端表行的紧凑表示：按 schemas 中各表的 *Out 模型生成的 __slots__ 记录类。
+
+普通快照里每行是一个 dict（十几个字段时单行约 650 字节，外加每个字符串值各自一个对象）；
+开启 COMPACT_RECORDS 后，快照中的行改为记录类实例：
+- 字段固定为 __slots__（无 __dict__），单行约为 dict 的 1/3；
+- status / priority / medication_form 等取值有限的字符串字段在构建时 intern，
+  百万行里相同的取值只保留一个对象；
+- 远端多返回的字段放在 _extra 中，远端缺失的字段保持未赋值（to_dict 时不输出），
+  因此 dict -> 记录 -> dict 完全往返。
+
+记录类实现 Mapping 接口（get / [] / keys / items / dict(rec) / {**rec}），crud 中按 dict 读取的代码
+不需要修改；返回给路由之前由 as_dict / as_dicts 转回普通 dict。记录与快照中的 dict 一样是共享只读的。
+"""
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple, Type
+
+from . import schemas
+
+# 各表对应的输出模型（字段列表取自模型，顺序即 to_dict 的输出顺序）
+TABLE_SCHEMAS = {
+    "patients_registration": schemas.PatientsRegistrationOut,
+    "diagnosis": schemas.DiagnosisOut,
+    "patient_preference": schemas.PatientPreferenceOut,
+    "prescription_form": schemas.PrescriptionFormOut,
+    "requisition_form": schemas.RequisitionFormOut,
+    "pharmacy_registration": schemas.PharmacyRegistrationOut,
+    "lab_registration": schemas.LabRegistrationOut,
+}
+
+# 取值有限、大量重复的字符串字段：构建记录时 intern
+INTERNED_FIELDS = frozenset({
+    "status", "priority", "medication_form", "medication_strength", "medication_name",
+    "preference_type", "gender", "department", "test_type", "test_code",
+    "diagnosis_code", "diagnosis_description", "prescriber_id", "family_doctor_id",
+    "dob", "diagnosis_date", "date_prescribed", "expiry_date", "date_requested", "result_date",
+    "registered_on",
+})
+
+_intern = sys.intern
+
+
+class Record(Mapping):
+    """记录类的基类；具体的类由 record_class() 生成。"""
+
+    __slots__ = ("_extra",)
+    _table: str = ""
+    _fields: Tuple[str, ...] = ()
+    _field_set: FrozenSet[str] = frozenset()
+    _interned: FrozenSet[str] = frozenset()
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Record":
+        obj = cls.__new__(cls)
+        extra = None
+        field_set, interned = cls._field_set, cls._interned
+        for key, value in data.items():
+            if key in field_set:
+                if key in interned and value.__class__ is str:
+                    value = _intern(value)
+                setattr(obj, key, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        obj._extra = extra
+        return obj
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        for name in self._fields:
+            try:
+                data[name] = getattr(self, name)
+            except AttributeError:  # 远端没有返回该字段
+                continue
+        if self._extra:
+            data.update(self._extra)
+        return data
+
+    # ---- Mapping ----
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._field_set:
+            return getattr(self, key, default)
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def __contains__(self, key: object) -> bool:
+        if key in self._field_set:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self) -> Iterator[str]:
+        for name in self._fields:
+            if hasattr(self, name):
+                yield name
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is self.__class__:
+            return self._values() == other._values() and self._extra == other._extra
+        if isinstance(other, Mapping):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None  # 与 dict 一致：可变语义，不可哈希
+
+    def _values(self) -> Tuple[Any, ...]:
+        missing = _MISSING
+        return tuple(getattr(self, name, missing) for name in self._fields)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def __reduce__(self):
+        return _rebuild, (self._table, self.to_dict())
+
+
+_MISSING = object()
+
+
+def _rebuild(table: str, data: Dict[str, Any]) -> Record:
+    return record_class(table).from_dict(data)
+
+
+_classes: Dict[str, Type[Record]] = {}
+
+
+def record_class(table: str) -> Optional[Type[Record]]:
+    """按表生成（并缓存）记录类；没有对应 schema 的表返回 None。"""
+    cls = _classes.get(table)
+    if cls is None and table in TABLE_SCHEMAS:
+        model = TABLE_SCHEMAS[table]
+        fields = tuple(name for name in model.model_fields if name.isidentifier() and not name.startswith("_"))
+        name = "".join(part.title() for part in table.split("_")) + "Record"
+        cls = type(name, (Record,), {
+            "__module__": __name__,
+            "__slots__": fields,
+            "_table": table,
+            "_fields": fields,
+            "_field_set": frozenset(fields),
+            "_interned": INTERNED_FIELDS & frozenset(fields),
+        })
+        _classes[table] = cls
+    return cls
+
+
+def compact(table: str, rows: Iterable[Dict[str, Any]]) -> List[Any]:
+    """把某张表的 dict 行转换为记录类实例（RemoteTableClient.row_factory）。"""
+    cls = record_class(table)
+    if cls is None:
+        return list(rows)
+    from_dict = cls.from_dict
+    return [from_dict(r) if r.__class__ is dict else r for r in rows]
+
+
+def as_dict(row: Any) -> Any:
+    """API 边界：记录转回普通 dict（dict / None 原样返回）。"""
+    return row.to_dict() if isinstance(row, Record) else row
+
+
+def as_dicts(rows: Iterable[Any]) -> List[Any]:
+    return [r.to_dict() if isinstance(r, Record) else r for r in rows]
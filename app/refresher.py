@@ -0,0 +1,129 @@
+"""
+注册类表（pharmacy / lab / patients）的后台刷新器。
+
+- 启动时（lifespan）在后台线程加载这些表并建立索引、解析地址；
+- 之后每 interval ± jitter 秒做一次条件请求（304 / 内容未变时几乎零开销，
+  有变化时按行增量更新），并重新填充派生缓存；
+- 读取走 stale-while-revalidate：快照年龄不超过 max_age 时直接返回，不等远端；
+  本进程写入某张表后该表立即视为 dirty，下一次读取同步重新验证（保证读到自己的写入），
+  同时唤醒刷新器尽快在后台更新。
+- 刷新器停止或连续失败时，快照年龄超过 max_age 后读取会退回到同步重新验证。
+"""
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app import crud, metrics, remote, tracing
+
+
+class SnapshotRefresher:
+    def __init__(self, tables: List[str], interval: float = 30.0, jitter: float = 5.0, stale_factor: float = 3.0):
+        self.tables = list(tables)
+        self.interval = interval
+        self.jitter = min(jitter, interval / 2)
+        # 允许直接返回的最大快照年龄 = interval * stale_factor
+        self.max_age = interval * stale_factor
+        self._due: Dict[str, float] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._client: Optional[remote.RemoteTableClient] = None
+
+    # ---- 生命周期 ----
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._attach(remote.client)
+        self._thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._client is not None:
+            for table in self.tables:
+                self._client.max_age.pop(table, None)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """等待首轮加载完成（PREWARM_BLOCKING 时在 lifespan 中调用）。"""
+        return self._ready.wait(timeout)
+
+    def mark_dirty(self, table: str) -> None:
+        if table in self.tables:
+            self._due[table] = 0.0
+            self._wake.set()
+
+    # ---- 内部 ----
+
+    def _attach(self, client: remote.RemoteTableClient) -> None:
+        # remote.client 可能被替换（基准测试 / 压测），每轮检查一次
+        if client is self._client:
+            return
+        self._client = client
+        for table in self.tables:
+            client.max_age[table] = self.max_age
+        client.add_invalidate_listener(self.mark_dirty)
+
+    def _next_due(self) -> float:
+        return time.monotonic() + self.interval + random.uniform(-self.jitter, self.jitter)
+
+    def refresh(self, table: str) -> bool:
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            with tracing.span("refresher.refresh", table=table):
+                # max_age=0：强制向远端做一次条件请求
+                snap = remote.client.get_snapshot(table, max_age=0)
+                crud.warm_snapshot(snap)
+            outcome = "ok"
+            return True
+        except Exception as e:
+            print(f"[WARN] background refresh of {table} failed: {type(e).__name__}: {e}")
+            return False
+        finally:
+            metrics.SNAPSHOT_REFRESH_SECONDS.observe(time.perf_counter() - start, table=table, outcome=outcome)
+
+    def _run(self) -> None:
+        for table in self.tables:
+            if self._stop.is_set():
+                return
+            self.refresh(table)
+            self._due[table] = self._next_due()
+        self._ready.set()
+
+        while not self._stop.is_set():
+            self._attach(remote.client)
+            now = time.monotonic()
+            for table in self.tables:
+                if self._due.get(table, 0.0) <= now and not self._stop.is_set():
+                    ok = self.refresh(table)
+                    # 失败时缩短间隔重试
+                    self._due[table] = self._next_due() if ok else time.monotonic() + min(5.0, self.interval)
+            timeout = max(0.0, min(self._due.values()) - time.monotonic()) if self._due else self.interval
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+
+_refresher: Optional[SnapshotRefresher] = None
+
+
+def start(tables: List[str], interval: float, jitter: float) -> SnapshotRefresher:
+    global _refresher
+    if _refresher is None:
+        _refresher = SnapshotRefresher(tables, interval=interval, jitter=jitter)
+        _refresher.start()
+    return _refresher
+
+
+def stop() -> None:
+    global _refresher
+    if _refresher is not None:
+        _refresher.stop()
+        _refresher = None
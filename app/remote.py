@@ -0,0 +1,650 @@
+"""
+远端表 API 客户端。
+
+每张表在进程内保留「最近一次读取的快照」（已解析的记录 + 索引 + 校验信息）：
+- 读取时发送条件请求（If-None-Match / If-Modified-Since）；
+  远端返回 304 或内容哈希未变时直接复用已解析、已建索引的快照；
+- 内容变化时按主键计算行级增量（inserted / updated / deleted），
+  只对变化行更新索引和派生缓存，并通知订阅者。
+- 配置了共享快照存储（app/shared_cache.py，多 worker 模式）时，先从存储中取其他 worker
+  刚下载过的响应体，写入代数也通过存储在 worker 之间传播。
+- 配置为列式存储的大表（app/columnar.py）整表写成 mmap 列式文件，不在进程内持有 dict 列表。
+- 配置了容错层（app/resilience.py）时，GET 带熔断、对冲与重试，远端失败时返回最近一次成功的快照。
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from . import metrics, tracing
+
+# 远端表 URL 映射
+REMOTE_TABLES = {
+    "patients_registration": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/patients_registration",
+    "diagnosis": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/diagnosis",
+    "patient_preference": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/patient_preference",
+    "prescription_form": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/prescription_form",
+    "requisition_form": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/requisition_form",
+    "pharmacy_registration": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/pharmacy_registration",
+    "lab_registration": "https://aetab8pjmb.us-east-1.awsapprunner.com/table/lab_registration",
+}
+
+# 每张表的主键字段（与 app/models.py 一致）
+PRIMARY_KEYS = {
+    "patients_registration": "patient_id",
+    "diagnosis": "diagnosis_id",
+    "patient_preference": "preference_id",
+    "prescription_form": "prescription_id",
+    "requisition_form": "requisition_id",
+    "pharmacy_registration": "pharmacy_id",
+    "lab_registration": "lab_id",
+}
+
+TIMEOUT = 60  # seconds. Increased to handle long-running AI workflows.
+
+
+def _extract_records(data: Any) -> List[Dict[str, Any]]:
+    """统一从远端响应中提取记录列表."""
+    if isinstance(data, dict) and "data" in data:
+        records = data["data"]
+    else:
+        records = data
+    return records if isinstance(records, list) else []
+
+
+def content_version(body: bytes) -> str:
+    """响应体内容哈希，作为快照版本号。"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def row_key(table: str, rec: Dict[str, Any]) -> Optional[str]:
+    """记录的主键（统一转成 str）；兼容远端用 "id" 作为主键的情况。"""
+    value = rec.get(PRIMARY_KEYS.get(table, "id"))
+    if value is None:
+        value = rec.get("id")
+    return None if value is None else str(value)
+
+
+class TableDelta:
+    """两个快照之间的行级差异。"""
+
+    def __init__(
+        self,
+        inserted: List[Dict[str, Any]],
+        updated: List[Dict[str, Any]],
+        deleted: List[str],
+    ):
+        self.inserted = inserted
+        self.updated = updated
+        self.deleted = deleted
+
+    def is_empty(self) -> bool:
+        return not (self.inserted or self.updated or self.deleted)
+
+    def changed_keys(self, table: str) -> List[str]:
+        keys = [row_key(table, r) for r in self.inserted + self.updated]
+        return [k for k in keys if k is not None] + list(self.deleted)
+
+    def __repr__(self) -> str:
+        return (
+            f"TableDelta(inserted={len(self.inserted)}, "
+            f"updated={len(self.updated)}, deleted={len(self.deleted)})"
+        )
+
+
+class TableSnapshot:
+    """
+    某张表某一版本的只读快照。
+
+    records 保持远端返回顺序（分页依赖该顺序）；by_pk / by_patient 为索引。
+    快照内的 dict 被多个请求共享，调用方不得原地修改。
+    """
+
+    def __init__(
+        self,
+        table: str,
+        records: List[Dict[str, Any]],
+        version: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        by_pk: Optional[Dict[str, Dict[str, Any]]] = None,
+        by_patient: Optional[Dict[Any, List[Dict[str, Any]]]] = None,
+        row_caches: Optional[Dict[str, Dict[str, Any]]] = None,
+    ):
+        self.table = table
+        self.records = records
+        self.version = version
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.time()
+        self.by_pk = by_pk if by_pk is not None else self._build_pk_index(records)
+        self.by_patient = by_patient if by_patient is not None else self._build_patient_index(records)
+        # 按行缓存的派生数据（例如解析后的经纬度），name -> {pk: value}
+        self.row_caches: Dict[str, Dict[str, Any]] = row_caches or {}
+        self._max_numeric_pk: Optional[int] = None
+
+    def _build_pk_index(self, records: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        index = {}
+        for rec in records:
+            key = row_key(self.table, rec)
+            if key is not None:
+                index[key] = rec
+        return index
+
+    @staticmethod
+    def _build_patient_index(records: Iterable[Dict[str, Any]]) -> Dict[Any, List[Dict[str, Any]]]:
+        index: Dict[Any, List[Dict[str, Any]]] = {}
+        for rec in records:
+            pid = rec.get("patient_id")
+            if pid is not None:
+                index.setdefault(pid, []).append(rec)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def get(self, pk: Any) -> Optional[Dict[str, Any]]:
+        return self.by_pk.get(str(pk))
+
+    def rows_for_patient(self, patient_id: Any) -> List[Dict[str, Any]]:
+        return list(self.by_patient.get(patient_id, ()))
+
+    def max_numeric_pk(self) -> int:
+        """数值型主键的最大值（用于自增 ID 分配），按快照缓存。"""
+        if self._max_numeric_pk is None:
+            max_id = 0
+            for key in self.by_pk:
+                try:
+                    max_id = max(max_id, int(key))
+                except (TypeError, ValueError):
+                    continue
+            self._max_numeric_pk = max_id
+        return self._max_numeric_pk
+
+    def cached(self, name: str, pk: str, compute: Callable[[], Any]) -> Any:
+        """按行缓存派生值；行变化时该缓存条目会在增量合并中被丢弃。"""
+        cache = self.row_caches.setdefault(name, {})
+        if pk in cache:
+            return cache[pk]
+        value = compute()
+        cache[pk] = value
+        return value
+
+    def diff(self, records: List[Dict[str, Any]]) -> TableDelta:
+        """计算本快照到新记录列表的行级差异。"""
+        inserted, updated = [], []
+        seen = set()
+        for rec in records:
+            key = row_key(self.table, rec)
+            if key is None:
+                continue
+            seen.add(key)
+            old = self.by_pk.get(key)
+            if old is None:
+                inserted.append(rec)
+            elif old != rec:
+                updated.append(rec)
+        deleted = [k for k in self.by_pk if k not in seen]
+        return TableDelta(inserted, updated, deleted)
+
+    def apply(
+        self,
+        records: List[Dict[str, Any]],
+        delta: TableDelta,
+        version: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> "TableSnapshot":
+        """
+        基于增量生成新快照（copy-on-write，旧快照仍可被正在进行的请求安全读取）。
+        未变化的行复用旧 dict，只有变化行才更新索引与派生缓存。
+        """
+        changed = set(delta.changed_keys(self.table))
+
+        # 未变化的行复用旧对象，保持身份稳定
+        merged = []
+        for rec in records:
+            key = row_key(self.table, rec)
+            if key is not None and key not in changed:
+                rec = self.by_pk.get(key, rec)
+            merged.append(rec)
+
+        by_pk = dict(self.by_pk)
+        for key in delta.deleted:
+            by_pk.pop(key, None)
+        for rec in delta.inserted + delta.updated:
+            by_pk[row_key(self.table, rec)] = rec
+
+        # 只重建受影响 patient 的列表（按新记录顺序）
+        affected = set()
+        for key in changed:
+            old = self.by_pk.get(key)
+            if old is not None and old.get("patient_id") is not None:
+                affected.add(old.get("patient_id"))
+        for rec in delta.inserted + delta.updated:
+            if rec.get("patient_id") is not None:
+                affected.add(rec.get("patient_id"))
+        by_patient = dict(self.by_patient)
+        if affected:
+            for pid in affected:
+                by_patient.pop(pid, None)
+            for rec in merged:
+                pid = rec.get("patient_id")
+                if pid in affected:
+                    by_patient.setdefault(pid, []).append(rec)
+
+        row_caches = {
+            name: {k: v for k, v in cache.items() if k not in changed}
+            for name, cache in self.row_caches.items()
+        }
+
+        new_snap = TableSnapshot(
+            self.table,
+            merged,
+            version,
+            etag=etag,
+            last_modified=last_modified,
+            by_pk=by_pk,
+            by_patient=by_patient,
+            row_caches=row_caches,
+        )
+        # 只有新增（没有删除）时，最大主键可以增量得到
+        if self._max_numeric_pk is not None and not delta.deleted:
+            max_id = self._max_numeric_pk
+            for rec in delta.inserted:
+                try:
+                    max_id = max(max_id, int(row_key(self.table, rec)))
+                except (TypeError, ValueError):
+                    continue
+            new_snap._max_numeric_pk = max_id
+        return new_snap
+
+
+DeltaListener = Callable[[str, TableDelta, TableSnapshot], None]
+
+
+class RemoteTableClient:
+    """
+    带快照复用的远端表客户端。
+
+    transport 需提供与 requests.Session 相同的 get/post/put 接口，
+    便于在压测/基准测试中替换为内存实现。
+    """
+
+    def __init__(self, tables: Optional[Dict[str, str]] = None, transport: Any = None, timeout: float = TIMEOUT):
+        self.tables = tables if tables is not None else REMOTE_TABLES
+        # 默认的 requests.Session 在第一次请求时才创建（requests 的导入开销不计入启动时间）
+        self._transport = transport
+        self._transport_lock = threading.Lock()
+        self.timeout = timeout
+        self._snapshots: Dict[str, TableSnapshot] = {}
+        # 最近一次 GET 的 (完成时间, 发起时的写入代数)，用于合并并发读取
+        self._last_fetch: Dict[str, tuple] = {}
+        # 本进程对每张表的写入代数，写入后递增
+        self._write_gen: Dict[str, int] = {t: 0 for t in self.tables}
+        self._locks: Dict[str, threading.Lock] = {t: threading.Lock() for t in self.tables}
+        self._listeners: List[DeltaListener] = []
+        self._invalidate_listeners: List[Callable[[str], None]] = []
+        # stale-while-revalidate：表 -> 允许直接返回的快照最大年龄（秒），由后台刷新器设置
+        self.max_age: Dict[str, float] = {}
+        # 多 worker 共享的快照存储（app.shared_cache.SharedSnapshotStore），由 lifespan 设置
+        self.shared: Any = None
+        # 列式快照文件（app.columnar.ColumnarStore），只对其 tables 中的表生效，由 lifespan 设置
+        self.columnar: Any = None
+        # 行转换：row_factory(table, records) -> 快照中保存的行（例如 app.records.compact）
+        self.row_factory: Optional[Callable[[str, List[Dict[str, Any]]], List[Any]]] = None
+        # 熔断 / 对冲 / 重试（app.resilience.Resilience），由 lifespan 设置
+        self.resilience: Any = None
+
+    @property
+    def transport(self) -> Any:
+        if self._transport is None:
+            with self._transport_lock:
+                if self._transport is None:
+                    import requests
+
+                    self._transport = requests.Session()
+        return self._transport
+
+    @transport.setter
+    def transport(self, value: Any) -> None:
+        self._transport = value
+
+    # ---- 订阅 / 查询 ----
+
+    def add_listener(self, listener: DeltaListener) -> None:
+        """注册增量回调：listener(table, delta, new_snapshot)。"""
+        self._listeners.append(listener)
+
+    def current(self, table: str) -> Optional[TableSnapshot]:
+        """不发请求，直接返回当前已有的快照（可能为 None）。"""
+        return self._snapshots.get(table)
+
+    def add_invalidate_listener(self, listener: Callable[[str], None]) -> None:
+        """注册写入回调：listener(table)，本进程写入某张表后调用。"""
+        self._invalidate_listeners.append(listener)
+
+    def invalidate(self, table: str) -> None:
+        """标记某张表需要在下次读取时重新验证（本进程写入后调用）。"""
+        self._write_gen[table] = self._write_gen.get(table, 0) + 1
+        if self.shared is not None:
+            try:
+                self.shared.bump(table)
+            except Exception as e:
+                print(f"[WARN] shared cache invalidation failed for {table}: {type(e).__name__}: {e}")
+        for listener in self._invalidate_listeners:
+            try:
+                listener(table)
+            except Exception as e:
+                print(f"[WARN] invalidate listener failed for {table}: {type(e).__name__}: {e}")
+
+    def _generation(self, table: str) -> tuple:
+        """(本进程写入代数, 共享存储中的写入代数)；任一变化都表示快照需要重新验证。"""
+        shared_gen = self.shared.generation(table) if self.shared is not None else 0
+        return self._write_gen.get(table, 0), shared_gen
+
+    def _stale_allowed(self, table: str) -> bool:
+        """最近一次成功读取之后没有写入过该表：远端失败时可以返回旧快照（不会丢掉自己的写入）。"""
+        last = self._last_fetch.get(table)
+        return last is not None and last[1] == self._generation(table)
+
+    def age(self, table: str) -> Optional[float]:
+        """距上次成功读取远端的秒数；从未读取过返回 None。"""
+        last = self._last_fetch.get(table)
+        return time.monotonic() - last[0] if last is not None else None
+
+    # ---- 读 ----
+
+    def get_snapshot(self, table: str, max_age: Optional[float] = None) -> TableSnapshot:
+        """
+        返回该表的最新快照。默认每次调用都会向远端发一次条件请求；
+        并发读取会合并：等待中的调用直接复用「在其到达之后才完成、且期间本进程
+        没有写入该表」的那次请求结果。
+
+        max_age（默认取 self.max_age[table]）：快照在该秒数内、且之后没有写入过该表时
+        直接返回，不发请求（stale-while-revalidate，由后台刷新器负责更新）。
+        配置了共享存储时，「写入」也包括其他 worker 的写入。
+        """
+        requested_at = time.monotonic()
+        if max_age is None:
+            max_age = self.max_age.get(table)
+        if max_age:
+            snap = self._snapshots.get(table)
+            last = self._last_fetch.get(table)
+            if (
+                snap is not None
+                and last is not None
+                and requested_at - last[0] <= max_age
+                and last[1] == self._generation(table)
+            ):
+                metrics.SNAPSHOT_READS.inc(table=table, result="cached")
+                return snap
+        lock = self._locks[table]
+        policy = self.resilience
+        stale = self._snapshots.get(table)
+        if policy is not None and stale is not None and self._stale_allowed(table):
+            # 同表的请求正在等慢速远端：等待超过 lock_wait_s 就先返回旧快照（期间有写入则继续等待）
+            if not lock.acquire(timeout=policy.lock_wait_s):
+                if self._stale_allowed(table):
+                    metrics.SNAPSHOT_READS.inc(table=table, result="stale")
+                    return stale
+                lock.acquire()
+        else:
+            lock.acquire()
+        try:
+            snap = self._snapshots.get(table)
+            last = self._last_fetch.get(table)
+            if (
+                snap is not None
+                and last is not None
+                and last[0] >= requested_at
+                and last[1] == self._generation(table)
+            ):
+                metrics.SNAPSHOT_READS.inc(table=table, result="coalesced")
+                return snap
+            gen = self._generation(table)
+            try:
+                new_snap = self._refresh(table, snap, gen)
+            except Exception as e:
+                if policy is None or snap is None or not self._stale_allowed(table):
+                    raise
+                # 远端失败（或熔断打开）：返回最近一次成功的快照；不更新 _last_fetch，下次读取仍会重试
+                metrics.SNAPSHOT_READS.inc(table=table, result="stale")
+                sp = tracing.current_span()
+                if sp is not None:
+                    sp.set_attribute("remote.stale", f"{table}: {type(e).__name__}: {e}")
+                return snap
+            self._last_fetch[table] = (time.monotonic(), gen)
+            return new_snap
+        finally:
+            lock.release()
+
+    def _refresh(self, table: str, snap: Optional[TableSnapshot], gen: tuple) -> TableSnapshot:
+        store = self.shared
+        if store is None:
+            return self._fetch(table, snap, gen)
+
+        known = snap.version if snap is not None else None
+        # 列式表的文件已由下载它的 worker 生成，按版本直接打开，不需要响应体
+        columnar = self._is_columnar(table)
+        entry = store.load(table, gen[1], known, with_body=not columnar)
+        if entry is None:
+            if store.acquire(table):
+                try:
+                    return self._fetch(table, snap, gen)
+                finally:
+                    store.release(table)
+            # 其他 worker 正在下载这张表：等它写入共享存储；下载失败或超时则自己下载
+            with tracing.span("shared_cache.wait", table=table):
+                entry = store.wait(table, gen[1], known, timeout=self.timeout, with_body=not columnar)
+            if entry is None:
+                return self._fetch(table, snap, gen)
+
+        if snap is not None and entry.version == known:
+            # 其他 worker 刚验证过、与本地快照同版本
+            snap.etag, snap.last_modified = entry.etag, entry.last_modified
+            snap.fetched_at = entry.fetched_at
+            metrics.SNAPSHOT_READS.inc(table=table, result="unchanged")
+            return snap
+        metrics.SNAPSHOT_READS.inc(table=table, result="shared")
+        if entry.body is None:
+            new_snap = self._open_columnar(table, entry.version, entry.etag, entry.last_modified)
+            if new_snap is not None:
+                return new_snap
+            # 列式文件已被清理：取响应体重新生成
+            entry = store.load(table, gen[1], known)
+            if entry is None:
+                return self._fetch(table, snap, gen)
+        return self._build(table, snap, entry.body, entry.version, entry.etag, entry.last_modified)
+
+    def _fetch(self, table: str, snap: Optional[TableSnapshot], gen: tuple) -> TableSnapshot:
+        headers = {}
+        if snap is not None:
+            if snap.etag:
+                headers["If-None-Match"] = snap.etag
+            if snap.last_modified:
+                headers["If-Modified-Since"] = snap.last_modified
+
+        resp = self._get(table, self.tables[table], headers)
+        if resp.status_code == 304 and snap is not None:
+            metrics.SNAPSHOT_READS.inc(table=table, result="not_modified")
+            snap.fetched_at = time.time()
+            if self.shared is not None:
+                self.shared.touch(table, snap.version, gen[1])
+            return snap
+        resp.raise_for_status()
+
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        body = resp.content
+        version = content_version(body)
+        if snap is not None and snap.version == version:
+            # 远端不支持条件请求，但内容未变：跳过解析和建索引
+            snap.etag, snap.last_modified = etag, last_modified
+            snap.fetched_at = time.time()
+            metrics.SNAPSHOT_READS.inc(table=table, result="unchanged")
+            new_snap = snap
+        else:
+            metrics.SNAPSHOT_READS.inc(table=table, result="full" if snap is None else "delta")
+            new_snap = self._build(table, snap, body, version, etag, last_modified)
+        # 在快照（以及列式文件）就绪之后再发布到共享存储
+        if self.shared is not None:
+            self.shared.save(table, version, etag, last_modified, body, gen[1])
+        return new_snap
+
+    def _is_columnar(self, table: str) -> bool:
+        return self.columnar is not None and table in self.columnar.tables
+
+    def _open_columnar(
+        self, table: str, version: str, etag: Optional[str], last_modified: Optional[str],
+        body: Optional[bytes] = None,
+    ) -> Optional[TableSnapshot]:
+        """打开（必要时由 body 生成）该版本的列式文件；文件不存在且没有 body 时返回 None。"""
+        from .columnar import ColumnarSnapshot
+
+        with tracing.span("snapshot.columnar", table=table) as sp:
+            data = self.columnar.open(table, version)
+            if data is None:
+                if body is None:
+                    return None
+                data = self.columnar.build(table, version, _extract_records(json.loads(body)))
+                if sp is not None:
+                    sp.set_attribute("built", True)
+            if sp is not None:
+                sp.set_attribute("rows", len(data))
+        new_snap = ColumnarSnapshot(data, etag=etag, last_modified=last_modified)
+        self._snapshots[table] = new_snap
+        return new_snap
+
+    def _build(
+        self,
+        table: str,
+        snap: Optional[TableSnapshot],
+        body: bytes,
+        version: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+    ) -> TableSnapshot:
+        """解析响应体；已有快照时按行增量合并并通知订阅者。列式表整表重新生成列式文件。"""
+        if self._is_columnar(table):
+            return self._open_columnar(table, version, etag, last_modified, body=body)
+        with tracing.span("snapshot.build", table=table) as sp:
+            records = _extract_records(json.loads(body))
+            if self.row_factory is not None:
+                records = self.row_factory(table, records)
+            if sp is not None:
+                sp.set_attribute("rows", len(records))
+            if snap is None:
+                new_snap = TableSnapshot(table, records, version, etag=etag, last_modified=last_modified)
+                self._snapshots[table] = new_snap
+                return new_snap
+
+            delta = snap.diff(records)
+            new_snap = snap.apply(records, delta, version, etag=etag, last_modified=last_modified)
+            if sp is not None:
+                sp.set_attribute("delta", repr(delta))
+        # 先通知订阅者再发布新快照：读到新版本的线程一定能看到对应的增量（见 app/changes.py）
+        if not delta.is_empty():
+            for listener in self._listeners:
+                try:
+                    listener(table, delta, new_snap)
+                except Exception as e:
+                    print(f"[WARN] snapshot listener failed for {table}: {type(e).__name__}: {e}")
+        self._snapshots[table] = new_snap
+        return new_snap
+
+    def _get(self, table: str, url: str, headers: Dict[str, str]) -> Any:
+        """GET：配置了容错层时经过熔断 / 对冲 / 重试。"""
+        if self.resilience is None:
+            return self._send(table, "GET", url, headers=headers)
+        return self.resilience.get(
+            table, lambda timeout: self._send(table, "GET", url, headers=headers, timeout=timeout)
+        )
+
+    def _write(self, table: str, verb: str, url: str, **kwargs) -> Any:
+        """POST / PUT：配置了容错层时熔断打开直接失败（不重试）。"""
+        if self.resilience is None:
+            return self._send(table, verb, url, **kwargs)
+        return self.resilience.guard(table, lambda: self._send(table, verb, url, **kwargs))
+
+    def _send(self, table: str, verb: str, url: str, timeout: Optional[float] = None, **kwargs) -> Any:
+        """发送一次 HTTP 请求并按 table / verb / status 记录延迟。"""
+        method = getattr(self.transport, verb.lower())
+        start = time.perf_counter()
+        status = "error"
+        with tracing.span(f"remote.{verb.lower()}", table=table) as sp:
+            try:
+                resp = method(url, timeout=self.timeout if timeout is None else timeout, **kwargs)
+                status = str(resp.status_code)
+                if sp is not None:
+                    sp.set_attribute("status", resp.status_code)
+                    sp.set_attribute("bytes", len(resp.content or b""))
+                return resp
+            finally:
+                metrics.REMOTE_REQUEST_SECONDS.observe(
+                    time.perf_counter() - start, table=table, verb=verb, status=status
+                )
+
+    # ---- 写 ----
+
+    def post(self, table: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        url = self.tables[table]
+        try:
+            resp = self._write(table, "POST", url, json=payload)
+            resp.raise_for_status()
+            return resp.json()
+        finally:
+            self.invalidate(table)
+
+    def post_many(
+        self,
+        table: str,
+        payloads: List[Dict[str, Any]],
+        concurrency: int = 8,
+        bulk: bool = False,
+    ) -> List[Optional[Exception]]:
+        """
+        批量写入，返回与 payloads 一一对应的异常（成功为 None），写完后只失效一次。
+        bulk=True：远端支持列表写入时一次 POST 整个列表；否则以不超过 concurrency 的并发逐条 POST。
+        """
+        url = self.tables[table]
+
+        def post_one(payload: Dict[str, Any]) -> Optional[Exception]:
+            try:
+                self._write(table, "POST", url, json=payload).raise_for_status()
+                return None
+            except Exception as e:
+                return e
+
+        try:
+            if bulk:
+                error = post_one(payloads)
+                return [error] * len(payloads)
+            if concurrency <= 1 or len(payloads) <= 1:
+                return [post_one(p) for p in payloads]
+            with ThreadPoolExecutor(
+                max_workers=min(concurrency, len(payloads)), thread_name_prefix=f"post-{table}"
+            ) as pool:
+                return list(pool.map(tracing.wrap(post_one), payloads))
+        finally:
+            self.invalidate(table)
+
+    def put(self, table: str, record_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        使用 PUT 方法更新远端服务器上的现有记录。
+        """
+        url = f"{self.tables[table]}/{record_id}"
+        try:
+            resp = self._write(table, "PUT", url, json=payload)
+            resp.raise_for_status()
+        finally:
+            self.invalidate(table)
+        # PUT 请求成功后，远端 API 可能返回空内容或确认消息，
+        # 我们直接返回我们发送的 payload 作为确认。
+        return payload
+
+
+# 进程内单例
+client = RemoteTableClient()
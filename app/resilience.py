@@ -0,0 +1,236 @@
+"""
+远端表 API 的容错层：按表熔断、按延迟对冲的 GET、有上限的重试。
+
+远端（App Runner）变慢时，原来每个请求最多等 TIMEOUT = 60 秒，线程池很快被占满，整个 API 停顿。
+RemoteTableClient.resilience 配置为 Resilience 后：
+- GET 超时为 get_timeout（默认与 TIMEOUT 相同，大表首次加载可能很慢）；超过该表最近 GET 延迟的 p95
+  仍未返回时再发一个相同的请求
+  （hedge），先成功的那个生效；连接错误 / 超时 / 5xx 按指数退避重试，最多 retries 次；
+- 每张表一个熔断器：连续 failure_threshold 次调用失败后打开，reset_timeout_s 内直接失败
+  （CircuitOpenError，不再占用线程等待远端），之后放行一个探测请求，成功则关闭；
+- 读取失败（包括熔断打开）且本进程已有该表快照时，RemoteTableClient 返回最近一次成功的快照
+  （SNAPSHOT_READS 中记为 stale）；等待同表正在进行的慢请求超过 lock_wait_s 时也直接返回旧快照。
+  该快照之后本进程或其他 worker 写入过该表（写入代数变化）时不返回旧快照，保证读到自己的写入；
+- 写入（POST / PUT）只受熔断保护，不对冲也不重试（POST 不是幂等的）。
+"""
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Optional
+
+from app import metrics, tracing
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0.0, HALF_OPEN: 1.0, OPEN: 2.0}
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开：不向远端发请求，直接失败。"""
+
+
+class RemoteServerError(Exception):
+    """远端返回 5xx（按失败处理并重试）。"""
+
+    def __init__(self, response: Any):
+        super().__init__(f"remote returned HTTP {response.status_code}")
+        self.response = response
+
+
+class CircuitBreaker:
+    def __init__(self, table: str, failure_threshold: int = 5, reset_timeout_s: float = 30.0):
+        self.table = table
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout_s = reset_timeout_s
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        metrics.REMOTE_CIRCUIT_STATE.set(_STATE_VALUES[state], table=self.table)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout_s:
+                self._set_state(HALF_OPEN)
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                # 半开：只放行一个探测请求
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"[INFO] circuit for {self.table} closed")
+                self._set_state(CLOSED)
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"[WARN] circuit for {self.table} opened after {self.failures} failures")
+                self._set_state(OPEN)
+                self.opened_at = time.monotonic()
+
+
+class Resilience:
+    def __init__(
+        self,
+        get_timeout: float = 60.0,
+        retries: int = 2,
+        backoff_s: float = 0.2,
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_min_s: float = 0.05,
+        hedge_min_samples: int = 20,
+        failure_threshold: int = 5,
+        reset_timeout_s: float = 30.0,
+        lock_wait_s: float = 2.0,
+        window: int = 200,
+    ):
+        self.get_timeout = get_timeout
+        self.retries = max(0, retries)
+        self.backoff_s = backoff_s
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_s = hedge_min_s
+        self.hedge_min_samples = hedge_min_samples
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.lock_wait_s = lock_wait_s
+        self._window = window
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    # ---- 熔断 ----
+
+    def breaker(self, table: str) -> CircuitBreaker:
+        b = self._breakers.get(table)
+        if b is None:
+            with self._lock:
+                b = self._breakers.setdefault(
+                    table, CircuitBreaker(table, self.failure_threshold, self.reset_timeout_s)
+                )
+        return b
+
+    def states(self) -> Dict[str, str]:
+        return {table: b.state for table, b in self._breakers.items()}
+
+    def guard(self, table: str, call: Callable[[], Any]) -> Any:
+        """写入：熔断打开时直接失败；否则调用一次并记录结果（不重试）。"""
+        breaker = self.breaker(table)
+        if not breaker.allow():
+            raise CircuitOpenError(f"circuit open for {table}")
+        try:
+            resp = call()
+        except Exception:
+            breaker.record_failure()
+            raise
+        if resp.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return resp
+
+    # ---- 对冲 / 重试 ----
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="remote-hedge")
+        return self._pool
+
+    def hedge_delay(self, table: str) -> Optional[float]:
+        """最近 GET 延迟的 p95；样本不足时返回 None（不对冲）。"""
+        samples = self._latencies.get(table)
+        if not self.hedge or samples is None or len(samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        p = ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_quantile))]
+        return min(max(p, self.hedge_min_s), self.get_timeout)
+
+    def _observe(self, table: str, seconds: float) -> None:
+        samples = self._latencies.get(table)
+        if samples is None:
+            with self._lock:
+                samples = self._latencies.setdefault(table, deque(maxlen=self._window))
+        samples.append(seconds)
+
+    def _attempt(self, table: str, send: Callable[[float], Any]) -> Any:
+        start = time.perf_counter()
+        resp = send(self.get_timeout)
+        if resp.status_code >= 500:
+            raise RemoteServerError(resp)
+        self._observe(table, time.perf_counter() - start)
+        return resp
+
+    def _hedged(self, table: str, send: Callable[[float], Any]) -> Any:
+        delay = self.hedge_delay(table)
+        if delay is None:
+            return self._attempt(table, send)
+        attempt = tracing.wrap(self._attempt)
+        pool = self._executor()
+        first = pool.submit(attempt, table, send)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        metrics.REMOTE_HEDGES.inc(table=table, outcome="sent")
+        second = pool.submit(attempt, table, send)
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        metrics.REMOTE_HEDGES.inc(table=table, outcome="won")
+                    # 另一个请求继续在后台完成，结果丢弃
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def get(self, table: str, send: Callable[[float], Any]) -> Any:
+        """
+        读取：send(timeout) 发一次 GET 并返回响应。熔断打开时抛出 CircuitOpenError；
+        连接错误 / 超时 / 5xx 重试（指数退避 + 抖动），全部失败后抛出最后一次的异常。
+        """
+        breaker = self.breaker(table)
+        if not breaker.allow():
+            metrics.REMOTE_RETRIES.inc(table=table, outcome="rejected")
+            raise CircuitOpenError(f"circuit open for {table}")
+        for attempt in range(self.retries + 1):
+            try:
+                resp = self._hedged(table, send)
+            except Exception as e:
+                if attempt >= self.retries:
+                    breaker.record_failure()
+                    metrics.REMOTE_RETRIES.inc(table=table, outcome="exhausted")
+                    if isinstance(e, RemoteServerError):
+                        return e.response  # 交给调用方 raise_for_status
+                    raise
+                metrics.REMOTE_RETRIES.inc(table=table, outcome="retry")
+                time.sleep(self.backoff_s * (2 ** attempt) * random.uniform(0.5, 1.5))
+                continue
+            breaker.record_success()
+            return resp
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
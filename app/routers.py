@@ -1,10 +1,49 @@
-from fastapi import APIRouter, HTTPException, Query, Path
-from . import crud, schemas
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query, Path, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from . import changes, crud, documents, fax, schemas
+from .config import settings
 from app.schemas import WorkflowRequest, WorkflowResponse
 from app.llm_tools import execute_tool
+from app.serialization import dump_json
+from app.http_cache import (
+    REGISTRY_CACHE_CONTROL,
+    REVALIDATE_CACHE_CONTROL,
+    conditional_json,
+    etag_matches,
+    not_modified,
+    table_etag,
+)
 
 router = APIRouter()
 
+
+def _facility_brief(
+    facility_id: Any,
+    getter,
+    cache: Dict[Any, Tuple[Optional[str], Optional[str]]],
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    返回药店/实验室的 (name, 纯地址)。
+    cache 在一次列表请求内复用，避免同一个 facility 被重复查询。
+    """
+    if facility_id in cache:
+        return cache[facility_id]
+    name = None
+    address = None
+    obj = getter(facility_id)
+    if obj:
+        name = obj.get("name")
+        raw_addr = obj.get("address")
+        if raw_addr and "||" in raw_addr:
+            address = raw_addr.split("||", 1)[0].strip()
+        else:
+            address = raw_addr
+    cache[facility_id] = (name, address)
+    return name, address
+
 # Patients
 @router.post("/patients", response_model=schemas.PatientsRegistrationOut)
 def create_patient(payload: schemas.PatientsRegistrationCreate):
@@ -18,11 +57,14 @@ def create_patient(payload: schemas.PatientsRegistrationCreate):
         raise HTTPException(status_code=502, detail=str(e))
 
 @router.get("/patients", response_model=list[schemas.PatientsRegistrationOut])
-def list_patients(skip: int = 0, limit: int = Query(100, le=1000)):
+def list_patients(request: Request, skip: int = 0, limit: int = Query(100, le=1000)):
     try:
-        return crud.get_patients(skip=skip, limit=limit)
+        with crud.pinned_snapshots(["patients_registration"]) as snapshots:
+            records = crud.get_patients(skip=skip, limit=limit)
+        etag = table_etag(snapshots, skip, limit)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(request, list[schemas.PatientsRegistrationOut], records, etag=etag)
 
 @router.get("/patients/{patient_id}", response_model=schemas.PatientsRegistrationOut)
 def get_patient(patient_id: int):
@@ -36,6 +78,35 @@ def get_patient(patient_id: int):
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
 
+@router.get("/patients/{patient_id}/context", response_model=schemas.PatientContextOut)
+def get_patient_context(
+    request: Request,
+    patient_id: int,
+    include: Optional[str] = Query(
+        None,
+        description="逗号分隔的部分，默认全部：" + ",".join(crud.CONTEXT_SECTIONS),
+    ),
+):
+    """
+    病人综合视图：一次返回病人信息、最新诊断 / 处方 / 检验申请、药店与实验室偏好、最近的药店与实验室。
+    所需的表并发读取、每张表只读一次；ETag 由各表快照版本计算，未变化时返回 304。
+    """
+    sections = [s.strip() for s in include.split(",") if s.strip()] if include else list(crud.CONTEXT_SECTIONS)
+    unknown = [s for s in sections if s not in crud.CONTEXT_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}")
+    try:
+        with crud.pinned_snapshots(crud.context_tables(sections)) as snapshots:
+            context = crud.get_patient_context(patient_id, sections)
+        if "patient" in sections and context["patient"] is None and "patient" not in context["errors"]:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        etag = None if context["errors"] else table_etag(snapshots, patient_id, *sections)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(request, schemas.PatientContextOut, context, etag=etag)
+
 # Diagnosis
 @router.post("/diagnosis", response_model=schemas.DiagnosisOut)
 def create_diagnosis(payload: schemas.DiagnosisCreate):
@@ -98,11 +169,14 @@ def create_preference(payload: schemas.PatientPreferenceCreate):
         raise HTTPException(status_code=502, detail=str(e))
 
 @router.get("/preferences", response_model=list[schemas.PatientPreferenceOut])
-def list_preferences(skip: int = 0, limit: int = Query(100, le=1000)):
+def list_preferences(request: Request, skip: int = 0, limit: int = Query(100, le=1000)):
     try:
-        return crud.get_preferences(skip=skip, limit=limit)
+        with crud.pinned_snapshots(["patient_preference"]) as snapshots:
+            records = crud.get_preferences(skip=skip, limit=limit)
+        etag = table_etag(snapshots, skip, limit)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(request, list[schemas.PatientPreferenceOut], records, etag=etag)
 
 @router.get(
     "/preferences/by-patient",
@@ -143,16 +217,22 @@ def get_preferences_by_patient_and_type(
     response_model=list[schemas.PreferredPharmacyOut],
 )
 def get_pharmacy_preferences(
+    request: Request,
     patient_id: int = Query(..., description="Patient ID"),
 ):
     """
     根据 patient_id 返回该病人的所有 pharmacy 偏好，包含完整的药店信息和距离。
     """
     try:
-        records = crud.get_detailed_pharmacy_preferences(patient_id)
-        return records
+        # ETag 由所依赖表的快照版本 + patient_id 计算，命中时不再组装偏好详情
+        with crud.pinned_snapshots(crud.CONTEXT_SECTIONS["pharmacy_preferences"]) as snapshots:
+            etag = table_etag(snapshots, patient_id)
+            if etag is not None and etag_matches(request, etag):
+                return not_modified(etag, REVALIDATE_CACHE_CONTROL)
+            records = crud.get_detailed_pharmacy_preferences(patient_id)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(request, list[schemas.PreferredPharmacyOut], records, etag=etag)
 
 
 # 新接口：patient 的 lab 偏好（返回完整信息）
@@ -161,16 +241,22 @@ def get_pharmacy_preferences(
     response_model=list[schemas.PreferredLabOut],
 )
 def get_lab_preferences(
+    request: Request,
     patient_id: int = Query(..., description="Patient ID"),
 ):
     """
     根据 patient_id 返回该病人的所有 lab 偏好，包含完整的实验室信息和距离。
     """
     try:
-        records = crud.get_detailed_lab_preferences(patient_id)
-        return records
+        # ETag 由所依赖表的快照版本 + patient_id 计算，命中时不再组装偏好详情
+        with crud.pinned_snapshots(crud.CONTEXT_SECTIONS["lab_preferences"]) as snapshots:
+            etag = table_etag(snapshots, patient_id)
+            if etag is not None and etag_matches(request, etag):
+                return not_modified(etag, REVALIDATE_CACHE_CONTROL)
+            records = crud.get_detailed_lab_preferences(patient_id)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(request, list[schemas.PreferredLabOut], records, etag=etag)
 
 # Prescription
 @router.post("/prescriptions", response_model=schemas.PrescriptionFormOut)
@@ -187,12 +273,29 @@ def create_prescription(payload: schemas.PrescriptionFormCreate):
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
 
+@router.post("/prescriptions/batch", response_model=schemas.PrescriptionBatchOut)
+def create_prescriptions_batch(payload: list[schemas.PrescriptionFormCreate]):
+    """
+    批量增：整批先按 PrescriptionFormCreate 校验（任一条不合法则整批 422），
+    一次分配连续的 prescription_id 后批量写入远端，返回逐条状态（部分失败不影响其他条目）。
+    """
+    if len(payload) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"Batch too large: at most {settings.batch_max_items} items")
+    try:
+        items = crud.create_prescriptions(payload)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    created = sum(1 for item in items if item["status"] == "created")
+    return {"created": created, "failed": len(items) - created, "items": items}
+
 # ✏️ 微调：列表处方时也返回 pharmacy_name + 纯地址
 @router.get("/prescriptions", response_model=list[schemas.PrescriptionWithPharmacyOut])
-def list_prescriptions(skip: int = 0, limit: int = Query(100, le=1000)):
+def list_prescriptions(request: Request, skip: int = 0, limit: int = Query(100, le=1000)):
     try:
         records = crud.get_prescriptions(skip=skip, limit=limit)
-        result: list[schemas.PrescriptionWithPharmacyOut] = []
+        # 直接构造 dict，由 TypeAdapter 整批校验 + 序列化（不再逐行构造 Pydantic 对象）
+        result: list[Dict[str, Any]] = []
+        pharmacy_cache: Dict[Any, Tuple[Optional[str], Optional[str]]] = {}
 
         for pres in records:
             pharmacy_name = None
@@ -200,26 +303,18 @@ def list_prescriptions(skip: int = 0, limit: int = Query(100, le=1000)):
             pharmacy_id = pres.get("pharmacy_id")
 
             if pharmacy_id is not None:
-                ph = crud.get_pharmacy(pharmacy_id)
-                if ph:
-                    pharmacy_name = ph.get("name")
-                    raw_addr = ph.get("address")
-                    if raw_addr and "||" in raw_addr:
-                        pharmacy_address = raw_addr.split("||", 1)[0].strip()
-                    else:
-                        pharmacy_address = raw_addr
-
-            pres_out = schemas.PrescriptionFormOut(**pres)
-            result.append(
-                schemas.PrescriptionWithPharmacyOut(
-                    prescription=pres_out,
-                    pharmacy_name=pharmacy_name,
-                    pharmacy_address=pharmacy_address,
+                pharmacy_name, pharmacy_address = _facility_brief(
+                    pharmacy_id, crud.get_pharmacy, pharmacy_cache
                 )
-            )
-        return result
+
+            result.append({
+                "prescription": pres,
+                "pharmacy_name": pharmacy_name,
+                "pharmacy_address": pharmacy_address,
+            })
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(request, list[schemas.PrescriptionWithPharmacyOut], result)
 
 
 # ✏️ 微调：单条查询处方也返回带 pharmacy 信息的结构
@@ -340,39 +435,23 @@ def update_prescription_pharmacy(prescription_id: str, payload: schemas.UpdatePr
         raise HTTPException(status_code=502, detail=str(e))
 
 
-# ✅ 新增：模拟发送处方传真到对应 pharmacy（根据 prescription_id 查询）
+# ✅ 发送处方传真到对应 pharmacy（进入传真队列，异步发送，见 app/fax.py）
 @router.post("/prescriptions/{prescription_id}/fax", response_model=str)
 def fax_prescription(prescription_id: str):
     """
-    Simulate sending a fax of a prescription form to its associated pharmacy.
+    Queue a fax of a prescription form to its associated pharmacy.
+    Delivery status can be polled with GET /fax/jobs/{job_id}.
 
     Response example:
-      "Fax sent for patient (ID: 1)'s prescription form (ID: 1763831311) to pharmacy (ID: 2)."
+      "Fax queued for patient (ID: 1)'s prescription form (ID: 1763831311) to pharmacy (ID: 2). Job ID: 3f2a..."
     """
-    try:
-        pres = crud.get_prescription(prescription_id)
-        if not pres:
-            raise HTTPException(status_code=404, detail=f"Prescription with ID {prescription_id} not found.")
+    return _fax_one("prescription", prescription_id)
 
-        patient_id = pres.get("patient_id")
-        pharmacy_id = pres.get("pharmacy_id")
 
-        if pharmacy_id is None:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Prescription {prescription_id} has no associated pharmacy_id."
-            )
-
-        message = (
-            f"Fax sent for patient (ID: {patient_id})'s prescription form "
-            f"(ID: {prescription_id}) to pharmacy (ID: {pharmacy_id})."
-        )
-        print(f"[FAX SIMULATION] {message}")
-        return message
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=str(e))
+@router.get("/prescriptions/{prescription_id}/document", response_class=FileResponse)
+def get_prescription_document(request: Request, prescription_id: str):
+    """处方的传真文档（PDF）预览；内容未变化时复用已渲染的文件，ETag 为内容哈希。"""
+    return _document_response(request, "prescription", prescription_id)
 
 
 # Requisition
@@ -389,12 +468,28 @@ def create_requisition(payload: schemas.RequisitionFormCreate):
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
 
+@router.post("/requisitions/batch", response_model=schemas.RequisitionBatchOut)
+def create_requisitions_batch(payload: list[schemas.RequisitionFormCreate]):
+    """
+    批量增：整批先按 RequisitionFormCreate 校验，一次分配连续的 requisition_id 后批量写入远端，
+    返回逐条状态。
+    """
+    if len(payload) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"Batch too large: at most {settings.batch_max_items} items")
+    try:
+        items = crud.create_requisitions(payload)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    created = sum(1 for item in items if item["status"] == "created")
+    return {"created": created, "failed": len(items) - created, "items": items}
+
 # ✏️ 微调：列表检验申请时也返回 lab_name + 纯地址
 @router.get("/requisitions", response_model=list[schemas.RequisitionWithLabOut])
-def list_requisitions(skip: int = 0, limit: int = Query(100, le=1000)):
+def list_requisitions(request: Request, skip: int = 0, limit: int = Query(100, le=1000)):
     try:
         records = crud.get_requisitions(skip=skip, limit=limit)
-        result: list[schemas.RequisitionWithLabOut] = []
+        result: list[Dict[str, Any]] = []
+        lab_cache: Dict[Any, Tuple[Optional[str], Optional[str]]] = {}
 
         for req in records:
             lab_name = None
@@ -402,26 +497,16 @@ def list_requisitions(skip: int = 0, limit: int = Query(100, le=1000)):
             lab_id = req.get("lab_id")
 
             if lab_id is not None:
-                lab = crud.get_lab(lab_id)
-                if lab:
-                    lab_name = lab.get("name")
-                    raw_addr = lab.get("address")
-                    if raw_addr and "||" in raw_addr:
-                        lab_address = raw_addr.split("||", 1)[0].strip()
-                    else:
-                        lab_address = raw_addr
-
-            req_out = schemas.RequisitionFormOut(**req)
-            result.append(
-                schemas.RequisitionWithLabOut(
-                    requisition=req_out,
-                    lab_name=lab_name,
-                    lab_address=lab_address,
-                )
-            )
-        return result
+                lab_name, lab_address = _facility_brief(lab_id, crud.get_lab, lab_cache)
+
+            result.append({
+                "requisition": req,
+                "lab_name": lab_name,
+                "lab_address": lab_address,
+            })
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(request, list[schemas.RequisitionWithLabOut], result)
 
 
 # ✏️ 微调：单条查询检验申请也返回带 lab 信息的结构
@@ -511,35 +596,19 @@ def set_requisition_lab(requisition_id: str, payload: dict):
 @router.post("/requisitions/{requisition_id}/fax", response_model=str)
 def fax_requisition(requisition_id: str):
     """
-    Simulate sending a fax of a requisition form to its associated lab.
+    Queue a fax of a requisition form to its associated lab.
+    Delivery status can be polled with GET /fax/jobs/{job_id}.
 
     Response example:
-      "Fax sent for patient (ID: 1)'s requisition form (ID: 1763837273) to lab (ID: 3)."
+      "Fax queued for patient (ID: 1)'s requisition form (ID: 1763837273) to lab (ID: 3). Job ID: 9c1b..."
     """
-    try:
-        req = crud.get_requisition(requisition_id)
-        if not req:
-            raise HTTPException(status_code=404, detail=f"Requisition with ID {requisition_id} not found.")
+    return _fax_one("requisition", requisition_id)
 
-        patient_id = req.get("patient_id")
-        lab_id = req.get("lab_id")
 
-        if lab_id is None:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Requisition {requisition_id} has no associated lab_id."
-            )
-
-        message = (
-            f"Fax sent for patient (ID: {patient_id})'s requisition form "
-            f"(ID: {requisition_id}) to lab (ID: {lab_id})."
-        )
-        print(f"[FAX SIMULATION] {message}")
-        return message
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=str(e))
+@router.get("/requisitions/{requisition_id}/document", response_class=FileResponse)
+def get_requisition_document(request: Request, requisition_id: str):
+    """检验申请的传真文档（PDF）预览；内容未变化时复用已渲染的文件，ETag 为内容哈希。"""
+    return _document_response(request, "requisition", requisition_id)
 
 
 # 只保留 path 形式的 latest：/requisitions/latest/{patient_id}
@@ -581,6 +650,135 @@ def get_latest_requisition_with_lab(patient_id: int = Path(..., description="Pat
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
 
+# Change feed
+def _get_feed(feed: str) -> changes.ChangeFeed:
+    change_feed = changes.get_feed(feed)
+    if change_feed is None:
+        raise HTTPException(status_code=404, detail=f"Unknown change feed: {feed} (expected one of {', '.join(changes.FEEDS)})")
+    return change_feed
+
+
+@router.get("/changes/{feed}", response_model=schemas.ChangeFeedOut)
+async def get_changes(
+    feed: str,
+    since: Optional[str] = Query(None, description="上次返回的 cursor；不传时返回全部行（reset）"),
+    wait: float = Query(0.0, ge=0, description="长轮询：没有新变更时最多等待的秒数"),
+):
+    """
+    增量变更流：返回 cursor 之后新增 / 修改 / 删除的处方（feed=prescriptions）或检验申请（feed=requisitions）。
+    """
+    change_feed = _get_feed(feed)
+    try:
+        return await change_feed.read(
+            since, wait=min(wait, settings.change_feed_max_wait_s), poll_interval=settings.change_feed_poll_s
+        )
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+
+@router.get("/changes/{feed}/stream")
+async def stream_changes(request: Request, feed: str, since: Optional[str] = None):
+    """
+    SSE 版本的变更流：每批变更一个 `changes` 事件（data 与 GET /changes/{feed} 的返回相同，id 为新的 cursor），
+    空闲时发送注释行保活。断线重连时浏览器会带上 Last-Event-ID，从该游标继续。
+    """
+    change_feed = _get_feed(feed)
+    cursor = since or request.headers.get("last-event-id")
+
+    async def events():
+        nonlocal cursor
+        while not await request.is_disconnected():
+            try:
+                result = await change_feed.read(
+                    cursor, wait=settings.change_feed_max_wait_s, poll_interval=settings.change_feed_poll_s
+                )
+            except Exception as e:
+                yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+                return
+            if result["reset"] or result["changes"]:
+                data = dump_json(schemas.ChangeFeedOut, result).decode("utf-8")
+                yield f"id: {result['cursor']}\nevent: changes\ndata: {data}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+            cursor = result["cursor"]
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Fax
+def _fax_one(kind: str, record_id: str) -> str:
+    """单条传真：入队并返回确认消息；表单不存在 404，没有关联的药店 / 实验室 400。"""
+    try:
+        jobs, errors = fax.submit(kind, [record_id])
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    if errors:
+        raise HTTPException(status_code=errors[0]["status_code"], detail=errors[0]["error"])
+    job = jobs[0]
+    facility_kind = fax.JOB_KINDS[kind][2]
+    return (
+        f"Fax queued for patient (ID: {job['patient_id']})'s {kind} form "
+        f"(ID: {record_id}) to {facility_kind} (ID: {job['facility_id']}). Job ID: {job['job_id']}"
+    )
+
+
+def _document_response(request: Request, kind: str, record_id: str):
+    try:
+        doc = documents.get_document(kind, record_id)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    if doc is None:
+        raise HTTPException(status_code=404, detail=f"{kind.capitalize()} with ID {record_id} not found.")
+    etag = f'"{doc.content_hash}"'
+    if etag_matches(request, etag):
+        return not_modified(etag, REVALIDATE_CACHE_CONTROL)
+    return FileResponse(
+        doc.path,
+        media_type="application/pdf",
+        filename=f"{kind}-{record_id}.pdf",
+        content_disposition_type="inline",
+        headers={"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL},
+    )
+
+
+@router.post("/fax/batch", response_model=schemas.FaxBulkOut)
+def fax_batch(payload: schemas.FaxBulkRequest):
+    """
+    批量传真：一次提交多张处方 / 检验申请，发往各自关联的药店 / 实验室（同一接收方合并成批发送）。
+    返回新建的任务与逐条错误；之后通过 GET /fax/jobs 轮询发送状态。
+    """
+    if len(payload.prescription_ids) + len(payload.requisition_ids) > settings.batch_max_items:
+        raise HTTPException(status_code=413, detail=f"Batch too large: at most {settings.batch_max_items} items")
+    try:
+        jobs, errors = fax.submit("prescription", payload.prescription_ids)
+        req_jobs, req_errors = fax.submit("requisition", payload.requisition_ids)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return {"jobs": jobs + req_jobs, "errors": errors + req_errors}
+
+
+@router.get("/fax/jobs", response_model=list[schemas.FaxJobOut])
+def list_fax_jobs(ids: str = Query(..., description="逗号分隔的 job_id")):
+    """批量查询传真任务状态（不存在的 job_id 不出现在结果中）。"""
+    job_ids = [job_id.strip() for job_id in ids.split(",") if job_id.strip()]
+    try:
+        return fax.get_jobs(job_ids)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+
+@router.get("/fax/jobs/{job_id}", response_model=schemas.FaxJobOut)
+def get_fax_job(job_id: str):
+    try:
+        jobs = fax.get_jobs([job_id])
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Fax job not found")
+    return jobs[0]
+
 # Pharmacy
 @router.post("/pharmacies", response_model=schemas.PharmacyRegistrationOut)
 def create_pharmacy(payload: schemas.PharmacyRegistrationCreate):
@@ -590,32 +788,51 @@ def create_pharmacy(payload: schemas.PharmacyRegistrationCreate):
         raise HTTPException(status_code=502, detail=str(e))
 
 @router.get("/pharmacies", response_model=list[schemas.PharmacyRegistrationOut])
-def list_pharmacies(skip: int = 0, limit: int = Query(100, le=1000)):
+def list_pharmacies(request: Request, skip: int = 0, limit: int = Query(100, le=1000)):
     try:
-        return crud.get_pharmacies(skip=skip, limit=limit)
+        with crud.pinned_snapshots(["pharmacy_registration"]) as snapshots:
+            records = crud.get_pharmacies(skip=skip, limit=limit)
+        etag = table_etag(snapshots, skip, limit)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(
+        request, list[schemas.PharmacyRegistrationOut], records,
+        etag=etag, cache_control=REGISTRY_CACHE_CONTROL,
+    )
 
 @router.get("/pharmacies/{pharmacy_id}", response_model=schemas.PharmacyRegistrationOut)
-def get_pharmacy(pharmacy_id: int):
+def get_pharmacy(request: Request, pharmacy_id: int):
     try:
-        obj = crud.get_pharmacy(pharmacy_id)
+        with crud.pinned_snapshots(["pharmacy_registration"]) as snapshots:
+            obj = crud.get_pharmacy(pharmacy_id)
         if not obj:
             raise HTTPException(status_code=404, detail="Pharmacy not found")
-        return obj
+        etag = table_etag(snapshots, pharmacy_id)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(
+        request, schemas.PharmacyRegistrationOut, obj,
+        etag=etag, cache_control=REGISTRY_CACHE_CONTROL,
+    )
 
 # 新增：获取最近的5个药店
 @router.get("/pharmacies/nearest/{patient_id}", response_model=list[schemas.NearbyPharmacyOut])
-def get_nearest_pharmacies(patient_id: int):
+def get_nearest_pharmacies(request: Request, patient_id: int):
     try:
-        pharmacies = crud.get_nearest_pharmacies(patient_id)
-        return pharmacies
+        # ETag 由病人表与注册表的快照版本 + patient_id 计算，命中时跳过距离计算
+        with crud.pinned_snapshots(crud.CONTEXT_SECTIONS["nearest_pharmacies"]) as snapshots:
+            etag = table_etag(snapshots, patient_id)
+            if etag is not None and etag_matches(request, etag):
+                return not_modified(etag, REGISTRY_CACHE_CONTROL)
+            pharmacies = crud.get_nearest_pharmacies(patient_id)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(
+        request, list[schemas.NearbyPharmacyOut], pharmacies,
+        etag=etag, cache_control=REGISTRY_CACHE_CONTROL,
+    )
 
 
 # Lab
@@ -627,32 +844,51 @@ def create_lab(payload: schemas.LabRegistrationCreate):
         raise HTTPException(status_code=502, detail=str(e))
 
 @router.get("/labs", response_model=list[schemas.LabRegistrationOut])
-def list_labs(skip: int = 0, limit: int = Query(100, le=1000)):
+def list_labs(request: Request, skip: int = 0, limit: int = Query(100, le=1000)):
     try:
-        return crud.get_labs(skip=skip, limit=limit)
+        with crud.pinned_snapshots(["lab_registration"]) as snapshots:
+            records = crud.get_labs(skip=skip, limit=limit)
+        etag = table_etag(snapshots, skip, limit)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(
+        request, list[schemas.LabRegistrationOut], records,
+        etag=etag, cache_control=REGISTRY_CACHE_CONTROL,
+    )
 
 @router.get("/labs/{lab_id}", response_model=schemas.LabRegistrationOut)
-def get_lab(lab_id: int):
+def get_lab(request: Request, lab_id: int):
     try:
-        obj = crud.get_lab(lab_id)
+        with crud.pinned_snapshots(["lab_registration"]) as snapshots:
+            obj = crud.get_lab(lab_id)
         if not obj:
             raise HTTPException(status_code=404, detail="Lab not found")
-        return obj
+        etag = table_etag(snapshots, lab_id)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(
+        request, schemas.LabRegistrationOut, obj,
+        etag=etag, cache_control=REGISTRY_CACHE_CONTROL,
+    )
 
 # 新增：获取最近的5个实验室
 @router.get("/labs/nearest/{patient_id}", response_model=list[schemas.NearbyLabOut])
-def get_nearest_labs(patient_id: int):
+def get_nearest_labs(request: Request, patient_id: int):
     try:
-        labs = crud.get_nearest_labs(patient_id)
-        return labs
+        # ETag 由病人表与注册表的快照版本 + patient_id 计算，命中时跳过距离计算
+        with crud.pinned_snapshots(crud.CONTEXT_SECTIONS["nearest_labs"]) as snapshots:
+            etag = table_etag(snapshots, patient_id)
+            if etag is not None and etag_matches(request, etag):
+                return not_modified(etag, REGISTRY_CACHE_CONTROL)
+            labs = crud.get_nearest_labs(patient_id)
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    return conditional_json(
+        request, list[schemas.NearbyLabOut], labs,
+        etag=etag, cache_control=REGISTRY_CACHE_CONTROL,
+    )
 
 
 # ----------- AI function calling demo -----------
@@ -730,6 +966,8 @@ def generate_orders_from_latest_diagnosis(body: schemas.AutoOrdersRequest):
             patient_id=body.patient_id,
             prescription=pres_out,
             requisition=req_out,
+            source=result.get("source", "llm"),
+            template_confidence=result.get("template_confidence"),
         )
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
@@ -777,6 +1015,7 @@ def complete_prescription_from_latest_diagnosis(body: schemas.CompletePrescripti
         return schemas.CompletePrescriptionResponse(
             patient_id=body.patient_id,
             prescription=pres_out,
+            llm_skipped=result.get("llm_skipped", False),
         )
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
@@ -824,6 +1063,7 @@ def complete_requisition_from_latest_diagnosis(body: schemas.CompleteRequisition
         return schemas.CompleteRequisitionResponse(
             patient_id=body.patient_id,
             requisition=req_out,
+            llm_skipped=result.get("llm_skipped", False),
         )
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
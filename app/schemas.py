@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, validator
-from typing import Dict, Any, Optional, Union
+from typing import Dict, Any, List, Optional, Union
 
 # 新增：用于表示经纬度的模型
 class Coordinates(BaseModel):
@@ -139,6 +139,20 @@ class PrescriptionFormOut(PrescriptionFormCreate):
         from_attributes = True
 
 
+# 批量创建处方：逐条结果（index 对应请求列表中的位置）
+class PrescriptionBatchItemOut(BaseModel):
+    index: int
+    status: str  # "created" | "error"
+    prescription_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+class PrescriptionBatchOut(BaseModel):
+    created: int
+    failed: int
+    items: List[PrescriptionBatchItemOut]
+
+
 # 最新处方 + 关联 pharmacy 数据
 class PrescriptionWithPharmacyOut(BaseModel):
     prescription: PrescriptionFormOut
@@ -184,6 +198,20 @@ class RequisitionFormOut(RequisitionFormCreate):
         from_attributes = True
 
 
+# 批量创建检验申请：逐条结果
+class RequisitionBatchItemOut(BaseModel):
+    index: int
+    status: str  # "created" | "error"
+    requisition_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+class RequisitionBatchOut(BaseModel):
+    created: int
+    failed: int
+    items: List[RequisitionBatchItemOut]
+
+
 # 新增：用于更新最新处方 pharmacy_id 的请求体
 class UpdatePrescriptionPharmacyRequest(BaseModel):
     pharmacy_id: int
@@ -284,6 +312,72 @@ class NearbyLabOut(BaseModel):
     distance_km: Optional[float] = None
 
 
+# ---------------- Patient context ----------------
+
+# 病人综合视图：未请求（include 中没有）或没有数据的部分为 None，失败的部分记入 errors
+class PatientContextOut(BaseModel):
+    patient_id: int
+    patient: Optional[PatientsRegistrationOut] = None
+    latest_diagnosis: Optional[DiagnosisOut] = None
+    latest_prescription: Optional[PrescriptionWithPharmacyOut] = None
+    latest_requisition: Optional[RequisitionWithLabOut] = None
+    pharmacy_preferences: Optional[List[PreferredPharmacyOut]] = None
+    lab_preferences: Optional[List[PreferredLabOut]] = None
+    nearest_pharmacies: Optional[List[NearbyPharmacyOut]] = None
+    nearest_labs: Optional[List[NearbyLabOut]] = None
+    errors: Dict[str, str] = {}
+
+
+# ---------------- Fax ----------------
+
+# 传真任务状态：queued -> sending -> sent / failed
+class FaxJobOut(BaseModel):
+    job_id: str
+    kind: str  # "prescription" | "requisition"
+    record_id: str
+    patient_id: Optional[str] = None
+    facility_id: str  # pharmacy_id 或 lab_id
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
+    batch_id: Optional[str] = None
+    delivery_ref: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+
+class FaxBulkRequest(BaseModel):
+    prescription_ids: List[str] = []
+    requisition_ids: List[str] = []
+
+
+class FaxBulkErrorOut(BaseModel):
+    kind: str
+    record_id: str
+    status_code: int  # 404：表单不存在；400：没有关联的药店 / 实验室
+    error: str
+
+
+class FaxBulkOut(BaseModel):
+    jobs: List[FaxJobOut]
+    errors: List[FaxBulkErrorOut]
+
+
+# ---------------- Change feed ----------------
+
+class ChangeOut(BaseModel):
+    op: str  # "insert" | "update" | "delete"；reset 时为 "upsert"
+    id: str
+    row: Optional[Dict[str, Any]] = None  # delete 时为 None
+
+
+# reset=true 时 changes 为当前全部行（客户端应替换本地列表）；下次请求带上 cursor
+class ChangeFeedOut(BaseModel):
+    cursor: str
+    reset: bool
+    changes: List[ChangeOut]
+
+
 # ---------------- Agent ----------------
 class WorkflowRequest(BaseModel):
     # 直接调用工具，不需要自然语言聊天。
@@ -325,6 +419,8 @@ class AutoOrdersResponse(BaseModel):
     patient_id: int
     prescription: PrescriptionFormOut
     requisition: RequisitionFormOut
+    source: str = Field("llm", description='"template" when a learned order set for the diagnosis was reused, else "llm".')
+    template_confidence: Optional[float] = None
 
 
 # ✅ 新增：高层 workflow - 补全已有处方
@@ -344,6 +440,9 @@ class CompletePrescriptionResponse(BaseModel):
     """
     patient_id: int
     prescription: PrescriptionFormOut
+    llm_skipped: bool = Field(
+        False, description="True when the form was already complete and unchanged, so the LLM was not called."
+    )
 
 
 # ✅ 新增：高层 workflow - 补全已有检验申请
@@ -363,3 +462,6 @@ class CompleteRequisitionResponse(BaseModel):
     """
     patient_id: int
     requisition: RequisitionFormOut
+    llm_skipped: bool = Field(
+        False, description="True when the form was already complete and unchanged, so the LLM was not called."
+    )
@@ -0,0 +1,59 @@
+"""
+高吞吐 JSON 响应路径。
+
+FastAPI 默认会对 endpoint 返回值按 response_model 再做一次校验 + 序列化；
+列表接口如果在路由里逐行构造 Pydantic 对象，同一份数据会被处理两遍。
+这里为每个响应类型缓存一个 Pydantic v2 TypeAdapter，整批校验后直接由
+pydantic-core 序列化为 bytes，绕过 response_model 的二次处理。
+
+路由里把远端异常映射为 502 的 try 块只应包住取数；dump_json / json_response
+放在 try 之外调用，校验 / 序列化失败是本服务的 bug，应以 500 暴露。
+"""
+from threading import Lock
+from typing import Any, Dict, Optional
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+# 响应类型 -> TypeAdapter，每个 schema 只构建一次
+_ADAPTERS: Dict[Any, TypeAdapter] = {}
+_ADAPTERS_LOCK = Lock()
+
+
+def get_adapter(tp: Any) -> TypeAdapter:
+    """返回（并缓存）给定类型的 TypeAdapter，例如 list[schemas.NearbyPharmacyOut]。"""
+    adapter = _ADAPTERS.get(tp)
+    if adapter is None:
+        with _ADAPTERS_LOCK:
+            adapter = _ADAPTERS.get(tp)
+            if adapter is None:
+                adapter = TypeAdapter(tp)
+                _ADAPTERS[tp] = adapter
+    return adapter
+
+
+def dump_json(tp: Any, data: Any) -> bytes:
+    """整批校验 data 并直接序列化为 JSON bytes（与 response_model 的输出一致）。"""
+    adapter = get_adapter(tp)
+    validated = adapter.validate_python(data)
+    return adapter.dump_json(validated, by_alias=True)
+
+
+def json_response(
+    tp: Any,
+    data: Any,
+    status_code: int = 200,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    构造已序列化好的 JSON 响应。
+
+    endpoint 直接返回 Response 时 FastAPI 不会再走 response_model，
+    因此装饰器上的 response_model 只用于 OpenAPI 文档。
+    """
+    return Response(
+        content=dump_json(tp, data),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json",
+    )
@@ -0,0 +1,217 @@
+"""
+多 worker 进程共享的远端表快照存储（SQLite，WAL 模式）。
+
+WEB_CONCURRENCY > 1 时每个 worker 都有自己的 RemoteTableClient；如果各自下载远端表，
+N 个 worker 就是 N 倍的远端流量。这里把「最近一次下载到的响应体」放进一个所有 worker
+都能读写的 SQLite 文件：
+
+- snapshots  ：表 -> 内容版本、ETag / Last-Modified、响应体、下载时间、下载发起时的写入代数；
+- generations：表 -> 写入代数。任一 worker 写入某张表后 +1；其他 worker 读取时发现代数变化，
+  就不再直接返回本地快照，也不接受代数更旧的共享条目（跨进程失效传播，保证读到自己的写入）；
+- leases     ：表 -> 正在下载的 worker 与租约到期时间。同一时刻只有一个 worker 下载某张表，
+  其余 worker 等它写入后直接取用；
+- id_ranges  ：表 -> 下一个可分配的自增 ID。各 worker 从这里预留连续的 ID 段，避免并发创建时重复。
+
+共享的是响应体而不是解析结果：每个 worker 仍在本进程内解析、建索引（本地已有快照时按行增量合并）。
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import NamedTuple, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    table_name    TEXT PRIMARY KEY,
+    version       TEXT NOT NULL,
+    etag          TEXT,
+    last_modified TEXT,
+    body          BLOB NOT NULL,
+    fetched_at    REAL NOT NULL,
+    generation    INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS generations (
+    table_name TEXT PRIMARY KEY,
+    gen        INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    table_name TEXT PRIMARY KEY,
+    holder     TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS id_ranges (
+    table_name TEXT PRIMARY KEY,
+    next_id    INTEGER NOT NULL
+);
+"""
+
+
+def default_path() -> str:
+    """未配置 SHARED_CACHE_PATH 时多 worker 模式使用的文件。"""
+    return os.path.join(tempfile.gettempdir(), "ehealth-snapshots.sqlite3")
+
+
+class SharedEntry(NamedTuple):
+    version: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    body: Optional[bytes]  # 与调用方已有快照同版本或 with_body=False 时为 None（不读取响应体）
+    fetched_at: float
+    generation: int
+
+
+class SharedSnapshotStore:
+    """
+    ttl：共享条目在下载后多少秒内可被其他 worker 直接使用（超过后需要重新向远端验证）；
+    lease_s：下载租约时长，持有者崩溃时租约到期后其他 worker 可以接手。
+    """
+
+    def __init__(self, path: str, ttl: float = 5.0, lease_s: float = 30.0, poll_interval: float = 0.05):
+        self.path = path
+        self.ttl = ttl
+        self.lease_s = lease_s
+        self.poll_interval = poll_interval
+        self.holder = f"{os.getpid()}"
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 连接不能跨线程共享：每个线程一个连接，autocommit
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- 写入代数 ----
+
+    def generation(self, table: str) -> int:
+        row = self._conn().execute("SELECT gen FROM generations WHERE table_name = ?", (table,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, table: str) -> None:
+        self._conn().execute(
+            "INSERT INTO generations (table_name, gen) VALUES (?, 1) "
+            "ON CONFLICT(table_name) DO UPDATE SET gen = gen + 1",
+            (table,),
+        )
+
+    # ---- 快照 ----
+
+    def load(
+        self, table: str, generation: int, known_version: Optional[str] = None, with_body: bool = True
+    ) -> Optional[SharedEntry]:
+        """
+        返回可直接使用的共享条目：下载时的写入代数 >= generation 且未超过 ttl；否则 None。
+        条目版本等于 known_version 或 with_body=False 时不读取响应体。
+        """
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT version, etag, last_modified, fetched_at, generation FROM snapshots WHERE table_name = ?",
+            (table,),
+        ).fetchone()
+        if row is None:
+            return None
+        version, etag, last_modified, fetched_at, gen = row
+        if gen < generation or time.time() - fetched_at > self.ttl:
+            return None
+        body = None
+        if with_body and version != known_version:
+            found = conn.execute(
+                "SELECT body FROM snapshots WHERE table_name = ? AND version = ?", (table, version)
+            ).fetchone()
+            if found is None:  # 两次查询之间被其他 worker 覆盖
+                return None
+            body = bytes(found[0])
+        return SharedEntry(version, etag, last_modified, body, fetched_at, gen)
+
+    def save(
+        self,
+        table: str,
+        version: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        body: bytes,
+        generation: int,
+    ) -> None:
+        """写入一次下载结果；不会覆盖代数更新的条目。"""
+        self._conn().execute(
+            "INSERT INTO snapshots (table_name, version, etag, last_modified, body, fetched_at, generation) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(table_name) DO UPDATE SET version = excluded.version, etag = excluded.etag, "
+            "last_modified = excluded.last_modified, body = excluded.body, "
+            "fetched_at = excluded.fetched_at, generation = excluded.generation "
+            "WHERE excluded.generation >= snapshots.generation",
+            (table, version, etag, last_modified, sqlite3.Binary(body), time.time(), generation),
+        )
+
+    def touch(self, table: str, version: str, generation: int) -> None:
+        """远端确认内容未变（304 / 内容哈希相同）：刷新下载时间和代数。"""
+        self._conn().execute(
+            "UPDATE snapshots SET fetched_at = ?, generation = MAX(generation, ?) "
+            "WHERE table_name = ? AND version = ?",
+            (time.time(), generation, table, version),
+        )
+
+    # ---- 自增 ID ----
+
+    def reserve_ids(self, table: str, floor: int, count: int) -> int:
+        """
+        原子地预留 count 个连续 ID，返回起始 ID：起点不小于 floor（快照中的最大主键 + 1），
+        也不小于任何 worker 之前预留过的 ID。
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT next_id FROM id_ranges WHERE table_name = ?", (table,)).fetchone()
+            start = max(floor, row[0] if row else 0)
+            conn.execute(
+                "INSERT INTO id_ranges (table_name, next_id) VALUES (?, ?) "
+                "ON CONFLICT(table_name) DO UPDATE SET next_id = excluded.next_id",
+                (table, start + count),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return start
+
+    # ---- 下载租约 ----
+
+    def acquire(self, table: str) -> bool:
+        """尝试获得该表的下载租约；其他 worker 持有未过期的租约时返回 False。"""
+        now = time.time()
+        cur = self._conn().execute(
+            "INSERT INTO leases (table_name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(table_name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at < ? OR leases.holder = excluded.holder",
+            (table, self.holder, now + self.lease_s, now),
+        )
+        return cur.rowcount == 1
+
+    def release(self, table: str) -> None:
+        self._conn().execute("DELETE FROM leases WHERE table_name = ? AND holder = ?", (table, self.holder))
+
+    def _leased(self, table: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM leases WHERE table_name = ? AND expires_at >= ?", (table, time.time())
+        ).fetchone()
+        return row is not None
+
+    def wait(
+        self, table: str, generation: int, known_version: Optional[str], timeout: float, with_body: bool = True
+    ) -> Optional[SharedEntry]:
+        """
+        等待持有租约的 worker 写入结果。租约释放（下载失败）或超时仍没有可用条目时返回 None，
+        调用方应自行下载。
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            entry = self.load(table, generation, known_version, with_body)
+            if entry is not None or not self._leased(table):
+                return entry
+        return None
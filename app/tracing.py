@@ -0,0 +1,221 @@
+"""
+轻量级进程内 tracing。
+
+- span 通过 contextvars 传递父子关系：asyncio task 自动继承上下文，
+  Starlette 的 run_in_threadpool（anyio.to_thread）也会复制上下文；
+  自己提交到线程池的函数请用 wrap() 包装。
+- 一个 trace 的根 span 结束时，整条 trace 作为一行 JSON 追加到
+  settings.trace_file（JSON Lines），便于离线分析；之后才结束的子 span 另写一行。
+- 未配置 trace_file 时 span() 为空操作，几乎没有额外开销。
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "attributes",
+        "start", "end", "status", "error", "thread",
+    )
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.trace_id = parent.trace_id if parent is not None else _new_id(16)
+        self.span_id = _new_id(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.thread = threading.current_thread().name
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(((self.end or time.time()) - self.start) * 1000, 3),
+            "status": self.status,
+            "error": self.error,
+            "thread": self.thread,
+            "attributes": self.attributes,
+        }
+
+
+class JsonFileExporter:
+    """
+    按 trace 缓冲 span，根 span 结束时把整条 trace 写成一行 JSON。
+
+    根 span 结束后才结束的子 span（例如对冲 GET 中输掉的那个请求）单独写一行（late=true）；
+    根 span 迟迟不结束的 trace 在缓冲超过 pending_ttl_s 秒或超过 max_pending 条时丢弃。
+    """
+
+    def __init__(self, path: str, max_pending: int = 10000, pending_ttl_s: float = 300.0, max_flushed: int = 10000):
+        self.path = path
+        self.max_pending = max_pending
+        self.pending_ttl_s = pending_ttl_s
+        self.max_flushed = max_flushed
+        self._lock = threading.Lock()
+        # trace_id -> (第一个 span 结束的时间, spans)；按插入顺序即按时间先后
+        self._pending: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        # 最近已写出的 trace_id
+        self._flushed: "OrderedDict[str, None]" = OrderedDict()
+
+    def on_end(self, span: Span) -> None:
+        record = span.to_dict()
+        with self._lock:
+            if span.parent_id is not None:
+                if span.trace_id in self._flushed:
+                    self._write(span.trace_id, record["name"], span.start, record["duration_ms"], [record], late=True)
+                    return
+                entry = self._pending.get(span.trace_id)
+                if entry is None:
+                    entry = self._pending[span.trace_id] = (time.monotonic(), [])
+                    self._evict()
+                entry[1].append(record)
+                return
+            entry = self._pending.pop(span.trace_id, None)
+            spans = entry[1] if entry is not None else []
+            spans.append(record)
+            self._flushed[span.trace_id] = None
+            while len(self._flushed) > self.max_flushed:
+                self._flushed.popitem(last=False)
+            self._write(span.trace_id, span.name, span.start, record["duration_ms"], spans)
+
+    def _evict(self) -> None:
+        # 调用方持有 self._lock
+        cutoff = time.monotonic() - self.pending_ttl_s
+        while self._pending:
+            trace_id, (first_seen, _) = next(iter(self._pending.items()))
+            if first_seen >= cutoff and len(self._pending) <= self.max_pending:
+                break
+            del self._pending[trace_id]
+
+    def _write(
+        self, trace_id: str, name: str, start: float, duration_ms: float, spans: List[Dict[str, Any]], late: bool = False
+    ) -> None:
+        trace: Dict[str, Any] = {"trace_id": trace_id, "name": name, "start": start, "duration_ms": duration_ms}
+        if late:
+            trace["late"] = True
+        trace["spans"] = sorted(spans, key=lambda s: s["start"])
+        line = json.dumps(trace, ensure_ascii=False, default=str)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+_exporter: Optional[JsonFileExporter] = JsonFileExporter(settings.trace_file) if settings.trace_file else None
+
+
+def set_exporter(exporter: Optional[JsonFileExporter]) -> None:
+    """替换（或关闭）导出器，例如在压测脚本中写到临时文件。"""
+    global _exporter
+    _exporter = exporter
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any):
+    """
+    with tracing.span("remote.get", table="diagnosis") as sp:
+        ...
+    未启用时 yield None。
+    """
+    exporter = _exporter
+    if exporter is None:
+        yield None
+        return
+
+    sp = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.status = "error"
+        sp.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        sp.end = time.time()
+        _current_span.reset(token)
+        exporter.on_end(sp)
+
+
+def traced(name: Optional[str] = None):
+    """装饰器版本的 span，默认命名为 "<模块名>.<函数名>"。"""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _exporter is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def wrap(func: Callable) -> Callable:
+    """把当前上下文（含当前 span）绑定到 func 上，用于提交到自建线程池。"""
+    ctx = contextvars.copy_context()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # 每次调用用一份拷贝，允许同一个包装函数在多个线程中并发执行
+        return ctx.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+class TracingMiddleware:
+    """纯 ASGI 中间件：每个 HTTP 请求一个根 span。"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _exporter is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        with span("http.request", method=scope.get("method"), path=scope.get("path")) as sp:
+            await self.app(scope, receive, send_wrapper)
+            route = scope.get("route")
+            sp.name = f"{scope.get('method')} {getattr(route, 'path', scope.get('path'))}"
+            sp.set_attribute("status", status[0])
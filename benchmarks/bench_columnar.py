@@ -0,0 +1,127 @@
+"""
+列式快照（app/columnar.py）与普通 dict 快照的内存 / 延迟对比。
+
+每种模式在一个全新的子进程中加载 --rows 行的合成 diagnosis 表，报告：
+- load_ms   : get_snapshot 耗时（下载已排除：响应体预先生成在内存里）
+- anon_mb   : 加载后进程匿名内存（堆）的增量，即每个 worker 独占的内存
+- rss_mb    : 加载后 RSS 增量（包括 mmap 的文件页；这部分页缓存由所有 worker 共享）
+- get_us / patient_us / page_us : 按主键取一行、按 patient_id 取全部行、取一页 100 行
+
+模式：
+- dicts           : 现有的 TableSnapshot（每行一个 dict + 字典索引）
+- columnar_build  : 第一个 worker：解析响应体并生成列式文件
+- columnar_open   : 其他 worker / 重启后：直接 mmap 已有文件（不解析响应体）
+
+运行方式（在仓库根目录）：
+    python -m benchmarks.bench_columnar --rows 1000000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_CHILD = r"""
+import gc, json, os, sys, time
+from benchmarks.fake_remote import FakeResponse, make_table
+from app import remote, columnar
+
+mode, rows, directory = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+
+def memory():
+    # (anonymous, rss) in MB from /proc/self/smaps_rollup (Linux)
+    values = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":"):
+                    values[parts[0][:-1]] = int(parts[1]) / 1024
+    except OSError:
+        return 0.0, 0.0
+    return values.get("Anonymous", 0.0), values.get("Rss", 0.0)
+
+class Transport:
+    def __init__(self, body):
+        self.body = body
+    def get(self, url, headers=None, timeout=None):
+        return FakeResponse(200, self.body, {"ETag": '"v1"'})
+
+body = json.dumps({"data": make_table("diagnosis", rows)}).encode("utf-8")
+gc.collect()
+version = remote.content_version(body)
+client = remote.RemoteTableClient(transport=Transport(body))
+if mode != "dicts":
+    client.columnar = columnar.ColumnarStore(directory, ["diagnosis"])
+    if mode == "columnar_open":
+        # 模拟其他 worker：文件已由第一个 worker 生成
+        client.columnar.build("diagnosis", version, json.loads(body)["data"])
+        gc.collect()
+
+anon0, rss0 = memory()
+t0 = time.perf_counter()
+if mode == "columnar_open":
+    snap = client._open_columnar("diagnosis", version, None, None)
+else:
+    snap = client.get_snapshot("diagnosis")
+load_ms = (time.perf_counter() - t0) * 1e3
+gc.collect()  # 响应体仍然保留（baseline 中已包含），增量只反映快照本身
+
+def timed(fn, n=2000):
+    t = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t) / n * 1e6
+
+get_us = timed(lambda i: snap.get((i * 7919) % rows + 1))
+patient_us = timed(lambda i: snap.rows_for_patient((i * 31) % 1000 + 1))
+def page(i):
+    start = (i * 4099) % max(rows - 100, 1)
+    return snap.records[start:start + 100]
+
+page_us = timed(page, n=200)
+# 访问过所有页后再测 RSS（mmap 的页是按需读入的）
+anon1, rss1 = memory()
+print(json.dumps({
+    "load_ms": load_ms,
+    "anon_mb": anon1 - anon0,
+    "rss_mb": rss1 - rss0,
+    "get_us": get_us,
+    "patient_us": patient_us,
+    "page_us": page_us,
+}))
+"""
+
+MODES = ("dicts", "columnar_build", "columnar_open")
+
+
+def run_mode(mode: str, rows: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        out = subprocess.run(
+            [sys.executable, "-c", _CHILD, mode, str(rows), directory],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+            env={**os.environ, "LLM_PROVIDER": os.environ.get("LLM_PROVIDER", "fake")},
+        )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="columnar vs dict snapshot memory benchmark")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--mode", choices=MODES, action="append")
+    args = parser.parse_args()
+
+    keys = ("load_ms", "anon_mb", "rss_mb", "get_us", "patient_us", "page_us")
+    print(f"diagnosis rows={args.rows}")
+    print(f"{'mode':<16}" + "".join(f"{k:>14}" for k in keys))
+    for mode in args.mode or MODES:
+        result = run_mode(mode, args.rows)
+        print(f"{mode:<16}" + "".join(f"{result[k]:>14.1f}" for k in keys))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Benchmark: crud 热路径在不同表规模下的耗时（远端层替换为 benchmarks/fake_remote.py 的内存实现）。
+
+覆盖：
+- get_patient / get_latest_{diagnosis,prescription,requisition}_by_patient
+- get_nearest_pharmacies / get_detailed_pharmacy_preferences
+- create_prescription（ID 分配 + POST 后的增量快照更新）
+- list_prescriptions 路由（pharmacy 名称/地址补全 + 序列化）
+- snapshot.build：冷启动时整表解析 + 建索引
+
+统计口径与 pytest-benchmark 相同（min/max/mean/median/stddev/ops），
+结果写入 benchmarks/results/<commit>.json，可用 benchmarks.compare 对比两次提交。
+
+运行方式（在仓库根目录）：
+    python -m benchmarks.bench_crud                          # 1k, 10k, 100k
+    python -m benchmarks.bench_crud --sizes 1000,1000000 -k nearest
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from starlette.requests import Request
+
+from app import crud, routers, schemas
+from benchmarks.fake_remote import InMemoryTransport, install, make_table
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def git_commit() -> str:
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD", "--", "app"]) != 0
+        return f"{sha}-dirty" if dirty else sha
+    except Exception:
+        return "unknown"
+
+
+def run_benchmark(
+    fn: Callable[[], Any],
+    setup: Optional[Callable[[], Any]] = None,
+    min_rounds: int = 5,
+    max_rounds: int = 1000,
+    min_time: float = 0.5,
+) -> Dict[str, float]:
+    """类似 pytest-benchmark 的 pedantic 模式：先预热一次，再跑到 min_time 或 max_rounds。"""
+    if setup:
+        setup()
+    fn()  # warm-up
+    timings: List[float] = []
+    total = 0.0
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while len(timings) < max_rounds and (len(timings) < min_rounds or total < min_time):
+            if setup:
+                setup()
+            t0 = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - t0
+            timings.append(elapsed)
+            total += elapsed
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    mean = statistics.fmean(timings)
+    return {
+        "min": min(timings),
+        "max": max(timings),
+        "mean": mean,
+        "median": statistics.median(timings),
+        "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "rounds": len(timings),
+        "ops": 1.0 / mean if mean else 0.0,
+    }
+
+
+class Dataset:
+    """按规模缓存合成表；每个用例拿到的是独立的 transport（行列表浅拷贝）。"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._tables: Dict[str, List[Dict[str, Any]]] = {}
+
+    def table(self, name: str) -> List[Dict[str, Any]]:
+        if name not in self._tables:
+            self._tables[name] = make_table(name, self.size)
+        return self._tables[name]
+
+    def install(self, *tables: str) -> InMemoryTransport:
+        transport = InMemoryTransport({t: list(self.table(t)) for t in tables})
+        install(transport)
+        return transport
+
+
+def _patient_ids(ds: Dataset, n: int = 256) -> List[int]:
+    rng = random.Random(ds.size)
+    return [rng.randint(1, max(1, ds.size // 4)) for _ in range(n)]
+
+
+def _cycle(values: List[Any]) -> Callable[[], Any]:
+    state = {"i": 0}
+
+    def nxt():
+        state["i"] = (state["i"] + 1) % len(values)
+        return values[state["i"]]
+
+    return nxt
+
+
+def _request() -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""})
+
+
+# ---------------- 用例 ----------------
+# 每个用例：(名称, 需要的表, 构造函数(ds) -> (fn, setup))
+
+def case_get_patient(ds: Dataset):
+    ds.install("patients_registration")
+    nxt = _cycle(list(range(1, ds.size + 1, max(1, ds.size // 256))))
+    return (lambda: crud.get_patient(nxt())), None
+
+
+def _latest(getter: Callable[[int], Any], table: str):
+    def build(ds: Dataset):
+        ds.install(table)
+        nxt = _cycle(_patient_ids(ds))
+        return (lambda: getter(nxt())), None
+    return build
+
+
+def case_nearest_pharmacies(ds: Dataset):
+    ds.install("patients_registration", "pharmacy_registration")
+    nxt = _cycle(_patient_ids(ds))
+    return (lambda: crud.get_nearest_pharmacies(nxt(), limit=5)), None
+
+
+def case_detailed_pharmacy_preferences(ds: Dataset):
+    ds.install("patient_preference", "pharmacy_registration")
+    nxt = _cycle(_patient_ids(ds))
+    return (lambda: crud.get_detailed_pharmacy_preferences(nxt())), None
+
+
+def case_create_prescription(ds: Dataset):
+    ds.install("prescription_form")
+    obj = schemas.PrescriptionFormCreate(
+        patient_id=1, prescriber_id="DOC001", medication_name="Amoxicillin",
+        medication_strength="500mg", medication_form="Capsule",
+        dosage_instructions="Take 1 capsule 3 times daily", quantity=21, refills_allowed=0,
+        status="active",
+    )
+    return (lambda: crud.create_prescription(obj)), None
+
+
+def case_list_prescriptions(ds: Dataset):
+    ds.install("prescription_form", "pharmacy_registration")
+    request = _request()
+    return (lambda: routers.list_prescriptions(request, skip=0, limit=100)), None
+
+
+def _snapshot_build(table: str):
+    def build(ds: Dataset):
+        transport = ds.install(table)
+
+        def setup():
+            install(transport)  # 每轮换一个空客户端，测冷启动整表构建
+
+        return (lambda: crud._get_snapshot(table)), setup
+    return build
+
+
+CASES = [
+    ("get_patient", case_get_patient),
+    ("get_latest_diagnosis_by_patient", _latest(crud.get_latest_diagnosis_by_patient, "diagnosis")),
+    ("get_latest_prescription_by_patient", _latest(crud.get_latest_prescription_by_patient, "prescription_form")),
+    ("get_latest_requisition_by_patient", _latest(crud.get_latest_requisition_by_patient, "requisition_form")),
+    ("get_nearest_pharmacies", case_nearest_pharmacies),
+    ("get_detailed_pharmacy_preferences", case_detailed_pharmacy_preferences),
+    ("create_prescription", case_create_prescription),
+    ("list_prescriptions", case_list_prescriptions),
+    ("snapshot_build[patients_registration]", _snapshot_build("patients_registration")),
+    ("snapshot_build[prescription_form]", _snapshot_build("prescription_form")),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="crud hot-path benchmarks")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="comma separated table sizes, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("-k", dest="keyword", default=None, help="only run cases whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.5, help="minimum measured seconds per case")
+    parser.add_argument("--output", default=None, help="result file (default: benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    cases = [(n, c) for n, c in CASES if not args.keyword or args.keyword in n]
+    commit = git_commit()
+    results = []
+
+    print(f"commit={commit} python={platform.python_version()}")
+    print(f"{'name':<45}{'size':>9}{'median':>12}{'mean':>12}{'stddev':>12}{'rounds':>8}")
+    for size in sizes:
+        ds = Dataset(size)
+        for name, build in cases:
+            fn, setup = build(ds)
+            stats = run_benchmark(fn, setup=setup, min_time=args.min_time)
+            results.append({"name": name, "size": size, "stats": stats})
+            print(
+                f"{name:<45}{size:>9}{stats['median'] * 1e3:>10.3f}ms{stats['mean'] * 1e3:>10.3f}ms"
+                f"{stats['stddev'] * 1e3:>10.3f}ms{stats['rounds']:>8}"
+            )
+        del ds
+        gc.collect()
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "commit": commit,
+        "datetime": datetime.now(timezone.utc).isoformat(),
+        "machine_info": {"python": sys.version, "platform": platform.platform()},
+        "benchmarks": results,
+    }, indent=2))
+    print(f"saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+快照行内存基准：普通 dict 行 vs __slots__ 记录（app/records.py，COMPACT_RECORDS=true）。
+
+父进程先把每张表的合成响应体写到临时文件；每种模式在全新的子进程中读取响应体并构建快照，报告：
+- load_ms  : 解析 + 建索引耗时
+- heap_mb  : 构建完成后仍然存活的 Python 对象（tracemalloc，即快照本身）
+- peak_mb  : 构建过程中的分配峰值（tracemalloc，包括 json 解析出的临时 dict）
+- bytes_row: heap_mb 折算到每行
+- get_us / patient_us / page_us : 按主键取一行、按 patient_id 取行、取一页 100 行（含转回 dict）
+
+运行方式（在仓库根目录）：
+    python -m benchmarks.bench_memory --rows 200000
+    python -m benchmarks.bench_memory --rows 1000000 --table prescription_form
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_CHILD = r"""
+import gc, json, sys, time, tracemalloc
+from benchmarks.fake_remote import FakeResponse
+from app import remote, records
+
+mode, table, path = sys.argv[1], sys.argv[2], sys.argv[3]
+
+class Transport:
+    def __init__(self, body):
+        self.body = body
+    def get(self, url, headers=None, timeout=None):
+        return FakeResponse(200, self.body, {"ETag": '"v1"'})
+
+with open(path, "rb") as f:
+    body = f.read()
+
+def load():
+    client = remote.RemoteTableClient(transport=Transport(body))
+    if mode == "records":
+        client.row_factory = records.compact
+    return client.get_snapshot(table)
+
+# 第一遍：tracemalloc 统计存活内存与峰值（会拖慢构建，不计时）
+gc.collect()
+tracemalloc.start()
+snap = load()
+gc.collect()
+heap, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+del snap
+gc.collect()
+
+# 第二遍：计时
+t0 = time.perf_counter()
+snap = load()
+load_ms = (time.perf_counter() - t0) * 1e3
+rows = len(snap)
+
+def timed(fn, n=2000):
+    t = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t) / n * 1e6
+
+keys = list(snap.by_pk)
+get_us = timed(lambda i: records.as_dict(snap.get(keys[(i * 7919) % rows])))
+patient_us = timed(lambda i: records.as_dicts(snap.rows_for_patient((i * 31) % 1000 + 1)))
+
+def page(i):
+    start = (i * 4099) % max(rows - 100, 1)
+    return records.as_dicts(snap.records[start:start + 100])
+
+page_us = timed(page, n=200)
+print(json.dumps({
+    "load_ms": load_ms,
+    "heap_mb": heap / 2**20,
+    "peak_mb": peak / 2**20,
+    "bytes_row": heap / max(rows, 1),
+    "get_us": get_us,
+    "patient_us": patient_us,
+    "page_us": page_us,
+}))
+"""
+
+MODES = ("dicts", "records")
+
+
+def run_mode(mode: str, table: str, body_path: str) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, mode, table, body_path],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+        env={**os.environ, "LLM_PROVIDER": os.environ.get("LLM_PROVIDER", "fake")},
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    from benchmarks.fake_remote import make_table
+
+    parser = argparse.ArgumentParser(description="dict vs __slots__ record snapshot memory benchmark")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--table", action="append",
+                        help="default: prescription_form, requisition_form, diagnosis")
+    args = parser.parse_args()
+
+    keys = ("load_ms", "heap_mb", "peak_mb", "bytes_row", "get_us", "patient_us", "page_us")
+    print(f"rows={args.rows}")
+    print(f"{'table':<20}{'mode':<9}" + "".join(f"{k:>12}" for k in keys))
+    with tempfile.TemporaryDirectory() as directory:
+        for table in args.table or ("prescription_form", "requisition_form", "diagnosis"):
+            body_path = os.path.join(directory, f"{table}.json")
+            with open(body_path, "w", encoding="utf-8") as f:
+                json.dump({"data": make_table(table, args.rows)}, f)
+            for mode in MODES:
+                result = run_mode(mode, table, body_path)
+                print(f"{table:<20}{mode:<9}" + "".join(f"{result[k]:>12.1f}" for k in keys))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Microbenchmark: 列表接口的响应序列化开销（逐行 Pydantic + response_model vs TypeAdapter 批量路径）。
+
+运行方式（在仓库根目录）：
+    python -m benchmarks.bench_serialization --rows 1000 --repeat 20
+"""
+import argparse
+import json
+import time
+
+from pydantic import TypeAdapter
+
+from app import schemas
+from app.serialization import dump_json
+
+
+def _make_rows(n: int):
+    rows = []
+    for i in range(n):
+        rows.append({
+            "prescription": {
+                "prescription_id": str(1763831311 + i),
+                "patient_id": i % 500,
+                "prescriber_id": "DOC001",
+                "medication_name": "Amoxicillin",
+                "medication_strength": "500mg",
+                "medication_form": "Tablet",
+                "dosage_instructions": "Take 1 tablet 3 times daily with food",
+                "quantity": 21,
+                "refills_allowed": 2,
+                "date_prescribed": "2025-11-22T00:00:00.000Z",
+                "expiry_date": "2025-12-31",
+                "status": "active",
+                "notes": "Complete full course even if feeling better",
+                "pharmacy_id": i % 20,
+            },
+            "pharmacy_name": f"Pharmacy {i % 20}",
+            "pharmacy_address": "100 Pharmacy Street, Ottawa, ON",
+        })
+    return rows
+
+
+_LEGACY_FIELD = TypeAdapter(list[schemas.PrescriptionWithPharmacyOut])
+
+
+def legacy_path(rows) -> bytes:
+    """旧路径：路由里逐行构造模型，FastAPI 再按 response_model 校验 + jsonable 化 + json.dumps。"""
+    result = []
+    for r in rows:
+        pres_out = schemas.PrescriptionFormOut(**r["prescription"])
+        result.append(
+            schemas.PrescriptionWithPharmacyOut(
+                prescription=pres_out,
+                pharmacy_name=r["pharmacy_name"],
+                pharmacy_address=r["pharmacy_address"],
+            )
+        )
+    validated = _LEGACY_FIELD.validate_python(result)
+    content = _LEGACY_FIELD.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(rows) -> bytes:
+    return dump_json(list[schemas.PrescriptionWithPharmacyOut], rows)
+
+
+def _time(fn, rows, repeat: int) -> float:
+    fn(rows)  # warm-up
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = _make_rows(args.rows)
+    assert json.loads(legacy_path(rows)) == json.loads(fast_path(rows))
+
+    legacy = _time(legacy_path, rows, args.repeat)
+    fast = _time(fast_path, rows, args.repeat)
+    print(f"rows={args.rows}")
+    print(f"legacy  : {legacy * 1e3:8.2f} ms  ({legacy / args.rows * 1e6:6.2f} us/row)")
+    print(f"fastpath: {fast * 1e3:8.2f} ms  ({fast / args.rows * 1e6:6.2f} us/row)")
+    print(f"speedup : {legacy / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+冷启动基准：每轮启动一个全新的 Python 进程，测量
+- import_ms        : import main（应用模块、路由、schema）
+- startup_ms       : lifespan 启动（可选的表预热）
+- first_request_ms : 第一个 /api/pharmacies/nearest/{id} 请求（会触发 patients + pharmacy 表加载）
+- second_request_ms: 同一请求第二次（快照已就绪）
+- total_ms         : 从父进程 spawn 到第一个响应返回（扣除子进程中生成合成数据的时间）
+
+远端表使用 benchmarks/fake_remote.py（--rows 行，--remote-latency-ms 模拟网络往返）。
+
+运行方式（在仓库根目录）：
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --importtime     # 额外打印 import 耗时最多的模块
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+_CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import main
+t_import = time.perf_counter()
+
+from benchmarks.fake_remote import InMemoryTransport, install, make_table
+rows, latency = int(sys.argv[1]), float(sys.argv[2])
+install(InMemoryTransport(
+    {t: make_table(t, rows) for t in ("patients_registration", "pharmacy_registration", "lab_registration")},
+    latency_ms=latency,
+))
+from fastapi.testclient import TestClient
+
+t1 = time.perf_counter()
+datagen_ms = (t1 - t_import) * 1e3
+with TestClient(main.app) as client:
+    t2 = time.perf_counter()
+    r = client.get("/api/pharmacies/nearest/1")
+    t3 = time.perf_counter()
+    client.get("/api/pharmacies/nearest/2")
+    t4 = time.perf_counter()
+assert r.status_code == 200, r.text
+print(json.dumps({
+    "import_ms": (t_import - t0) * 1e3,
+    "startup_ms": (t2 - t1) * 1e3,
+    "first_request_ms": (t3 - t2) * 1e3,
+    "second_request_ms": (t4 - t3) * 1e3,
+    "datagen_ms": datagen_ms,
+}))
+"""
+
+SCENARIOS = {
+    "lazy": {},
+    "prewarm": {
+        "PREWARM_TABLES": "pharmacy_registration,lab_registration,patients_registration",
+        "PREWARM_BLOCKING": "true",
+    },
+}
+
+
+def run_once(env_extra: dict, rows: int, latency_ms: float) -> dict:
+    env = {**os.environ, "LLM_PROVIDER": os.environ.get("LLM_PROVIDER", "fake"), **env_extra}
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", _CHILD, str(rows), str(latency_ms)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    total = (time.perf_counter() - start) * 1e3
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    # 进程启动 + import + lifespan + 首个请求（扣除子进程里生成合成数据的时间；不含第二个请求）
+    result["total_ms"] = total - result.pop("datagen_ms") - result["second_request_ms"]
+    return result
+
+
+def importtime_top(n: int = 15) -> None:
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+        env={**os.environ, "LLM_PROVIDER": os.environ.get("LLM_PROVIDER", "fake")},
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        self_us, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative), int(self_us), name.strip()))
+    print(f"\ntop {n} imports by cumulative time:")
+    for cumulative, self_us, name in sorted(rows, reverse=True)[:n]:
+        print(f"  {cumulative / 1000:8.1f}ms (self {self_us / 1000:6.1f}ms)  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--remote-latency-ms", type=float, default=50.0)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    parser.add_argument("--importtime", action="store_true")
+    args = parser.parse_args()
+
+    keys = ("import_ms", "startup_ms", "first_request_ms", "second_request_ms", "total_ms")
+    print(f"rows={args.rows} remote_latency={args.remote_latency_ms}ms runs={args.runs} (median)")
+    print(f"{'scenario':<10}" + "".join(f"{k:>20}" for k in keys))
+    for name in args.scenario or sorted(SCENARIOS):
+        runs = [run_once(SCENARIOS[name], args.rows, args.remote_latency_ms) for _ in range(args.runs)]
+        print(f"{name:<10}" + "".join(f"{statistics.median(r[k] for r in runs):>18.1f}ms" for k in keys))
+
+    if args.importtime:
+        importtime_top()
+
+
+if __name__ == "__main__":
+    main()
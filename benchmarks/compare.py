@@ -0,0 +1,50 @@
+"""
+对比两次 bench_crud 的结果（按 name + size 对齐，比较 median）。
+
+运行方式：
+    python -m benchmarks.compare benchmarks/results/<old>.json benchmarks/results/<new>.json --threshold 10
+变慢超过阈值（百分比）的用例标记为 REGRESSION，且退出码为 1，便于在 CI 中使用。
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def _load(path: str):
+    data = json.loads(Path(path).read_text())
+    return data.get("commit", path), {(b["name"], b["size"]): b["stats"] for b in data["benchmarks"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    old_commit, old = _load(args.old)
+    new_commit, new = _load(args.new)
+    print(f"{old_commit} -> {new_commit}")
+    print(f"{'name':<45}{'size':>9}{'old':>12}{'new':>12}{'change':>10}")
+
+    regressions = 0
+    for key in sorted(set(old) & set(new), key=lambda k: (k[1], k[0])):
+        before, after = old[key]["median"], new[key]["median"]
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -args.threshold:
+            flag = "  improved"
+        print(f"{key[0]:<45}{key[1]:>9}{before * 1e3:>10.3f}ms{after * 1e3:>10.3f}ms{change:>+9.1f}%{flag}")
+
+    for key in sorted(set(old) ^ set(new)):
+        print(f"{key[0]:<45}{key[1]:>9}  only in {'old' if key in old else 'new'}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+远端表 API 的内存替身 + 合成数据生成器（基准测试 / 压测共用）。
+
+InMemoryTransport 实现与 requests.Session 相同的 get/post/put 接口，
+可直接赋给 app.remote.client.transport。它支持 ETag / If-None-Match，
+响应体按版本缓存为 bytes，因此计时只包含客户端自身的解析与索引开销。
+"""
+import json
+import json as _json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from app.remote import PRIMARY_KEYS, REMOTE_TABLES
+
+# 注册表在真实环境中规模有限，这里给一个上限，避免 1M 规模时生成无意义的数据
+REGISTRY_MAX_ROWS = 10_000
+
+_DIAGNOSES = [
+    ("J06.9", "Acute upper respiratory infection, unspecified"),
+    ("E11.9", "Type 2 diabetes mellitus without complications"),
+    ("I10", "Essential (primary) hypertension"),
+    ("N39.0", "Urinary tract infection, site not specified"),
+    ("J45.909", "Unspecified asthma, uncomplicated"),
+]
+_MEDICATIONS = [
+    ("Amoxicillin", "500mg", "Capsule"),
+    ("Metformin", "850mg", "Tablet"),
+    ("Lisinopril", "10mg", "Tablet"),
+    ("Nitrofurantoin", "100mg", "Capsule"),
+    ("Salbutamol", "100mcg", "Inhaler"),
+]
+
+
+def _addr(rng: random.Random, label: str) -> str:
+    lat = 45.30 + rng.random() * 0.25
+    lng = -75.90 + rng.random() * 0.35
+    return f"{label}, Ottawa, ON||" + json.dumps({"lat": lat, "lng": lng})
+
+
+def make_table(table: str, n_rows: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """生成一张合成表。patient_id 取值范围与 n_rows 成比例，保证按病人查询时有命中。"""
+    rng = random.Random(f"{table}:{n_rows}:{seed}")
+    n_patients = max(1, n_rows // 4)
+    rows: List[Dict[str, Any]] = []
+    if table == "patients_registration":
+        for i in range(1, n_rows + 1):
+            rows.append({
+                "patient_id": i, "name": f"Patient {i}", "dob": "1980-01-01", "gender": "Female",
+                "contact_info": _addr(rng, f"{i} Patient St"), "phone_number": "613-555-0000",
+                "OHIP_code": None, "private_insurance_name": None, "private_insurance_id": None,
+                "weight_kg": "70", "height_cm": "170", "family_doctor_id": "DOC001",
+            })
+    elif table == "diagnosis":
+        for i in range(1, n_rows + 1):
+            code, desc = _DIAGNOSES[i % len(_DIAGNOSES)]
+            rows.append({
+                # crud.http 的示例请求使用 patient 1..5，保证它们都有诊断
+                "diagnosis_id": i, "patient_id": i if i <= min(5, n_patients) else rng.randint(1, n_patients),
+                "doctor_id": 1,
+                "diagnosis_code": code, "diagnosis_description": desc,
+                "diagnosis_date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            })
+    elif table == "patient_preference":
+        n_facilities = min(n_rows, REGISTRY_MAX_ROWS)
+        for i in range(1, n_rows + 1):
+            ptype = "pharmacy" if i % 2 else "lab"
+            rows.append({
+                "preference_id": i, "patient_id": rng.randint(1, n_patients), "preference_type": ptype,
+                "pharmacy_id": rng.randint(1, n_facilities) if ptype == "pharmacy" else None,
+                "lab_id": rng.randint(1, n_facilities) if ptype == "lab" else None,
+                "notes": "Preferred location",
+            })
+    elif table == "prescription_form":
+        n_facilities = min(n_rows, REGISTRY_MAX_ROWS)
+        for i in range(1, n_rows + 1):
+            name, strength, form = _MEDICATIONS[i % len(_MEDICATIONS)]
+            rows.append({
+                "prescription_id": str(i), "patient_id": rng.randint(1, n_patients), "prescriber_id": "DOC001",
+                "medication_name": name, "medication_strength": strength, "medication_form": form,
+                "dosage_instructions": "Take 1 tablet 3 times daily with food", "quantity": 21,
+                "refills_allowed": 2, "date_prescribed": f"2025-{rng.randint(1, 12):02d}-01T00:00:00.000Z",
+                "expiry_date": "2025-12-31", "status": "active", "notes": None,
+                "pharmacy_id": rng.randint(1, n_facilities) if i % 3 else None,
+            })
+    elif table == "requisition_form":
+        n_facilities = min(n_rows, REGISTRY_MAX_ROWS)
+        for i in range(1, n_rows + 1):
+            rows.append({
+                "requisition_id": str(i), "patient_id": rng.randint(1, n_patients),
+                "lab_id": rng.randint(1, n_facilities) if i % 3 else None,
+                "department": "General Medicine", "test_type": "Complete Blood Count", "test_code": "CBC",
+                "clinical_info": "Baseline blood work", "date_requested": f"2025-{rng.randint(1, 12):02d}-01T00:00:00.000Z",
+                "priority": "Routine", "status": "Pending", "result_date": None, "notes": None,
+            })
+    elif table in ("pharmacy_registration", "lab_registration"):
+        pk = PRIMARY_KEYS[table]
+        kind = "Pharmacy" if table == "pharmacy_registration" else "Lab"
+        for i in range(1, min(n_rows, REGISTRY_MAX_ROWS) + 1):
+            rows.append({
+                pk: i, "name": f"{kind} {i}", "email": f"{kind.lower()}{i}@example.com",
+                "phone_number": "613-555-1111", "address": _addr(rng, f"{i} {kind} Rd"),
+                "license_no": f"LIC-{i:05d}", "status": "active", "registered_on": "2025-07-11T20:42:41.000Z",
+            })
+    else:
+        raise KeyError(table)
+    return rows
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, content: bytes = b"", headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            import requests
+            raise requests.HTTPError(f"{self.status_code} from fake remote")
+
+
+class InMemoryTransport:
+    """线程安全的内存远端表服务。"""
+
+    def __init__(
+        self,
+        tables: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+        support_etag: bool = True,
+        latency_ms: float = 0.0,
+    ):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {t: [] for t in REMOTE_TABLES}
+        if tables:
+            self.tables.update(tables)
+        self.support_etag = support_etag
+        # 模拟网络往返延迟（每个请求固定 sleep，不持锁）
+        self.latency_ms = latency_ms
+        self.versions: Dict[str, int] = {t: 1 for t in self.tables}
+        self.calls: Dict[str, int] = {}
+        self._bodies: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _table_of(url: str) -> List[str]:
+        parts = urlparse(url).path.strip("/").split("/")
+        # /table/<name>[/<id>]
+        return parts[1:]
+
+    def _wait(self) -> None:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def _count(self, verb: str, table: str) -> None:
+        key = f"{verb} {table}"
+        self.calls[key] = self.calls.get(key, 0) + 1
+
+    def _body(self, table: str) -> bytes:
+        version = self.versions[table]
+        cached = self._bodies.get(table)
+        if cached is None or cached[0] != version:
+            cached = (version, json.dumps({"data": self.tables[table]}).encode("utf-8"))
+            self._bodies[table] = cached
+        return cached[1]
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None, timeout: Any = None, **kwargs) -> FakeResponse:
+        table = self._table_of(url)[0]
+        self._wait()
+        with self._lock:
+            self._count("GET", table)
+            etag = f'"{table}-{self.versions[table]}"'
+            if self.support_etag and headers and headers.get("If-None-Match") == etag:
+                return FakeResponse(304, headers={"ETag": etag})
+            body = self._body(table)
+        return FakeResponse(200, body, {"ETag": etag} if self.support_etag else {})
+
+    def post(self, url: str, json: Any = None, timeout: Any = None, **kwargs) -> FakeResponse:
+        table = self._table_of(url)[0]
+        self._wait()
+        with self._lock:
+            self._count("POST", table)
+            rows = [dict(r) for r in (json if isinstance(json, list) else [json])]
+            cached = self._bodies.get(table)
+            self.tables[table].extend(rows)
+            self.versions[table] += 1
+            if cached is not None and rows:
+                # 追加写入时在旧响应体上拼接，避免每次 POST 都重新序列化整张表
+                tail = ", ".join(_json.dumps(r) for r in rows).encode("utf-8")
+                sep = b", " if len(self.tables[table]) > len(rows) else b""
+                self._bodies[table] = (self.versions[table], cached[1][:-2] + sep + tail + b"]}")
+        return FakeResponse(200, b'{"status": "ok"}')
+
+    def put(self, url: str, json: Any = None, timeout: Any = None, **kwargs) -> FakeResponse:
+        table, record_id = self._table_of(url)[:2]
+        pk = PRIMARY_KEYS[table]
+        self._wait()
+        with self._lock:
+            self._count("PUT", table)
+            for i, row in enumerate(self.tables[table]):
+                if str(row.get(pk)) == record_id:
+                    self.tables[table][i] = {**row, **(json or {})}
+                    self.versions[table] += 1
+                    return FakeResponse(200, b'{"status": "ok"}')
+        return FakeResponse(404, b'{"detail": "not found"}')
+
+
+def install(transport: InMemoryTransport):
+    """用内存 transport 替换远端客户端（清空所有快照），返回新的 RemoteTableClient。"""
+    from app import remote
+
+    new_client = remote.RemoteTableClient(transport=transport)
+    # 保留已注册的监听器（变更订阅、后台刷新器等）和 stale-while-revalidate 配置
+    new_client._listeners = list(remote.client._listeners)
+    new_client._invalidate_listeners = list(remote.client._invalidate_listeners)
+    new_client.max_age = dict(remote.client.max_age)
+    new_client.shared = remote.client.shared
+    new_client.columnar = remote.client.columnar
+    new_client.row_factory = remote.client.row_factory
+    new_client.resilience = remote.client.resilience
+    remote.client = new_client
+    return new_client
@@ -0,0 +1,337 @@
+"""
+端到端压测：在进程内（httpx ASGITransport）重放前端 portal 的完整流程。
+
+- 远端表：benchmarks/fake_remote.py 的内存实现（合成数据，--rows 控制规模）
+- LLM：app/llm_provider.py 的 FakeLLMProvider（--llm-latency-ms / --llm-jitter-ms / --llm-dist /
+  --llm-failure-rate）
+- 场景：从 app/tests/crud.http 中解析 ⭐ 请求与 /workflow/* 请求作为模板，
+  路径和请求体里的 patient_id / prescription_id / requisition_id / pharmacy_id / lab_id
+  替换为每个虚拟用户自己的数据。
+
+场景：
+  portal  : generate-orders → nearest pharmacies/labs → preferences → 设置 pharmacy/lab
+            → complete-prescription/requisition → fax（与 portal 前端一致）
+  catalog : 先 generate-orders，再按文件顺序把 crud.http 中所有 ⭐ / workflow 请求各跑一遍
+
+按并发级别逐级加压，报告吞吐、每个步骤的 p50/p95/p99 和错误率。
+
+运行方式（在仓库根目录）：
+    python -m benchmarks.loadtest --levels 1,4,16 --duration 10 --llm-latency-ms 800
+    python -m benchmarks.loadtest --list            # 打印从 crud.http 解析出的场景
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.llm_provider import FAILURE_MODES, FakeLLMProvider, set_provider
+from benchmarks.fake_remote import InMemoryTransport, install, make_table
+
+HTTP_FILE = Path(__file__).resolve().parent.parent / "app" / "tests" / "crud.http"
+STAR = "⭐"
+
+
+@dataclass
+class HttpBlock:
+    title: str
+    method: str
+    path: str
+    body: Optional[Any] = None
+    starred: bool = False
+
+
+def parse_http_file(path: Path = HTTP_FILE) -> List[HttpBlock]:
+    """解析 REST Client 格式的 .http 文件（### 标题 / METHOD URL / headers / 空行 / body）。"""
+    blocks: List[HttpBlock] = []
+    for chunk in re.split(r"^###", path.read_text(encoding="utf-8"), flags=re.M)[1:]:
+        lines = chunk.splitlines()
+        title = lines[0].strip()
+        request_lines = [ln for ln in lines[1:] if not ln.lstrip().startswith("#")]
+        starts = [i for i, ln in enumerate(request_lines) if re.match(r"^(GET|POST|PUT|PATCH|DELETE) ", ln)]
+        # 一个 ### 块下可能有多条 GET（例如 by-patient 的两种类型），逐条拆开
+        for n, i in enumerate(starts):
+            method, url = request_lines[i].split(" ", 1)
+            end = starts[n + 1] if n + 1 < len(starts) else len(request_lines)
+            rest = request_lines[i + 1:end]
+            body = None
+            if "" in rest:
+                text = "\n".join(rest[rest.index(""):]).strip()
+                if text:
+                    body = json.loads(text)
+            blocks.append(HttpBlock(
+                title=title,
+                method=method,
+                path=url.strip().replace("{{baseUrl}}", ""),
+                body=body,
+                starred=STAR in title,
+            ))
+    return blocks
+
+
+# 路径中的示例 ID → 当前虚拟用户上下文中的字段
+_PATH_BINDINGS = [
+    (re.compile(r"(/(?:diagnosis|prescriptions|requisitions)/latest/)\d+"), "patient_id"),
+    (re.compile(r"(/prescriptions/)\d+"), "prescription_id"),
+    (re.compile(r"(/requisitions/)\d+"), "requisition_id"),
+    (re.compile(r"(/nearest/)\d+"), "patient_id"),
+    (re.compile(r"(/patients/)\d+"), "patient_id"),
+    (re.compile(r"(/diagnosis/)\d+"), "patient_id"),
+    (re.compile(r"(/pharmacies/)\d+"), "pharmacy_id"),
+    (re.compile(r"(/labs/)\d+"), "lab_id"),
+    (re.compile(r"([?&]patient_id=)\d+"), "patient_id"),
+]
+_BODY_KEYS = ("patient_id", "prescription_id", "requisition_id", "pharmacy_id", "lab_id")
+
+
+def bind(block: HttpBlock, ctx: Dict[str, Any]) -> Tuple[str, str, Optional[Any]]:
+    path = block.path
+    for pattern, key in _PATH_BINDINGS:
+        if key in ctx:
+            path = pattern.sub(lambda m: f"{m.group(1)}{ctx[key]}", path)
+    body = json.loads(json.dumps(block.body)) if block.body is not None else None
+    for target in (body, (body or {}).get("arguments") if isinstance(body, dict) else None):
+        if isinstance(target, dict):
+            for key in _BODY_KEYS:
+                if key in target and key in ctx:
+                    target[key] = ctx[key]
+    return block.method, path, body
+
+
+def harvest(ctx: Dict[str, Any], data: Any) -> None:
+    """从响应中提取后续步骤需要的 ID（新建的处方/检验单、最近的药店/实验室）。"""
+    if isinstance(data, dict):
+        for key, id_key in (("prescription", "prescription_id"), ("requisition", "requisition_id")):
+            if isinstance(data.get(key), dict) and data[key].get(id_key) is not None:
+                ctx[id_key] = data[key][id_key]
+    elif isinstance(data, list) and data and isinstance(data[0], dict):
+        for key in ("pharmacy_id", "lab_id"):
+            if data[0].get(key) is not None:
+                ctx[key] = data[0][key]
+
+
+@dataclass
+class Step:
+    name: str
+    method: str
+    pattern: str
+    harvest: bool = False
+    block: Optional[HttpBlock] = None
+
+
+PORTAL_FLOW = [
+    Step("generate_orders", "POST", r"^/workflow/generate-orders$", harvest=True),
+    Step("nearest_pharmacies", "GET", r"^/pharmacies/nearest/\d+$", harvest=True),
+    Step("nearest_labs", "GET", r"^/labs/nearest/\d+$", harvest=True),
+    Step("pharmacy_preferences", "GET", r"^/preferences/pharmacy\?"),
+    Step("lab_preferences", "GET", r"^/preferences/lab\?"),
+    Step("set_pharmacy", "PUT", r"^/prescriptions/\d+/pharmacy$"),
+    Step("set_lab", "PUT", r"^/requisitions/\d+/lab$"),
+    Step("complete_prescription", "POST", r"^/workflow/complete-prescription$"),
+    Step("complete_requisition", "POST", r"^/workflow/complete-requisition$"),
+    Step("fax_prescription", "POST", r"^/prescriptions/\d+/fax$"),
+    Step("fax_requisition", "POST", r"^/requisitions/\d+/fax$"),
+]
+
+
+def build_scenario(name: str, blocks: List[HttpBlock]) -> List[Step]:
+    def find(step: Step) -> Step:
+        for b in blocks:
+            if b.method == step.method and re.search(step.pattern, b.path):
+                step.block = b
+                return step
+        raise ValueError(f"{HTTP_FILE.name} has no request matching {step.method} {step.pattern}")
+
+    seed = [find(Step(s.name, s.method, s.pattern, s.harvest)) for s in PORTAL_FLOW[:1]]
+    if name == "portal":
+        return seed + [find(Step(s.name, s.method, s.pattern, s.harvest)) for s in PORTAL_FLOW[1:]]
+    if name == "catalog":
+        steps = []
+        for b in blocks:
+            if b.starred or b.path.startswith("/workflow"):
+                label = re.sub(r"\d+", "{id}", f"{b.method} {b.path.split('?')[0]}")
+                if b.path.startswith("/workflow") and isinstance(b.body, dict) and "tool" in b.body:
+                    label += f" [{b.body['tool']}]"
+                steps.append(Step(label, b.method, "", harvest=False, block=b))
+        return seed + steps
+    raise ValueError(f"unknown scenario: {name}")
+
+
+@dataclass
+class Stats:
+    latencies: Dict[str, List[float]] = field(default_factory=dict)
+    errors: Dict[str, int] = field(default_factory=dict)
+    flows: int = 0
+    failed_flows: int = 0
+
+    def record(self, step: str, seconds: float, ok: bool) -> None:
+        self.latencies.setdefault(step, []).append(seconds)
+        if not ok:
+            self.errors[step] = self.errors.get(step, 0) + 1
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+async def virtual_user(
+    client: httpx.AsyncClient, steps: List[Step], patient_ids: List[int], rng: random.Random,
+    deadline: float, stats: Stats,
+) -> None:
+    while time.perf_counter() < deadline:
+        ctx: Dict[str, Any] = {"patient_id": rng.choice(patient_ids), "pharmacy_id": 1, "lab_id": 1}
+        flow_ok = True
+        for step in steps:
+            method, path, body = bind(step.block, ctx)
+            t0 = time.perf_counter()
+            try:
+                resp = await client.request(method, path, json=body)
+                ok = resp.status_code < 400
+            except Exception:
+                resp, ok = None, False
+            stats.record(step.name, time.perf_counter() - t0, ok)
+            if not ok:
+                flow_ok = False
+                if step.harvest:
+                    break  # 后续步骤依赖这一步的结果
+                continue
+            if step.harvest:
+                harvest(ctx, resp.json())
+        stats.flows += 1
+        if not flow_ok:
+            stats.failed_flows += 1
+
+
+def seed_tables(rows: int) -> Tuple[InMemoryTransport, List[int]]:
+    tables = {
+        t: make_table(t, rows)
+        for t in ("patients_registration", "diagnosis", "patient_preference", "prescription_form",
+                  "requisition_form", "pharmacy_registration", "lab_registration")
+    }
+    patient_ids = sorted({d["patient_id"] for d in tables["diagnosis"]})
+    return InMemoryTransport(tables), patient_ids
+
+
+async def run_level(app, steps: List[Step], patient_ids: List[int], concurrency: int, duration: float, seed: int) -> Tuple[Stats, float]:
+    stats = Stats()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest/api", timeout=None) as client:
+        start = time.perf_counter()
+        deadline = start + duration
+        await asyncio.gather(*(
+            virtual_user(client, steps, patient_ids, random.Random(seed * 1000 + i), deadline, stats)
+            for i in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+    return stats, elapsed
+
+
+def report(concurrency: int, stats: Stats, elapsed: float) -> Dict[str, Any]:
+    total_requests = sum(len(v) for v in stats.latencies.values())
+    total_errors = sum(stats.errors.values())
+    summary = {
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "flows": stats.flows,
+        "flows_per_s": stats.flows / elapsed if elapsed else 0.0,
+        "requests_per_s": total_requests / elapsed if elapsed else 0.0,
+        "error_rate": total_errors / total_requests if total_requests else 0.0,
+        "steps": {},
+    }
+    print(
+        f"\n== concurrency={concurrency}  flows={stats.flows} ({summary['flows_per_s']:.2f}/s)  "
+        f"requests={total_requests} ({summary['requests_per_s']:.1f}/s)  error_rate={summary['error_rate']:.2%}"
+    )
+    print(f"{'step':<58}{'count':>7}{'err':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, values in stats.latencies.items():
+        values = sorted(values)
+        p50, p95, p99 = (percentile(values, p) for p in (50, 95, 99))
+        errors = stats.errors.get(name, 0)
+        summary["steps"][name] = {"count": len(values), "errors": errors, "p50": p50, "p95": p95, "p99": p99}
+        print(f"{name:<58}{len(values):>7}{errors:>6}{p50 * 1e3:>8.1f}ms{p95 * 1e3:>8.1f}ms{p99 * 1e3:>8.1f}ms")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="in-process end-to-end load test")
+    parser.add_argument("--scenario", choices=("portal", "catalog"), default="portal")
+    parser.add_argument("--levels", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--rows", type=int, default=1000, help="synthetic rows per remote table")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--llm-dist", choices=("fixed", "normal", "lognormal", "uniform"), default="normal")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--llm-failure-modes", default="error", help=f"comma separated subset of {','.join(FAILURE_MODES)}")
+    parser.add_argument("--admission", action="store_true", help="enable /workflow admission control (off by default)")
+    parser.add_argument("--rate-limit-per-min", type=float, default=0.0, help="per-client limit with --admission; 0 = none")
+    parser.add_argument("--llm-max-concurrency", type=int, default=8, help="concurrent workflows with --admission")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="write the summary as JSON")
+    parser.add_argument("--list", action="store_true", help="print the parsed scenario and exit")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's debug prints")
+    args = parser.parse_args()
+
+    steps = build_scenario(args.scenario, parse_http_file())
+    if args.list:
+        for step in steps:
+            print(f"{step.name:<58}{step.block.method:>6} {step.block.path}")
+        return
+
+    # 准入控制的上限由压测显式指定（main 导入时按 settings 安装中间件）
+    from app.config import settings
+
+    settings.admission_enabled = args.admission
+    settings.rate_limit_per_min = args.rate_limit_per_min
+    settings.llm_max_concurrency = args.llm_max_concurrency
+
+    from main import app
+
+    transport, patient_ids = seed_tables(args.rows)
+    install(transport)
+    set_provider(FakeLLMProvider(
+        latency_ms=args.llm_latency_ms,
+        jitter_ms=args.llm_jitter_ms,
+        latency_dist=args.llm_dist,
+        failure_rate=args.llm_failure_rate,
+        failure_modes=args.llm_failure_modes.split(","),
+        seed=args.seed,
+    ))
+
+    summaries = []
+    for level in (int(x) for x in args.levels.split(",") if x):
+        # 工具函数里有大量 [DEBUG] print，压测时默认屏蔽
+        sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with sink:
+            stats, elapsed = asyncio.run(run_level(app, steps, patient_ids, level, args.duration, args.seed))
+        summaries.append(report(level, stats, elapsed))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "scenario": args.scenario,
+            "rows": args.rows,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_jitter_ms": args.llm_jitter_ms,
+            "llm_dist": args.llm_dist,
+            "llm_failure_rate": args.llm_failure_rate,
+            "admission": args.admission,
+            "rate_limit_per_min": args.rate_limit_per_min,
+            "llm_max_concurrency": args.llm_max_concurrency,
+            "levels": summaries,
+        }, indent=2))
+        print(f"\nsaved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+用 LLM cassette 重放一段工作流 trace，对比新旧版本的延迟与输出。
+
+trace 文件为 JSON Lines，每行一个请求：
+    {"method": "POST", "path": "/api/workflow/generate-orders", "body": {"patient_id": 5}}
+没有 method/path 的行会被跳过；也可以用 --from-http 直接取 app/tests/crud.http 中的 /workflow 请求。
+
+典型用法（在仓库根目录）：
+    # 1) 在基线版本上录制：调用 LLM（真实或 fake），写 cassette，并保存每个请求的输出
+    python -m benchmarks.replay --trace trace.jsonl --mode record --llm openai \
+        --cassette llm_cassette.jsonl.gz --out baseline.jsonl
+    # 2) 在新版本上回放：LLM 响应全部来自 cassette，不消耗 token，再与基线逐条对比
+    python -m benchmarks.replay --trace trace.jsonl --mode replay \
+        --cassette llm_cassette.jsonl.gz --out candidate.jsonl --baseline baseline.jsonl
+
+远端表默认使用 benchmarks/fake_remote.py 的合成数据（--rows，结果可复现）；--live-remote 则访问真实远端。
+"""
+import argparse
+import contextlib
+import io
+import json
+import re
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from fastapi.testclient import TestClient
+
+from app import llm_cassette, llm_provider
+from benchmarks.fake_remote import InMemoryTransport, install, make_table
+
+# 每次运行都会变化的字段：新分配的 ID、时间戳
+_VOLATILE_KEYS = {"prescription_id", "requisition_id"}
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?Z?)?")
+
+
+def normalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: ("<id>" if k in _VOLATILE_KEYS else normalize(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [normalize(v) for v in value]
+    if isinstance(value, str):
+        return _DATE.sub("<date>", value)
+    return value
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    items = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if isinstance(entry, dict) and "method" in entry and "path" in entry:
+            items.append(entry)
+    return items
+
+
+def trace_from_http() -> List[Dict[str, Any]]:
+    from benchmarks.loadtest import parse_http_file
+
+    return [
+        {"method": b.method, "path": "/api" + b.path, "body": b.body}
+        for b in parse_http_file() if b.path.startswith("/workflow")
+    ]
+
+
+def run(trace: List[Dict[str, Any]], verbose: bool = False) -> List[Dict[str, Any]]:
+    from main import app
+
+    results = []
+    client = TestClient(app)
+    sink = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with sink:
+        for i, item in enumerate(trace):
+            t0 = time.perf_counter()
+            resp = client.request(item["method"], item["path"], json=item.get("body"))
+            elapsed = time.perf_counter() - t0
+            try:
+                body = resp.json()
+            except ValueError:
+                body = resp.text
+            results.append({
+                "i": i,
+                "method": item["method"],
+                "path": item["path"],
+                "status": resp.status_code,
+                "latency_ms": round(elapsed * 1000, 3),
+                "body": body,
+            })
+    return results
+
+
+def compare(baseline: List[Dict[str, Any]], candidate: List[Dict[str, Any]]) -> int:
+    mismatches = 0
+    for old, new in zip(baseline, candidate):
+        if old["status"] != new["status"] or normalize(old["body"]) != normalize(new["body"]):
+            mismatches += 1
+            print(f"  [diff] #{new['i']} {new['method']} {new['path']}: status {old['status']} -> {new['status']}")
+    if len(baseline) != len(candidate):
+        print(f"  [diff] trace length {len(baseline)} -> {len(candidate)}")
+        mismatches += 1
+    old_lat = [r["latency_ms"] for r in baseline]
+    new_lat = [r["latency_ms"] for r in candidate]
+    if old_lat and new_lat:
+        print(
+            f"latency p50 {statistics.median(old_lat):.1f}ms -> {statistics.median(new_lat):.1f}ms, "
+            f"total {sum(old_lat):.0f}ms -> {sum(new_lat):.0f}ms"
+        )
+    print(f"outputs: {len(candidate) - mismatches}/{len(candidate)} identical (ids and dates ignored)")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replay a workflow trace through the LLM cassette")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--trace", help="JSON Lines file of {method, path, body}")
+    source.add_argument("--from-http", action="store_true", help="use the /workflow requests in app/tests/crud.http")
+    parser.add_argument("--mode", choices=[m for m in llm_cassette.MODES if m != "off"], default="replay")
+    parser.add_argument("--cassette", default="llm_cassette.jsonl.gz")
+    parser.add_argument("--strict", action="store_true", help="replay: require exact fingerprint matches")
+    parser.add_argument("--llm", choices=("fake", "openai"), default="fake", help="provider used when recording")
+    parser.add_argument("--rows", type=int, default=1000, help="synthetic rows per remote table")
+    parser.add_argument("--live-remote", action="store_true", help="use the real remote tables instead of the stub")
+    parser.add_argument("--out", default=None, help="write per-request results as JSON Lines")
+    parser.add_argument("--baseline", default=None, help="compare against a previous --out file")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    trace = trace_from_http() if args.from_http else load_trace(args.trace)
+    if not args.live_remote:
+        install(InMemoryTransport({
+            t: make_table(t, args.rows)
+            for t in ("patients_registration", "diagnosis", "patient_preference", "prescription_form",
+                      "requisition_form", "pharmacy_registration", "lab_registration")
+        }))
+
+    inner = llm_provider.FakeLLMProvider() if args.llm == "fake" else llm_provider.OpenAIProvider()
+    provider = llm_cassette.CassetteProvider(
+        inner, llm_cassette.Cassette(args.cassette), mode=args.mode, strict=args.strict,
+    )
+    llm_provider.set_provider(provider)
+
+    results = run(trace, verbose=args.verbose)
+    errors = sum(1 for r in results if r["status"] >= 400)
+    print(
+        f"{len(results)} requests, {errors} errors, cassette {args.mode}: "
+        f"{provider.hits} hits / {provider.misses} misses ({len(provider.cassette)} recordings)"
+    )
+    if args.out:
+        Path(args.out).write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results), encoding="utf-8")
+        print(f"saved {args.out}")
+    if args.baseline:
+        compare(load_trace(args.baseline), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,144 @@
-import uvicorn
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+
+import anyio.to_thread
+from fastapi import FastAPI, Response
 from starlette.middleware.cors import CORSMiddleware
 
+from app import admission, columnar, crud, documents, fax, idempotency, metrics, records, refresher, remote, resilience, shared_cache, tracing
+from app.config import settings
 from app.routers import router
 
-app = FastAPI(title="eHealth API - Create/Get")
+
+async def _prewarm(tables: list) -> None:
+    try:
+        loaded = await anyio.to_thread.run_sync(crud.prewarm_tables, tables)
+        print(f"[INFO] prewarmed tables: {loaded}")
+    except Exception as e:
+        # 预热失败不影响服务启动，首次请求时会照常加载
+        print(f"[WARN] table prewarm failed: {type(e).__name__}: {e}")
+
+
+def _table_list(value: str) -> list:
+    return [t.strip() for t in value.split(",") if t.strip()]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 远端表快照、OpenAI 客户端、数据库 engine 都是按需创建的；这里只做可选的预热
+    # 多 worker 时各 worker 通过共享存储复用远端表响应体，写入代数也经由它跨进程传播
+    shared_path = settings.shared_cache_path or (shared_cache.default_path() if settings.web_concurrency > 1 else "")
+    if shared_path:
+        remote.client.shared = shared_cache.SharedSnapshotStore(shared_path, ttl=settings.shared_cache_ttl_s)
+    # 大表改用 mmap 列式文件，所有 worker 映射同一份文件
+    columnar_tables = _table_list(settings.columnar_tables)
+    if columnar_tables:
+        remote.client.columnar = columnar.ColumnarStore(settings.columnar_dir or columnar.default_dir(), columnar_tables)
+    # 其余表的快照行改用 __slots__ 记录类
+    if settings.compact_records:
+        remote.client.row_factory = records.compact
+    # 远端变慢 / 故障时：熔断、对冲 GET、有上限的重试，读取失败时返回旧快照
+    if settings.remote_resilience:
+        remote.client.resilience = resilience.Resilience(
+            get_timeout=settings.remote_get_timeout_s,
+            retries=settings.remote_retries,
+            backoff_s=settings.remote_retry_backoff_s,
+            hedge=settings.remote_hedge,
+            failure_threshold=settings.circuit_failure_threshold,
+            reset_timeout_s=settings.circuit_reset_s,
+            lock_wait_s=settings.remote_stale_wait_s,
+        )
+
+    task = None
+    tables = _table_list(settings.prewarm_tables)
+    if tables:
+        if settings.prewarm_blocking:
+            await _prewarm(tables)
+        else:
+            task = asyncio.create_task(_prewarm(tables))
+
+    # 注册类表由后台刷新器加载并定期重新验证（stale-while-revalidate）
+    refresh_tables = _table_list(settings.refresh_tables)
+    if refresh_tables and settings.refresh_interval_s > 0:
+        r = refresher.start(refresh_tables, settings.refresh_interval_s, settings.refresh_jitter_s)
+        if settings.prewarm_blocking:
+            await anyio.to_thread.run_sync(r.wait_ready)
+
+    # 传真队列的发送线程默认在第一次入队时启动；开启时随服务启动，继续发送重启前未完成的任务
+    if settings.fax_dispatch_on_startup:
+        fax.ensure_started()
+    yield
+    if task is not None and not task.done():
+        task.cancel()
+    await anyio.to_thread.run_sync(refresher.stop)
+    await anyio.to_thread.run_sync(fax.stop)
+    documents.shutdown()
+    if remote.client.resilience is not None:
+        remote.client.resilience.shutdown()
+
+
+app = FastAPI(title="eHealth API - Create/Get", lifespan=lifespan)
+# /workflow* 的限速与 LLM 并发上限（超出时 429 + Retry-After）
+if settings.admission_enabled:
+    app.add_middleware(
+        admission.AdmissionMiddleware,
+        path_prefix="/api/workflow",
+        # 客户端令牌桶按 worker 计（keep-alive 连接固定在一个 worker 上，不分摊）；
+        # 全局并发与排队上限是全服务的，每个 worker 只负责自己的份额
+        rate_per_min=settings.rate_limit_per_min,
+        burst=settings.rate_limit_burst,
+        max_concurrency=int(admission.per_worker(settings.llm_max_concurrency, settings.web_concurrency)),
+        max_queue=int(admission.per_worker(settings.admission_max_queue, settings.web_concurrency, minimum=0)),
+        max_wait_s=settings.admission_max_wait_s,
+    )
+# POST 请求的 Idempotency-Key：重复请求直接返回保存的响应（在准入控制之外，重放不占用限额）
+if settings.idempotency_enabled:
+    app.add_middleware(
+        idempotency.IdempotencyMiddleware,
+        path=settings.idempotency_store_path,
+        ttl=settings.idempotency_ttl_s,
+        wait_s=settings.idempotency_wait_s,
+    )
+# 每个请求一个根 span（配置 TRACE_FILE 后生效）
+app.add_middleware(tracing.TracingMiddleware)
+# 按路由记录请求延迟
+app.add_middleware(metrics.MetricsMiddleware)
 # 添加CORS中间件
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173"],
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"],
+    allow_headers=["*"],  # 包括 Idempotency-Key
+    expose_headers=["ETag", "Retry-After", "Idempotent-Replayed"],
 )
 app.include_router(router, prefix="/api")
 
-if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True
+
+# Prometheus 文本格式指标（不在 /api 前缀下，也不出现在 OpenAPI 文档中）
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    return Response(
+        content=metrics.REGISTRY.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
     )
+
+
+if __name__ == "__main__":
+    import uvicorn  # 只在直接运行时需要
+
+    if settings.web_concurrency > 1:
+        # 生产模式：多个 worker 进程（reload 只支持单进程）
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            workers=settings.web_concurrency,
+        )
+    else:
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=settings.reload,
+        )